@@ -10,12 +10,16 @@ from .osi.phy_l1 import capture
 from .osi.phy_l1 import send_raw_pkts
 from .osi.phy_l1 import mitm
 from .osi.phy_l1 import read_pcap
+from .osi.phy_l1 import replay_pcap
 from .osi.phy_l1 import save_pcap
 from .osi.transport_l4 import tcp_client
 from .osi.transport_l4 import tcp_server
 from .osi.transport_l4 import tls_client
 from .osi.transport_l4 import tls_server
 
+from .bench import capture as bench_capture
+from .bench import channels as bench_channels
+
 from .examples import demo_options
 from .examples import demo_info
 from .examples import call_another
@@ -43,6 +47,10 @@ exported_abilities = [
     invert_str.Ability,
     show_str.Ability,
 
+    # benchmarks
+    bench_capture.Ability,
+    bench_channels.Ability,
+
     debug_packets.Ability,
     echo_server.Ability,
     demux.Ability,
@@ -55,6 +63,7 @@ exported_abilities = [
     send_raw_pkts.Ability,
     mitm.Ability,
     read_pcap.Ability,
+    replay_pcap.Ability,
     save_pcap.Ability,
     tcp_client.Ability,
     tcp_server.Ability,
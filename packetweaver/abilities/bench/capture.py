@@ -0,0 +1,127 @@
+import socket
+import struct
+import subprocess
+import threading
+import time
+import packetweaver.core.ns as ns
+import packetweaver.libs.sys.pcap as pcap_lib
+
+
+class Ability(ns.AbilityBase):
+    _option_list = [
+        ns.ChoiceOpt('engine', ['all'] + pcap_lib.CAPTURE_ENGINES,
+                     comment='Capture engine to benchmark'),
+        ns.NumOpt('frames', default=200000,
+                  comment='Number of frames to inject'),
+        ns.NumOpt('frame_size', default=80,
+                  comment='Size of each frame, in bytes'),
+        ns.StrOpt('veth', default='pwbench',
+                  comment='Prefix of the veth pair created for the test'),
+    ]
+
+    _info = ns.AbilityInfo(
+        name='Capture Benchmark',
+        description='Measures the frames/sec and drops of each capture '
+                    'engine on a veth pair',
+        authors=['pw-team', ],
+        tags=[ns.Tag.TCP_STACK_L1, ns.Tag.THREADED],
+    )
+
+    # IEEE 802 local experimental ethertype, ignored by the host stack
+    ETHERTYPE = 0x88b5
+
+    @classmethod
+    def check_preconditions(cls, module_factory):
+        l_dep = []
+        if not ns.HAS_PCAPY and not ns.HAS_AF_PACKET:
+            l_dep.append('No capture engine available: please install '
+                         'pcapy.')
+        l_dep += super(Ability, cls).check_preconditions(module_factory)
+        return l_dep
+
+    def _create_veth(self):
+        tx, rx = self.veth + '0', self.veth + '1'
+        subprocess.check_call(['ip', 'link', 'add', tx, 'type', 'veth',
+                               'peer', 'name', rx])
+        for name in (tx, rx):
+            subprocess.check_call(['ip', 'link', 'set', name, 'up'])
+        return tx, rx
+
+    def _delete_veth(self, tx):
+        subprocess.call(['ip', 'link', 'del', tx])
+
+    @classmethod
+    def _count(cls, inp, counter):
+        ethertype = struct.pack('!H', cls.ETHERTYPE)
+        try:
+            while True:
+                if inp.recv()[12:14] == ethertype:
+                    counter[0] += 1
+                    counter[1] = time.perf_counter()
+        except (IOError, EOFError):
+            pass
+
+    def _run_one(self, engine, tx, rx):
+        """ Injects the frames on tx while capturing them on rx
+
+        :return: the number of frames captured, the elapsed time and the
+            kernel counters of the capture
+        """
+        w, r = ns.DequePipe()
+        counter = [0, None]
+        counting = threading.Thread(target=self._count, args=(r, counter))
+        counting.start()
+        capture_stats = pcap_lib.CaptureStats()
+        thr, stop_evt, _ = pcap_lib.start_capture(rx, None, w, engine,
+                                                  capture_stats)
+        # lets the capture handle be opened before injecting
+        time.sleep(0.5)
+
+        s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        s.bind((tx, 0))
+        frame = (b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01'
+                 + struct.pack('!H', self.ETHERTYPE))
+        frame += b'\x00' * max(0, int(self.frame_size) - len(frame))
+        start = time.perf_counter()
+        for _ in range(int(self.frames)):
+            s.send(frame)
+        s.close()
+
+        # waits for the capture to drain its buffers
+        seen = -1
+        while seen != counter[0]:
+            seen = counter[0]
+            time.sleep(0.5)
+        stop_evt.set()
+        thr.join()
+        w.close()
+        counting.join()
+        if counter[1] is None:
+            return 0, 0, capture_stats.as_dict()
+        return counter[0], counter[1] - start, capture_stats.as_dict()
+
+    def main(self):
+        if self.engine == 'all':
+            engines = pcap_lib.CAPTURE_ENGINES
+        else:
+            engines = [self.engine]
+
+        tx, rx = self._create_veth()
+        try:
+            self._view.delimiter('{} frames of {} bytes on {}'.format(
+                self.frames, self.frame_size, rx))
+            for engine in engines:
+                if pcap_lib.select_capture_engine(engine) != engine:
+                    self._view.warning('{:10s} unavailable'.format(engine))
+                    continue
+                received, elapsed, kernel = self._run_one(engine, tx, rx)
+                rate = received / elapsed if elapsed > 0 else 0
+                self._view.info(
+                    '{:10s} {:>12.0f} frames/s, {} dropped ({} received, {} '
+                    'dropped by the kernel)'.format(
+                        engine, rate, int(self.frames) - received, received,
+                        kernel['dropped'])
+                )
+            self._view.delimiter()
+        finally:
+            self._delete_veth(tx)
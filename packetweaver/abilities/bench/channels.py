@@ -0,0 +1,95 @@
+import multiprocessing
+import threading
+import time
+import packetweaver.core.ns as ns
+
+
+class Ability(ns.AbilityBase):
+    _option_list = [
+        ns.ChoiceOpt('channel', ['all', 'pipe', 'shm_ring', 'deque'],
+                     comment='Channel type to benchmark'),
+        ns.NumOpt('frames', default=200000,
+                  comment='Number of frames to push through the chain'),
+        ns.NumOpt('frame_size', default=80,
+                  comment='Size of each frame, in bytes'),
+        ns.NumOpt('hops', default=4,
+                  comment='Number of links between the source and the sink'),
+    ]
+
+    _info = ns.AbilityInfo(
+        name='Channel Benchmark',
+        description='Measures the frames/sec of each channel type through '
+                    'a chain of relaying threads',
+        authors=['pw-team', ],
+        tags=[ns.Tag.OFFLINE, ns.Tag.THREADED],
+    )
+
+    CHANNELS = {
+        'pipe': multiprocessing.Pipe,
+        'shm_ring': ns.ShmRingPipe,
+        'deque': ns.DequePipe,
+    }
+
+    @staticmethod
+    def _relay(inp, out):
+        try:
+            while True:
+                out.send(inp.recv())
+        except (IOError, EOFError):
+            pass
+        finally:
+            inp.close()
+            out.close()
+
+    @staticmethod
+    def _sink(inp, counter):
+        try:
+            while True:
+                inp.recv()
+                counter[0] += 1
+        except (IOError, EOFError):
+            pass
+        finally:
+            inp.close()
+
+    def _run_one(self, factory):
+        """ Pushes the frames through `hops` links of the given type
+
+        :param factory: a callable returning a (sending end, receiving end)
+        :return: the number of frames received and the elapsed time
+        """
+        links = [factory() for _ in range(int(self.hops))]
+        threads = [
+            threading.Thread(target=self._relay, args=(links[i][1],
+                                                       links[i + 1][0]))
+            for i in range(len(links) - 1)
+        ]
+        counter = [0]
+        threads.append(threading.Thread(target=self._sink,
+                                        args=(links[-1][1], counter)))
+        for t in threads:
+            t.start()
+
+        frame = b'\x00' * int(self.frame_size)
+        src = links[0][0]
+        start = time.perf_counter()
+        for _ in range(int(self.frames)):
+            src.send(frame)
+        src.close()
+        for t in threads:
+            t.join()
+        return counter[0], time.perf_counter() - start
+
+    def main(self):
+        if self.channel == 'all':
+            names = sorted(self.CHANNELS)
+        else:
+            names = [self.channel]
+
+        self._view.delimiter('{} frames of {} bytes, {} hops'.format(
+            self.frames, self.frame_size, self.hops))
+        for name in names:
+            received, elapsed = self._run_one(self.CHANNELS[name])
+            self._view.info('{:10s} {:>12.0f} frames/s ({} received)'.format(
+                name, received / elapsed, received))
+        self._view.delimiter()
@@ -11,8 +11,7 @@ class Ability(ns.ThreadedAbilityBase):
         # always check if we are asked to stop
         while not self.is_stopped():
             try:
-                # setup semi-active polling of piped inputs
-                if self._poll(0.1):
-                    self._view.info("display> {}".format(self._recv()))
+                # blocks until a message arrives; raises EOFError once stopped
+                self._view.info("display> {}".format(self._recv()))
             except (IOError, EOFError):
                 break
@@ -15,7 +15,7 @@ except ImportError:
     HAS_DNSPYTHON = False
 
 
-class Ability(ns.ThreadedAbilityBase):
+class Ability(ns.ProcessAbilityBase):
     _option_list = [
         ns.PathOpt('fake_zone',
                    must_exist=True, readable=True, is_dir=False,
@@ -344,8 +344,7 @@ class Ability(ns.ThreadedAbilityBase):
 
         try:
             while not self.is_stopped():
-                if self._poll(0.05):
-                    s = self._recv()
+                for s in self._recv_many():
                     metadata_len, = struct.unpack('!H', s[:2])
                     metadata = s[2:metadata_len+2]
                     data = s[metadata_len+2:]
@@ -1,4 +1,6 @@
 import packetweaver.core.ns as ns
+import packetweaver.libs.sys.pcap as pcap_lib
+import struct
 
 
 class Ability(ns.ThreadedAbilityBase):
@@ -11,7 +13,21 @@ class Ability(ns.ThreadedAbilityBase):
         ns.PortOpt(ns.OptNames.PORT_DST, optional=True, default=53),
         ns.NICOpt(ns.OptNames.INPUT_INTERFACE),
         ns.NICOpt(ns.OptNames.OUTPUT_INTERFACE, default=None, optional=True),
-        ns.BoolOpt('quiet', default=True)
+        ns.BoolOpt('quiet', default=True),
+        ns.NumOpt('workers', default=1,
+                  comment='Number of DNSProxy Server processes answering '
+                          'the requests'),
+        ns.NumOpt('queue_size', default=1024,
+                  comment='Maximum number of frames queued between two '
+                          'stages of the proxy'),
+        ns.ChoiceOpt('queue_policy', ns.Policy.ALL,
+                     comment='What a stage does when its queue is full. '
+                             'block: wait for room, dropping nothing; '
+                             'drop-newest: drop the incoming frame; '
+                             'drop-oldest: drop the oldest queued frame; '
+                             'sample: once the queue is half full, keep '
+                             'only 1 frame in 10 and drop the others, '
+                             'then drop every frame while it is full'),
     ]
 
     _info = ns.AbilityInfo(
@@ -29,13 +45,32 @@ class Ability(ns.ThreadedAbilityBase):
         ('scapy_unsplitter', 'base', 'DNS Metadata Reverser'),
     ]
 
+    @staticmethod
+    def _flow_key(s):
+        """ Returns the 5-tuple of a split query, parsed from its metadata
+        (Ether to UDP headers), so that the queries of a given flow are
+        handled by the same worker; None if the query is not bytes
+        """
+        if not isinstance(s, (bytes, bytearray)) or len(s) < 2:
+            return None
+        metadata_len, = struct.unpack('!H', s[:2])
+        return pcap_lib.flow_key(s[2:metadata_len + 2])
+
     def main(self):
-        dns_srv_abl = self.get_dependency(
-            'dnsproxysrv',
-            fake_zone=self.fake_zone,
-            policy_zone=self.policy_zone,
-            quiet=self.quiet
-        )
+        dns_srvs = [
+            self.get_dependency(
+                'dnsproxysrv',
+                fake_zone=self.fake_zone,
+                policy_zone=self.policy_zone,
+                quiet=self.quiet
+            )
+            for _ in range(max(1, self.workers))
+        ]
+        if len(dns_srvs) == 1:
+            # no dispatcher is needed in front of a single server
+            dns_srv_abl = dns_srvs[0]
+        else:
+            dns_srv_abl = ns.ReplicatedStage(dns_srvs, key=self._flow_key)
 
         mitm_abl = self.get_dependency('mitm',
                                        interface=self.interface,
@@ -50,8 +85,14 @@ class Ability(ns.ThreadedAbilityBase):
         scapy_dns_metadata_reverser = self.get_dependency('scapy_unsplitter',
                                                           quiet=self.quiet)
 
-        mitm_abl | scapy_dns_metadata_splitter | dns_srv_abl |\
-            scapy_dns_metadata_reverser | mitm_abl
+        # Frames are handed over by reference between the threads of this
+        # process; the links to the DNSProxy Server processes are turned
+        # into shared-memory rings. The queues are bounded so that a fast
+        # capture cannot grow memory without limit.
+        link = ns.Link(ns.DequePipe, capacity=max(1, int(self.queue_size)),
+                       policy=self.queue_policy)
+        mitm_abl | link | scapy_dns_metadata_splitter | link | dns_srv_abl |\
+            link | scapy_dns_metadata_reverser | link | mitm_abl
 
         self._start_wait_and_stop(
             [dns_srv_abl, mitm_abl, scapy_dns_metadata_reverser,
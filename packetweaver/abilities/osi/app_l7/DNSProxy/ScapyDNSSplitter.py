@@ -37,31 +37,29 @@ class Ability(ns.ThreadedAbilityBase):
         l_dep += super(Ability, cls).check_preconditions(module_factory)
         return l_dep
 
-    def main(self):
+    def process(self, s):
+        """ Splits a frame into its metadata and its DNS message
+
+        :param s: the Ether frame
+        :return: the message to send, or None if the frame is dropped
+        """
         try:
-            while not self.is_stopped():
-                if self._poll(0.1):
-                    s = self._recv()
-                    try:
-                        m = l2.Ether(s)
-                        data = str(m[scapy_dns.DNS])
-                        if m.haslayer(scapy_inet.UDP):
-                            m[scapy_inet.UDP].remove_payload()
-                        else:
-                            m[scapy_inet.UDP].remove_payload()
-                        metadata = str(m)
-                        self._send(
-                            '{}{}{}'.format(
-                                struct.pack('!H', len(metadata)),
-                                metadata,
-                                data
-                            )
-                        )
-                    except Exception as e:
-                        if not self.quiet:
-                            self._view.error(
-                                'Unparsable frame. Dropping: ' + str(e)
-                            )
-                            print(s)
-        except (IOError, EOFError):
-            pass
+            m = l2.Ether(s)
+            data = str(m[scapy_dns.DNS])
+            if m.haslayer(scapy_inet.UDP):
+                m[scapy_inet.UDP].remove_payload()
+            else:
+                m[scapy_inet.UDP].remove_payload()
+            metadata = str(m)
+            return '{}{}{}'.format(
+                struct.pack('!H', len(metadata)),
+                metadata,
+                data
+            )
+        except Exception as e:
+            if not self.quiet:
+                self._view.error(
+                    'Unparsable frame. Dropping: ' + str(e)
+                )
+                print(s)
+        return None
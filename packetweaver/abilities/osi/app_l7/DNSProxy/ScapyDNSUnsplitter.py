@@ -53,44 +53,43 @@ class Ability(ns.ThreadedAbilityBase):
 
         return new_msg
 
-    def main(self):
+    def process(self, s):
+        """ Rebuilds a frame from a demux token, metadata and a DNS message
+
+        :param s: the message received from the DNS proxy server
+        :return: the frame to send, or None if the message is dropped
+        """
         try:
-            while not self.is_stopped():
-                if self._poll(0.1):
-                    s = self._recv()
-                    try:
-                        demux_tok, metadata_len = struct.unpack('!cH', s[:3])
-                        metadata = s[3:metadata_len+3]
-                        data = s[metadata_len+3:]
+            demux_tok, metadata_len = struct.unpack('!cH', s[:3])
+            metadata = s[3:metadata_len+3]
+            data = s[metadata_len+3:]
 
-                        parsed_metadata = l2.Ether(metadata)
-                        parsed_data = scapy_dns.DNS(data)
+            parsed_metadata = l2.Ether(metadata)
+            parsed_data = scapy_dns.DNS(data)
 
-                        if demux_tok == '\x00':
-                            forged_metadata = self._forge_scapy_response(
-                                parsed_metadata
-                            )
-                            m = forged_metadata / parsed_data
-                            self._send(demux_tok + str(m))
-                        elif demux_tok == '\xFF':
-                            if parsed_metadata.haslayer(scapy_inet.IP):
-                                del parsed_metadata[scapy_inet.IP].chksum
-                            else:
-                                del parsed_metadata[scapy_inet6.IPv6].chksum
-                            del parsed_metadata[scapy_inet.UDP].chksum
-                            m = parsed_metadata / parsed_data
-                            self._send(demux_tok + str(m))
-                        else:
-                            if not self.quiet:
-                                self._view.error(
-                                    'Invalid demux token: {:x}.'
-                                    ' Dropping.'.format(ord(demux_tok))
-                                )
-                    except Exception as e:
-                        if not self.quiet:
-                            self._view.error(
-                                'Unparsable frame. Dropping: ' + str(e)
-                            )
-                            print(s)
-        except (IOError, EOFError):
-            pass
+            if demux_tok == '\x00':
+                forged_metadata = self._forge_scapy_response(
+                    parsed_metadata
+                )
+                m = forged_metadata / parsed_data
+                return demux_tok + str(m)
+            elif demux_tok == '\xFF':
+                if parsed_metadata.haslayer(scapy_inet.IP):
+                    del parsed_metadata[scapy_inet.IP].chksum
+                else:
+                    del parsed_metadata[scapy_inet6.IPv6].chksum
+                del parsed_metadata[scapy_inet.UDP].chksum
+                m = parsed_metadata / parsed_data
+                return demux_tok + str(m)
+            elif not self.quiet:
+                self._view.error(
+                    'Invalid demux token: {:x}.'
+                    ' Dropping.'.format(ord(demux_tok))
+                )
+        except Exception as e:
+            if not self.quiet:
+                self._view.error(
+                    'Unparsable frame. Dropping: ' + str(e)
+                )
+                print(s)
+        return None
@@ -13,7 +13,7 @@ class Ability(ns.ThreadedAbilityBase):
     def main(self):
         while not self.is_stopped():
             try:
-                if self._poll(0.1):
-                    print(self._recv().encode('hex'))
+                for s in self._recv_many():
+                    print(s.encode('hex'))
             except (IOError, EOFError):
                 break
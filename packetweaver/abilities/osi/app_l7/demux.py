@@ -18,13 +18,15 @@ class Ability(ns.ThreadedAbilityBase):
 
         try:
             while not self.is_stopped():
-                if self._poll(0.1):
-                    s = self._recv()
+                batches = {}
+                for s in self._recv_many():
                     if s[0] in demux:
-                        demux[s[0]].send(s[1:])
+                        batches.setdefault(s[0], []).append(s[1:])
                     elif not quiet:
                         self._view.warning(
                             'Invalid prefix: {0:1s}'.format(s[0])
                         )
+                for prefix, msgs in batches.items():
+                    ns.send_many(demux[prefix], msgs)
         except (IOError, EOFError):
             pass
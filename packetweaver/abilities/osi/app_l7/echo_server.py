@@ -31,8 +31,9 @@ class Ability(ns.ThreadedAbilityBase):
     def main(self):
         while not self._stop_evt.is_set():
             try:
-                if self._poll(0.1):
-                    s = self._recv()
-                    self._send(self.prefix.format(self.client_info) + s)
+                prefix = self.prefix.format(self.client_info)
+                self._send_many(
+                    [prefix + s for s in self._recv_many()]
+                )
             except (IOError, EOFError):
                 self._stop_evt.set()
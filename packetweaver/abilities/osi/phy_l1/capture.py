@@ -9,7 +9,32 @@ class Ability(ns.ThreadedAbilityBase):
                   comment='Filter to apply to received frames'),
         ns.NICOpt(ns.OptNames.INPUT_INTERFACE,
                   default=None,
-                  comment='NIC to sniff on')
+                  comment='NIC to sniff on'),
+        ns.ChoiceOpt('engine', pcap_lib.CAPTURE_ENGINES,
+                     comment='Capture engine; af_packet reads a TPACKET_V3 '
+                             'ring and falls back to pcapy if unsupported'),
+        ns.NumOpt('workers', default=1,
+                  comment='Number of capture threads sharing the frames '
+                          'in a fanout group (af_packet only)'),
+        ns.ChoiceOpt('fanout', pcap_lib.FANOUT_MODES, default='hash',
+                     comment='How frames are spread among the workers; hash '
+                             'keeps each flow on the same worker'),
+        ns.NumOpt('batch', default=1,
+                  comment='Maximum number of frames sent as a single '
+                          'FrameBatch message; 1 sends each frame alone'),
+        ns.NumOpt('batch_timeout', default=10,
+                  comment='Maximum number of milliseconds a frame waits '
+                          'for its batch to be sent'),
+        ns.BoolOpt('metadata', default=False,
+                   comment='Send the capture timestamp, wire length and '
+                           'interface index along with the frames'),
+        ns.NumOpt('snaplen', default=pcap_lib.SNAPLEN,
+                  comment='Maximum number of bytes captured per frame; '
+                          'the wire length of truncated frames is only '
+                          'sent with metadata'),
+        ns.BoolOpt('headers_only', default=False,
+                   comment='Truncate frames right after their transport '
+                           'header'),
     ]
 
     _info = ns.AbilityInfo(
@@ -23,23 +48,92 @@ class Ability(ns.ThreadedAbilityBase):
     @classmethod
     def check_preconditions(cls, module_factory):
         l_dep = []
-        if not ns.HAS_PCAPY:
+        if not ns.HAS_PCAPY and not ns.HAS_AF_PACKET:
             l_dep.append(
                 'Pcapy support missing or broken. '
                 'Please install pcapy or proceed to an update.')
         l_dep += super(Ability, cls).check_preconditions(module_factory)
         return l_dep
 
+    def _use_fanout(self):
+        if self.workers <= 1:
+            return False
+        if (
+            pcap_lib.select_capture_engine(pcap_lib.CAPTURE_ENGINE_AF_PACKET)
+            != pcap_lib.CAPTURE_ENGINE_AF_PACKET
+        ):
+            self._view.warning('Multiple workers require the af_packet '
+                               'engine: using a single worker')
+            return False
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super(Ability, self).__init__(*args, **kwargs)
+        # CaptureStats of the handles feeding the out pipes
+        self._capture_stats = []
+
+    def get_capture_stats(self):
+        """ Returns the kernel counters of the capture, summed over its
+        workers; see pcap.CaptureStats.as_dict
+
+        The counters are those of the capture handle, which may be shared
+        with other abilities capturing the same frames.
+        """
+        return pcap_lib.CaptureStats.merge(self._capture_stats)
+
+    def get_stats(self):
+        ret = super(Ability, self).get_stats()
+        ret['capture'] = self.get_capture_stats()
+        return ret
+
+    def _report_capture_stats(self):
+        self._view.info('Capture on {}: {}'.format(
+            self.interface,
+            pcap_lib.CaptureStats.format(self.get_capture_stats())
+        ))
+
+    def _send_metadata(self):
+        # consumers expect bytes unless metadata was explicitly requested
+        if (
+            not self.metadata
+            and (self.headers_only or self.snaplen < pcap_lib.SNAPLEN)
+        ):
+            self._view.warning('Frames are truncated without metadata: '
+                               'their wire length is lost')
+        return self.metadata
+
     def main(self):
-        l_threads = []
-        for out in self._builtin_out_pipes:
-            thr, cap_stop_evt, _ = pcap_lib.start_capture(
-                self.interface, self.bpf, out
-            )
-            l_threads.append((thr, cap_stop_evt))
+        pipes = list(self._builtin_out_pipes)
+        if len(pipes) == 0:
+            self._wait()
+            return
+
+        if self._use_fanout():
+            # with one out pipe per worker, e.g. one per replica of the next
+            # stage, each worker feeds its own pipe
+            threads, stop_evt, self._capture_stats = \
+                pcap_lib.start_fanout_capture(
+                    self.interface, pipes, self.workers, self.bpf,
+                    self.fanout, self.batch, self.batch_timeout / 1000.0,
+                    self._send_metadata(), self.snaplen, self.headers_only
+                )
+            self._wait()
+            stop_evt.set()
+            for t in threads:
+                t.join()
+            self._report_capture_stats()
+            return
+
+        # a single handle feeds all the out pipes, and is shared with the
+        # other abilities capturing the same frames
+        cap = pcap_lib.subscribe_capture(self.interface, pipes, self.bpf,
+                                         self.engine, self.batch,
+                                         self.batch_timeout / 1000.0,
+                                         self._send_metadata(), self.snaplen,
+                                         self.headers_only)
+        self._capture_stats = [cap.stats]
 
         self._wait()
 
-        for t in l_threads:
-            t[1].set()
-            t[0].join()
+        cap.unsubscribe(pipes)
+        self._report_capture_stats()
@@ -54,6 +54,11 @@ class Ability(ns.ThreadedAbilityBase):
         ns.BoolOpt('quiet',
                    default=True,
                    comment='Whether to log errors.'),
+        ns.BoolOpt('metadata',
+                   default=False,
+                   comment='Whether to report FrameRecords, holding the '
+                           'capture time and the interface each frame came '
+                           'in through, instead of raw frames.'),
     ]
 
     _info = ns.AbilityInfo(
@@ -240,7 +245,8 @@ class Ability(ns.ThreadedAbilityBase):
 
             # Configure the sniffing ability
             sniff_abl = self.get_dependency('capture', bpf=bpf_expr,
-                                            interface=bridge_name)
+                                            interface=bridge_name,
+                                            metadata=self.metadata)
             self._transfer_out(sniff_abl)
             sniff_abl.start()
 
@@ -311,7 +317,8 @@ class Ability(ns.ThreadedAbilityBase):
             # Configure the sniffing ability
             sniff_abl = self.get_dependency('capture',
                                             bpf=bpf_expr,
-                                            interface=self.interface)
+                                            interface=self.interface,
+                                            metadata=self.metadata)
             self._transfer_out(sniff_abl)
             sniff_abl.start()
 
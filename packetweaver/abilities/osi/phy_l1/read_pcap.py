@@ -1,7 +1,8 @@
+import socket
 import packetweaver.core.ns as ns
+import packetweaver.libs.sys.pcap_file as pcap_file
 try:
     import scapy.layers.l2
-    import scapy.utils
     HAS_SCAPY = True
 except ImportError:
     HAS_SCAPY = False
@@ -10,9 +11,16 @@ except ImportError:
 class Ability(ns.ThreadedAbilityBase):
     _option_list = [
         ns.PathOpt(ns.OptNames.PATH_SRC,
-                   comment='Pcap file from which the packets are read',
+                   comment='Pcap or pcapng file from which the packets are '
+                           'read',
                    must_exist=True,
-                   readable=True)
+                   readable=True),
+        ns.BoolOpt('metadata', default=False,
+                   comment='Send the capture timestamp, wire length and, '
+                           'for pcapng files, interface of the frames along '
+                           'with them'),
+        ns.BoolOpt('dissect', default=False,
+                   comment='Send scapy packets instead of raw frames'),
     ]
 
     _info = ns.AbilityInfo(
@@ -23,27 +31,75 @@ class Ability(ns.ThreadedAbilityBase):
         type=ns.AbilityType.COMPONENT
     )
 
+    # maximum number of frames sent in a single _send_many call
+    MAX_BATCH = 256
+
+    def __init__(self, *args, **kwargs):
+        super(Ability, self).__init__(*args, **kwargs)
+        # (ifindex, ifname) of the interfaces of the pcapng file, by
+        # (interface_id, name)
+        self._interfaces = {}
+
+    def _interface(self, itf):
+        """ Returns the ifindex and ifname of the FrameRecords of the frames
+        captured on an interface of the file
+
+        Interfaces that exist on this host get their local index; the other
+        ones get a negative index derived from their identifier in the file,
+        so that they stay distinct when the frames are written again.
+        """
+        if itf is None:
+            return None, None
+        key = (itf.if_id, itf.name)
+        if key not in self._interfaces:
+            ifindex = None
+            if itf.name is not None:
+                try:
+                    ifindex = socket.if_nametoindex(itf.name)
+                except OSError:
+                    pass
+            if ifindex is None:
+                used = {i for i, _ in self._interfaces.values()}
+                ifindex = -(itf.if_id + 1)
+                while ifindex in used:
+                    ifindex -= 1
+            self._interfaces[key] = (ifindex, itf.name)
+        return self._interfaces[key]
+
+    def _to_msg(self, ts_ns, wirelen, data, itf):
+        if self.dissect:
+            pkt = scapy.layers.l2.Ether(bytes(data))
+            if ts_ns is not None:
+                pkt.time = ts_ns / 1e9
+            pkt.wirelen = wirelen
+            return pkt
+        if self.metadata:
+            ifindex, ifname = self._interface(itf)
+            return ns.FrameRecord(bytes(data), ts_ns, wirelen, ifindex,
+                                  ifname)
+        return bytes(data)
+
     def main(self):
         if self.path_src is None:
             self._view.error('Missing filename')
             return
+        if self.dissect and not HAS_SCAPY:
+            self._view.error('Scapy support missing or broken: cannot '
+                             'dissect the frames')
+            return
 
-        pcaprd = scapy.utils.PcapReader(self.path_src)
-
-        p = True
-        while p:
-            p = pcaprd.read_packet(size=65535)
-            if p:
-                try:
-                    self._send(str(p))
-                except (IOError, EOFError):
-                    break
-        pcaprd.close()
-
-    @classmethod
-    def check_preconditions(cls, module_factory):
-        l_dep = []
-        if not HAS_SCAPY:
-            l_dep.append('Scapy support missing or broken.')
-        l_dep += super(Ability, cls).check_preconditions(module_factory)
-        return l_dep
+        try:
+            with pcap_file.PcapReader(self.path_src) as reader:
+                msgs = []
+                for ts_ns, _, wirelen, data, itf in reader.records(True):
+                    msgs.append(self._to_msg(ts_ns, wirelen, data, itf))
+                    if len(msgs) >= self.MAX_BATCH:
+                        self._send_many(msgs)
+                        msgs = []
+                        if self._is_stop_requested():
+                            return
+                self._send_many(msgs)
+        except (IOError, EOFError):
+            pass
+        except ValueError as e:
+            self._view.error(str(e))
@@ -0,0 +1,94 @@
+import time
+import packetweaver.core.ns as ns
+import packetweaver.libs.sys.pacing as pacing
+import packetweaver.libs.sys.pcap_file as pcap_file
+
+
+class Ability(ns.ThreadedAbilityBase):
+    _option_list = [
+        ns.PathOpt(ns.OptNames.PATH_SRC,
+                   comment='Pcap file from which the frames are replayed',
+                   must_exist=True,
+                   readable=True),
+        ns.NumOpt('speed', default=1,
+                  comment='Replay speed factor, e.g. 0.5 or 10; 0 to send '
+                          'the frames as fast as possible'),
+        ns.NumOpt('loops', default=1,
+                  comment='Number of times the file is replayed; 0 to '
+                          'replay it until stopped'),
+    ]
+
+    _info = ns.AbilityInfo(
+        name='Replay Pcap',
+        description='Sends the frames of a PCAP at their original pace, '
+                    'or faster',
+        authors=['pw-team', ],
+        tags=[ns.Tag.TCP_STACK_L1],
+        type=ns.AbilityType.COMPONENT
+    )
+
+    # maximum number of frames sent in a single _send_many call
+    MAX_BATCH = 256
+
+    def __init__(self, *args, **kwargs):
+        super(Ability, self).__init__(*args, **kwargs)
+        self._pacer = None
+
+    def get_stats(self):
+        ret = super(Ability, self).get_stats()
+        if self._pacer is not None:
+            ret['pacing'] = self._pacer.stats()
+        return ret
+
+    def _flush(self, frames):
+        # the pacer sets no limit; it only measures the achieved rates
+        for chunk in self._pacer.pace(frames):
+            self._send_many(chunk)
+        del frames[:]
+
+    def _replay_once(self):
+        """ Sends the frames of the file once
+
+        :return: False if the ability was stopped during the replay
+        """
+        frames = []
+        start = None
+        first_ts = None
+        for ts_ns, _, _, data in pcap_file.iter_pcap(self.path_src):
+            # frames without a timestamp, such as those of pcapng Simple
+            # Packet Blocks, are sent right after the previous one
+            if self.speed > 0 and ts_ns is not None:
+                if start is None:
+                    start, first_ts = time.perf_counter(), ts_ns
+                deadline = start + (ts_ns - first_ts) / 1e9 / self.speed
+                if deadline > time.perf_counter():
+                    self._flush(frames)
+                    if not pacing.wait_until(deadline, self._stop_wakeup):
+                        return False
+            frames.append(bytes(data))
+            if len(frames) >= self.MAX_BATCH:
+                self._flush(frames)
+                if self._is_stop_requested():
+                    return False
+        self._flush(frames)
+        return not self._is_stop_requested()
+
+    def main(self):
+        if self.path_src is None:
+            self._view.error('Missing filename')
+            return
+
+        self._pacer = pacing.Pacer()
+        loop = 0
+        try:
+            while self.loops <= 0 or loop < self.loops:
+                if not self._replay_once():
+                    break
+                loop += 1
+        except (IOError, EOFError):
+            pass
+        except ValueError as e:
+            self._view.error(str(e))
+            return
+        self._view.info('Replayed {}: {}'.format(
+            self.path_src, pacing.Pacer.format(self._pacer.stats())))
@@ -1,18 +1,39 @@
 import packetweaver.core.ns as ns
-try:
-    import scapy.layers.l2
-    import scapy.utils
-    HAS_SCAPY = True
-except ImportError:
-    HAS_SCAPY = False
+import packetweaver.libs.sys.pcap_file as pcap_file
 
 
 class Ability(ns.ThreadedAbilityBase):
     _option_list = [
         ns.PathOpt(ns.OptNames.PATH_DST,
                    default=None,
-                   comment='File to write the pcap to',
-                   must_exist=False, optional=True)
+                   comment='File to write the pcap to; with rotation, '
+                           '{index} and strftime directives are replaced '
+                           'in its name',
+                   must_exist=False, optional=True),
+        ns.NumOpt('buffer_size', default=1024,
+                  comment='Number of KiB of records buffered before being '
+                          'written'),
+        ns.NumOpt('flush_interval', default=1000,
+                  comment='Maximum number of milliseconds records stay in '
+                          'the buffer'),
+        ns.ChoiceOpt('format', ['pcap', 'pcapng'],
+                     comment='File format; pcapng records the interface of '
+                             'each frame when it is known'),
+        ns.BoolOpt('nanoseconds', default=False,
+                   comment='Write pcap timestamps with a nanosecond '
+                           'resolution instead of a microsecond one; pcapng '
+                           'always uses nanoseconds'),
+        ns.NumOpt('rotate_size', default=0,
+                  comment='Maximum size of a file, in MiB; 0 for no limit'),
+        ns.NumOpt('rotate_interval', default=0,
+                  comment='Maximum number of seconds covered by a file; 0 '
+                          'for no limit'),
+        ns.NumOpt('rotate_packets', default=0,
+                  comment='Maximum number of frames in a file; 0 for no '
+                          'limit'),
+        ns.ChoiceOpt('compress', ['none'] + sorted(pcap_file.COMPRESSORS),
+                     comment='Compression of the completed files, done in '
+                             'the background'),
     ]
 
     _info = ns.AbilityInfo(
@@ -28,26 +49,39 @@ class Ability(ns.ThreadedAbilityBase):
             self._view.error('Missing filename')
             return
 
-        pcapwr = scapy.utils.PcapWriter(self.path_dst)
+        # frames are written as they were received, stamped with their
+        # capture time and wire length when they are known; the files are
+        # written by another thread, so that the receive loop never waits
+        # for the disk
+        pcapwr = pcap_file.RotatingPcapWriter(
+            self.path_dst,
+            max_bytes=int(self.rotate_size * (1 << 20)),
+            max_seconds=self.rotate_interval,
+            max_packets=int(self.rotate_packets),
+            compress=None if self.compress == 'none' else self.compress,
+            nanoseconds=self.nanoseconds,
+            pcapng=self.format == 'pcapng',
+            buffer_size=int(self.buffer_size) * 1024,
+            flush_interval=self.flush_interval / 1000.0
+        )
 
         try:
             while not self.is_stopped():
-                if self._poll(0.1):
-                    s = self._recv()
-                    if s:
-                        p = scapy.layers.l2.Ether(s)
-                        pcapwr.write(p)
+                msgs = self._recv_many(timeout=pcapwr.flush_interval)
+                for rec in ns.iter_records(msgs):
+                    data = rec.data
+                    if not data:
+                        continue
+                    if not isinstance(data, (bytes, bytearray, memoryview)):
+                        # e.g. a scapy packet
+                        data = bytes(data)
+                    pcapwr.write(data, rec.ts_ns, rec.wirelen, rec.ifindex,
+                                 rec.ifname)
+                pcapwr.tick()
         except (IOError, EOFError):
             pass
 
         pcapwr.close()
-
-    @classmethod
-    def check_preconditions(cls, module_factory):
-        l_dep = []
-        if not HAS_SCAPY:
-            l_dep.append(
-                'Scapy support missing or broken. '
-                'Please install it or proceed to an update.')
-        l_dep += super(Ability, cls).check_preconditions(module_factory)
-        return l_dep
+        if pcapwr.dropped > 0:
+            self._view.warning('{} frames dropped: the disk could not keep '
+                               'up'.format(pcapwr.dropped))
@@ -1,10 +1,26 @@
 import packetweaver.core.ns as ns
+import packetweaver.libs.sys.pacing as pacing
 import packetweaver.libs.sys.pcap as pcap_lib
 
 
 class Ability(ns.ThreadedAbilityBase):
     _option_list = [
-        ns.NICOpt(ns.OptNames.OUTPUT_INTERFACE, None, 'NIC to send traffic on')
+        ns.NICOpt(ns.OptNames.OUTPUT_INTERFACE, None,
+                  'NIC to send traffic on'),
+        ns.ChoiceOpt('engine', pcap_lib.CAPTURE_ENGINES,
+                     default=pcap_lib.CAPTURE_ENGINE_AF_PACKET,
+                     comment='Send engine; af_packet sends all the queued '
+                             'frames with a TX ring and falls back to pcapy '
+                             'if unsupported'),
+        ns.NumOpt('pps', default=0,
+                  comment='Maximum number of frames sent per second; 0 for '
+                          'no limit'),
+        ns.NumOpt('bps', default=0,
+                  comment='Maximum number of bits of frames sent per '
+                          'second; 0 for no limit'),
+        ns.NumOpt('burst', default=1,
+                  comment='Maximum number of frames sent back to back when '
+                          'a rate is set'),
     ]
 
     _info = ns.AbilityInfo(
@@ -19,17 +35,35 @@ class Ability(ns.ThreadedAbilityBase):
     @classmethod
     def check_preconditions(cls, module_factory):
         l_dep = []
-        if not ns.HAS_PCAPY:
+        if not ns.HAS_PCAPY and not ns.HAS_AF_PACKET:
             l_dep.append('Pcapy support missing or broken. '
                          'Please install pcapy or proceed to an update.')
         l_dep += super(Ability, cls).check_preconditions(module_factory)
         return l_dep
 
+    def __init__(self, *args, **kwargs):
+        super(Ability, self).__init__(*args, **kwargs)
+        self._pacer = None
+
+    def get_stats(self):
+        ret = super(Ability, self).get_stats()
+        if self._pacer is not None:
+            ret['pacing'] = self._pacer.stats()
+        return ret
+
     def main(self):
-        thr, stop_evt = pcap_lib.send_raw_traffic(self.outerface, self._poll,
-                                                  self._recv)
+        self._pacer = pacing.Pacer(self.pps, self.bps, self.burst)
+
+        # self._recv and self._recv_many block until a frame arrives;
+        # self._recv raises once stopped
+        thr, stop_evt = pcap_lib.send_raw_traffic(
+            self.outerface, None, self._recv, self.engine, self._recv_many,
+            self._pacer
+        )
 
         self._wait()
 
         stop_evt.set()
         thr.join()
+        self._view.info('Sent on {}: {}'.format(
+            self.outerface, pacing.Pacer.format(self._pacer.stats())))
@@ -0,0 +1,45 @@
+import struct
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.libs.sys.pcap_file as pcap_file
+from packetweaver.abilities.osi.phy_l1 import replay_pcap
+
+
+def pcapng_block(btype, body):
+    body += b'\x00' * (-len(body) % 4)
+    blen = len(body) + 12
+    return struct.pack('<II', btype, blen) + body + struct.pack('<I', blen)
+
+
+class TestReplayPcap:
+    def replay(self, path, speed):
+        abl = replay_pcap.Ability(None, {})
+        abl.set_opt('path_src', path)
+        abl.set_opt('speed', speed)
+        w, r = channel.DequePipe()
+        abl.add_out_pipe(w)
+        abl.main()
+        out = []
+        r.recv_many(out)
+        return out
+
+    def test_simple_packet_blocks(self, tmp_path):
+        # no timestamp: the frames are sent at once, whatever the speed
+        path = str(tmp_path / 'spb.pcapng')
+        data = pcapng_block(pcap_file.PCAPNG_SHB, struct.pack(
+            '<IHHq', pcap_file.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+        data += pcapng_block(pcap_file.PCAPNG_IDB,
+                             struct.pack('<HHIHH', 1, 0, 0, 0, 0))
+        frames = [b'frame%d' % i for i in range(3)]
+        for frame in frames:
+            data += pcapng_block(pcap_file.PCAPNG_SPB,
+                                 struct.pack('<I', len(frame)) + frame)
+        with open(path, 'wb') as f:
+            f.write(data)
+        assert self.replay(path, 1) == frames
+
+    def test_pace(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        with pcap_file.PcapWriter(path, pcapng=True) as writer:
+            writer.write(b'a', 1000000000)
+            writer.write(b'b', 1020000000)
+        assert self.replay(path, 1) == [b'a', b'b']
@@ -34,13 +34,13 @@ class Ability(ns.ThreadedAbilityBase):
     )
 
     @staticmethod
-    def _forward_outgoing(sock, stop_evt, poller, receiver):
+    def _forward_outgoing(sock, stop_evt, receiver):
         while not stop_evt.is_set():
-            if poller(0.1):
-                try:
-                    s = receiver()
-                except EOFError:
-                    break
+            try:
+                s = receiver()
+            except (IOError, EOFError):
+                break
+            if s is not None:
                 sock.send(str(s))
 
     @staticmethod
@@ -81,7 +81,7 @@ class Ability(ns.ThreadedAbilityBase):
         stop_evt = threading.Event()
 
         out_thr = threading.Thread(target=self._forward_outgoing,
-                                   args=(s, stop_evt, self._poll, self._recv))
+                                   args=(s, stop_evt, self._recv))
         out_thr.start()
 
         in_thr = threading.Thread(target=self._forward_incoming,
@@ -11,6 +11,8 @@ import packetweaver.core.controllers.shell_ctrl as shell_ctrl
 import packetweaver.core.models.app_model as app_model
 import packetweaver.core.models.abilities.threaded_ability_base as \
     threaded_ability
+import packetweaver.core.models.abilities.process_ability_base as \
+    process_ability
 import packetweaver.core.models.modules.module_factory as module_factory
 import packetweaver.core.views.text as output
 
@@ -113,6 +115,16 @@ class AppCtrl(ctrl.Ctrl):
         self._ctrl.execute()
 
     def post_process(self):
+        # child processes are not listed by threading.enumerate()
+        for abl in process_ability.ProcessAbilityBase.running_instances():
+            self._view.warning(
+                'Stopping the [{}] process'.format(abl._info.get_name())
+            )
+            abl.stop()
+            abl.join(1)
+            if abl.is_alive():
+                abl.terminate()
+
         for i in range(12):
             l_remain_thread = threading.enumerate()
             # Is the main thread the only thread remaining?
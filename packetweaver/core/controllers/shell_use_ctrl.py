@@ -4,6 +4,7 @@ import pipes
 import sys
 import logging
 import readline
+import threading
 import traceback
 import packetweaver.libs.sys.path_handling as path_ha
 import packetweaver.core.views.text as output
@@ -11,6 +12,9 @@ import packetweaver.core.controllers.exceptions as ex
 import packetweaver.core.models.modules.module_option as module_option
 import packetweaver.core.controllers.ctrl as ctrl
 import packetweaver.core.controllers.kbd_exception as kbd_exception
+import packetweaver.core.models.abilities.stats as stats
+import packetweaver.libs.sys.pacing as pacing
+import packetweaver.libs.sys.pcap as pcap
 import configparser as config_parser
 
 
@@ -42,6 +46,10 @@ class ShellUseCtrl(cmd.Cmd, ctrl.Ctrl):
         self._module_factory = module_factory
         self._set_new_module_inst()
         self._view = view
+        # ability started with "run bg", and the thread running it if the
+        # ability is not a thread itself
+        self._bg_inst = None
+        self._bg_thread = None
 
     def _set_new_module_inst(self, cur_mod_inst=None):
         new_mod_inst = self._module.get_ability_instance_by_name(
@@ -126,8 +134,130 @@ class ShellUseCtrl(cmd.Cmd, ctrl.Ctrl):
         Execute an ability using the current option values.
 
         Its content is automatically reloaded.
+
+        With the "bg" argument, the ability runs in the background and the
+        shell remains available: the "stats" command displays the counters
+        of the running pipeline, and the "stop" command stops it.
+
+        Example:
+            > run bg
+        """
+        if s == 'bg':
+            self.run_background()
+        else:
+            self.run(s)
+
+    def complete_run(self, text, _line, begidx, endidx):
+        return [i for i in ('bg',) if i.startswith(text)]
+
+    def _is_bg_running(self):
+        if self._bg_inst is None:
+            return False
+        if self._bg_thread is not None:
+            return self._bg_thread.is_alive()
+        return not self._bg_inst.is_stopped()
+
+    def run_background(self):
+        """ Method called by the do_run method to run in the background """
+        if self._is_bg_running():
+            self._view.error(
+                'An ability is already running in the background; '
+                'use the "stop" command first'
+            )
+            return
+        self._set_new_module_inst(self._module_inst)
+        self._bg_inst = self._module_inst
+        self._bg_thread = None
+        if isinstance(self._bg_inst, threading.Thread):
+            self._bg_inst.start()
+        else:
+            # plain abilities run their main method in start()
+            self._bg_thread = threading.Thread(target=self._bg_inst.start)
+            self._bg_thread.daemon = True
+            self._bg_thread.start()
+        self._view.info('[{}] running in the background'.format(
+            self._bg_inst.get_name())
+        )
+        # keeps the options for the next run, with a fresh instance
+        self._set_new_module_inst(self._module_inst)
+
+    def do_stop(self, s=''):
+        """
+        Stop the ability started with "run bg"
         """
-        self.run(s)
+        if not self._is_bg_running():
+            self._view.warning('No ability is running in the background')
+            return
+        self._bg_inst.stop()
+        try:
+            if self._bg_thread is not None:
+                self._bg_thread.join()
+            else:
+                while not self._bg_inst.is_stopped():
+                    self._bg_inst.join(0.1)
+                self._bg_inst.join(0.1)
+        except kbd_exception.CtrlC:
+            self._view.warning('Stop interrupted')
+            return
+        ret = self._bg_inst.result()
+        if ret is not None:
+            self._view.success(str(ret))
+
+    def do_stats(self, s=''):
+        """
+        Display the counters of the ability started with "run bg", and of
+        the abilities it instantiated: number of messages and bytes read
+        and written, time spent waiting for input and output, sampled
+        per-message processing time, latency since the capture of the
+        frames when known, kernel counters of the captures, achieved rates
+        of the raw senders, and depth and drops of the pipes.
+        """
+        if self._bg_inst is None:
+            self._view.warning('No ability was run in the background')
+            return
+        self._view.delimiter('Statistics')
+        for entry in self._bg_inst.get_pipeline_stats():
+            indent = '  ' * entry['level']
+            if 'msgs_in' not in entry:
+                self._view.info('{}[{}]'.format(indent, entry['name']))
+                continue
+            self._view.info(
+                '{}[{}] in: {} msgs, {} B; out: {} msgs, {} B; '
+                'recv wait: {:.3f}s; send wait: {:.3f}s; '
+                'processing p50/p99: {}/{}'.format(
+                    indent, entry['name'],
+                    entry['msgs_in'], entry['bytes_in'],
+                    entry['msgs_out'], entry['bytes_out'],
+                    entry['recv_wait'], entry['send_wait'],
+                    stats.format_duration(entry['processing']['p50']),
+                    stats.format_duration(entry['processing']['p99'])
+                )
+            )
+            if 'capture' in entry:
+                self._view.info('{}  capture: {}'.format(
+                    indent, pcap.CaptureStats.format(entry['capture'])))
+            if 'pacing' in entry:
+                self._view.info('{}  sent: {}'.format(
+                    indent, pacing.Pacer.format(entry['pacing'])))
+            if entry['latency']['samples'] > 0:
+                self._view.info(
+                    '{}  capture latency p50/p99: {}/{}'.format(
+                        indent,
+                        stats.format_duration(entry['latency']['p50']),
+                        stats.format_duration(entry['latency']['p99'])
+                    )
+                )
+            for direction in ('in', 'out'):
+                for pipe in entry['{}_pipes'.format(direction)]:
+                    if pipe['depth'] is None:
+                        continue
+                    self._view.info(
+                        '{}  {} pipe ({}): depth {}, drops {}'.format(
+                            indent, direction, pipe['type'],
+                            pipe['depth'], pipe['drops']
+                        )
+                    )
+        self._view.delimiter()
 
     def run(self, s=''):
         """ Method called by the do_run method """
@@ -3,6 +3,7 @@ import logging
 import collections
 import copy
 import inspect
+import weakref
 import packetweaver.core.models.abilities.ability_dependency
 import packetweaver.core.models.abilities.ability_info as ability_info
 import packetweaver.core.models.modules.module_factory
@@ -122,6 +123,10 @@ class AbilityBase(object):
         self._ret_value = None
         self._alive = True
         self._started_status = False
+        # weak references to the instances returned by get_dependency, for
+        # get_pipeline_stats; the instances are not kept alive by their
+        # parent
+        self._dependency_instances = []
         self._set_default_opts(default_opts)
         self.logger = logging.getLogger(__name__)
 
@@ -338,9 +343,42 @@ class AbilityBase(object):
         return ability
 
     def get_dependency(self, name, params={}, **kwargs):
-        return type(self).cls_get_dependency(
+        ability = type(self).cls_get_dependency(
             name, self._module_factory, params, **kwargs
         )
+        self._track_dependency(ability)
+        return ability
+
+    def _track_dependency(self, ability):
+        """ Records a dependency instance for get_pipeline_stats, and forgets
+        those that were garbage-collected
+        """
+        self._dependency_instances = [
+            ref for ref in self._dependency_instances if ref() is not None
+        ]
+        self._dependency_instances.append(weakref.ref(ability))
+
+    def get_pipeline_stats(self):
+        """ Returns the counters of this ability and, recursively, of the
+        abilities it instantiated with get_dependency
+
+        :return: a list of dicts, in depth-first order; each dict contains
+            the name of the ability and its level in the dependency tree,
+            along with the counters returned by its get_stats method, if any
+        """
+        ret = []
+        stack = [(self, 0)]
+        while len(stack) > 0:
+            ability, level = stack.pop()
+            if hasattr(ability, 'get_stats'):
+                entry = ability.get_stats()
+            else:
+                entry = {'name': ability._info.get_name()}
+            entry['level'] = level
+            ret.append(entry)
+            deps = (ref() for ref in reversed(ability._dependency_instances))
+            stack.extend((dep, level + 1) for dep in deps if dep is not None)
+        return ret
 
     def get_opt(self, name, interpreted=True, bypass_cache=False):
         """
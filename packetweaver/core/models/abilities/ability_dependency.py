@@ -16,6 +16,7 @@ classic_dependencies = {
     'echo': AbilityDependency('base', 'Echo Server'),
     'pcapwriter': AbilityDependency('base', 'Save to Pcap'),
     'pcapreader': AbilityDependency('base', 'Read from Pcap'),
+    'pcapreplay': AbilityDependency('base', 'Replay Pcap'),
     'demux': AbilityDependency('base', 'Demux'),
 }
 
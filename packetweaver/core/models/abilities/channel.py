@@ -0,0 +1,1013 @@
+import collections
+import mmap
+import multiprocessing
+import multiprocessing.reduction
+import os
+import pickle
+import select
+import struct
+import threading
+
+
+class Wakeup(object):
+    """ Selectable flag used to wake up a reader blocked in select()
+
+    An eventfd is used whenever the platform provides one; a plain pipe is
+    used otherwise. The flag is level-triggered: its file descriptor is
+    readable between a call to set() and the following call to clear().
+    """
+
+    def __init__(self):
+        self._closed = False
+        if hasattr(os, 'eventfd'):
+            self._rfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._wfd = self._rfd
+            self._token = struct.pack('=Q', 1)
+        else:
+            self._rfd, self._wfd = os.pipe()
+            os.set_blocking(self._rfd, False)
+            self._token = b'\x01'
+
+    def fileno(self):
+        return self._rfd
+
+    def set(self):
+        try:
+            os.write(self._wfd, self._token)
+        except BlockingIOError:
+            # the flag is already set (pipe full or eventfd counter maxed)
+            pass
+
+    def clear(self):
+        try:
+            while os.read(self._rfd, 4096):
+                if self._rfd == self._wfd:
+                    break
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout=None):
+        r, _, _ = select.select([self._rfd], [], [], timeout)
+        return len(r) > 0
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for fd in {self._rfd, self._wfd}:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __del__(self):
+        self.close()
+
+
+class Policy(object):
+    """ Defines what a bounded channel does when it is full
+
+    BLOCK: the sender waits until the receiver makes room
+    DROP_NEWEST: the message being sent is dropped
+    DROP_OLDEST: the oldest queued messages are dropped to make room
+    SAMPLE: once the channel is half full, only one message out of
+        sample_rate is accepted; messages are dropped when it is full
+    """
+    BLOCK = 'block'
+    DROP_NEWEST = 'drop-newest'
+    DROP_OLDEST = 'drop-oldest'
+    SAMPLE = 'sample'
+
+    ALL = [BLOCK, DROP_NEWEST, DROP_OLDEST, SAMPLE]
+
+
+class MessageTooLarge(IOError):
+    """ Raised when a message can never fit in a channel whose policy is
+    Policy.BLOCK; with the other policies, such messages are dropped
+    """
+
+
+class SendInterrupted(IOError):
+    """ Raised when a send blocked on a full channel is interrupted by the
+    stop wakeup of the writer; see _Connection.set_stop_wakeup
+    """
+
+
+class _Verdict(object):
+    """ Outcome of the admission of a message in a bounded channel """
+    WRITE, DROP, EVICT, WAIT = range(4)
+
+
+class _Bounded(object):
+    """ Admission logic shared by the bounded queues of this module """
+
+    def _init_policy(self, capacity, policy, sample_rate):
+        self._sampled = 0
+        self.configure(capacity, policy, sample_rate)
+
+    def configure(self, capacity=None, policy=None, sample_rate=None):
+        """ Changes the bound and the policy of this queue
+
+        :param capacity: the new bound, or None to keep the current one
+        :param policy: one of the Policy values, or None to keep it
+        :param sample_rate: with Policy.SAMPLE, one message out of
+            sample_rate is accepted once the queue is half full
+        """
+        if policy is not None:
+            if policy not in Policy.ALL:
+                raise ValueError('Unknown policy: {}'.format(policy))
+            self.policy = policy
+        if sample_rate is not None:
+            if sample_rate < 1:
+                raise ValueError('Invalid sample rate: {}'.format(
+                    sample_rate))
+            self.sample_rate = sample_rate
+        if capacity is not None:
+            self._set_limit(capacity)
+
+    def _admit(self, size, fill):
+        """ Decides what to do with a message
+
+        :param size: the size of the message, in units of the bound
+        :param fill: the current fill level, in units of the bound
+        :return: a _Verdict value
+        """
+        if self.policy == Policy.SAMPLE and fill * 2 >= self.limit:
+            self._sampled += 1
+            if self._sampled % self.sample_rate != 0:
+                return _Verdict.DROP
+        if self.limit - fill >= size:
+            return _Verdict.WRITE
+        if self.policy == Policy.BLOCK:
+            return _Verdict.WAIT
+        if self.policy == Policy.DROP_OLDEST:
+            return _Verdict.EVICT
+        return _Verdict.DROP
+
+
+class _ShmRing(_Bounded):
+    """ Preallocated shared-memory ring of length-prefixed byte records
+
+    The ring lives in an anonymous shared mapping, so it survives a fork()
+    and may be shared by threads as well as by child processes. Each record
+    is a 4-byte length, a 1-byte kind and the payload. Offsets stored in the
+    header are monotonic byte counters; their difference is the fill level.
+
+    The data wakeup flag is set only when the ring goes from empty to
+    non-empty, and cleared when the reader empties it, so a burst of records
+    costs no syscall beyond the first one.
+
+    The bound of the ring is expressed in bytes; it may be lowered below
+    the allocated size with configure().
+    """
+    _HDR_SIZE = 64
+    _REC = struct.Struct('=IB')
+    _HEAD, _TAIL, _DROPS, _COUNT, _MSGS_IN, _MSGS_OUT = range(6)
+    _W_CLOSED, _R_CLOSED, _W_WAITING = 0, 1, 2
+
+    KIND_RAW = 0
+    KIND_PICKLE = 1
+
+    def __init__(self, capacity, policy=Policy.BLOCK, sample_rate=10):
+        if capacity <= self._REC.size:
+            raise ValueError('Ring capacity is too small: {}'.format(capacity))
+        self.capacity = capacity
+        self._map = mmap.mmap(-1, self._HDR_SIZE + capacity)
+        # typed views on the header avoid a struct call per counter access
+        self._ctr = memoryview(self._map)[:48].cast('Q')
+        self._flags = memoryview(self._map)[48:self._HDR_SIZE]
+        self._data = memoryview(self._map)[self._HDR_SIZE:]
+        self._lock = multiprocessing.Lock()
+        self._data_evt = Wakeup()
+        self._space_evt = Wakeup()
+        self._init_policy(capacity, policy, sample_rate)
+
+    def _set_limit(self, capacity):
+        if capacity > self.capacity or capacity <= self._REC.size:
+            raise ValueError(
+                'Ring bound must be between {} and {} bytes'.format(
+                    self._REC.size + 1, self.capacity)
+            )
+        self.limit = capacity
+
+    def _copy_in(self, pos, data):
+        start = pos % self.capacity
+        end = start + len(data)
+        if end <= self.capacity:
+            self._data[start:end] = data
+        else:
+            first = self.capacity - start
+            self._data[start:] = data[:first]
+            self._data[:end - self.capacity] = data[first:]
+
+    def _copy_out(self, pos, n):
+        start = pos % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            return self._data[start:end].tobytes()
+        return (self._data[start:].tobytes()
+                + self._data[:end - self.capacity].tobytes())
+
+    def fill(self):
+        return self._ctr[self._HEAD] - self._ctr[self._TAIL]
+
+    def is_empty(self):
+        return self._ctr[self._HEAD] == self._ctr[self._TAIL]
+
+    @property
+    def drops(self):
+        return self._ctr[self._DROPS]
+
+    def writer_closed(self):
+        return self._flags[self._W_CLOSED] == 1
+
+    def reader_closed(self):
+        return self._flags[self._R_CLOSED] == 1
+
+    def _evict(self, head, tail, size):
+        """ Drops the oldest records until size bytes are free
+
+        :return: the new tail offset
+        """
+        while self.limit - (head - tail) < size:
+            length, _ = self._REC.unpack(self._copy_out(tail, self._REC.size))
+            tail += self._REC.size + length
+            self._ctr[self._DROPS] += 1
+            self._ctr[self._COUNT] -= 1
+        return tail
+
+    def put(self, kind, data, stop_evt=None):
+        """ Appends a record to the ring
+
+        :param kind: KIND_RAW or KIND_PICKLE
+        :param data: the payload, as a bytes-like object
+        :param stop_evt: see put_many
+        :return: True if the record was written, False if it was dropped
+        @raise BrokenPipeError if the reading end is closed
+        """
+        return self.put_many(((kind, data),), stop_evt) == 1
+
+    def put_many(self, records, stop_evt=None):
+        """ Appends several records, taking the lock once for all the
+        records that are admitted without waiting
+
+        Records larger than the bound of the ring are dropped, unless the
+        policy is Policy.BLOCK.
+
+        :param records: a sequence of (kind, payload) tuples
+        :param stop_evt: an optional Wakeup interrupting the wait for room
+        :return: the number of records written; the others were dropped
+        @raise BrokenPipeError if the reading end is closed
+        @raise MessageTooLarge if a record can never fit and the policy is
+            Policy.BLOCK; no record is written then
+        @raise SendInterrupted if stop_evt is set while waiting for room
+        """
+        ctr = self._ctr
+        max_len = self.limit - self._REC.size
+        if any(len(data) > max_len for _, data in records):
+            if self.policy == Policy.BLOCK:
+                raise MessageTooLarge(
+                    'Message too large for this ring: more than {} '
+                    'bytes'.format(max_len))
+            fitting = [rec for rec in records if len(rec[1]) <= max_len]
+            with self._lock:
+                ctr[self._DROPS] += len(records) - len(fitting)
+            records = fitting
+        i = written = 0
+        while True:
+            with self._lock:
+                if self._flags[self._W_CLOSED] or self._flags[self._R_CLOSED]:
+                    raise BrokenPipeError('Ring is closed')
+                head = ctr[self._HEAD]
+                tail = ctr[self._TAIL]
+                was_empty = head == tail
+                round_start = written
+                while i < len(records):
+                    kind, data = records[i]
+                    rec_len = self._REC.size + len(data)
+                    verdict = self._admit(rec_len, head - tail)
+                    if verdict == _Verdict.WAIT:
+                        break
+                    i += 1
+                    if verdict == _Verdict.DROP:
+                        ctr[self._DROPS] += 1
+                        continue
+                    if verdict == _Verdict.EVICT:
+                        tail = self._evict(head, tail, rec_len)
+                    self._copy_in(head, self._REC.pack(len(data), kind))
+                    self._copy_in(head + self._REC.size, data)
+                    head += rec_len
+                    written += 1
+                ctr[self._TAIL] = tail
+                ctr[self._HEAD] = head
+                ctr[self._COUNT] += written - round_start
+                ctr[self._MSGS_IN] += written - round_start
+                if was_empty and head != tail:
+                    self._data_evt.set()
+                if i == len(records):
+                    return written
+                self._space_evt.clear()
+                self._flags[self._W_WAITING] = 1
+            if stop_evt is None:
+                self._space_evt.wait()
+                continue
+            ready, _, _ = select.select([self._space_evt, stop_evt], [], [])
+            if stop_evt in ready:
+                raise SendInterrupted('Writer stopped while the ring is full')
+
+    def get(self):
+        """ Pops the oldest record of the ring
+
+        :return: a (kind, payload) tuple, or None if the ring is empty
+        """
+        ctr = self._ctr
+        with self._lock:
+            head = ctr[self._HEAD]
+            tail = ctr[self._TAIL]
+            if head == tail:
+                return None
+            length, kind = self._REC.unpack(
+                self._copy_out(tail, self._REC.size)
+            )
+            data = self._copy_out(tail + self._REC.size, length)
+            tail += self._REC.size + length
+            ctr[self._TAIL] = tail
+            ctr[self._COUNT] -= 1
+            ctr[self._MSGS_OUT] += 1
+            if tail == head and not self._flags[self._W_CLOSED]:
+                self._data_evt.clear()
+            if self._flags[self._W_WAITING]:
+                self._flags[self._W_WAITING] = 0
+                self._space_evt.set()
+            return kind, data
+
+    def get_many(self, max_n=None):
+        """ Pops the records currently stored in the ring
+
+        :param max_n: maximum number of records to pop; all if None
+        :return: a list of (kind, payload) tuples
+        """
+        ctr = self._ctr
+        records = []
+        with self._lock:
+            head = ctr[self._HEAD]
+            tail = ctr[self._TAIL]
+            while tail != head and (max_n is None or len(records) < max_n):
+                length, kind = self._REC.unpack(
+                    self._copy_out(tail, self._REC.size)
+                )
+                records.append(
+                    (kind, self._copy_out(tail + self._REC.size, length))
+                )
+                tail += self._REC.size + length
+            ctr[self._TAIL] = tail
+            ctr[self._COUNT] -= len(records)
+            ctr[self._MSGS_OUT] += len(records)
+            if tail == head and not self._flags[self._W_CLOSED]:
+                self._data_evt.clear()
+            if records and self._flags[self._W_WAITING]:
+                self._flags[self._W_WAITING] = 0
+                self._space_evt.set()
+        return records
+
+    def stats(self):
+        ctr = self._ctr
+        return {
+            'depth': ctr[self._COUNT],
+            'depth_bytes': ctr[self._HEAD] - ctr[self._TAIL],
+            'capacity': self.limit,
+            'drops': ctr[self._DROPS],
+            'msgs_in': ctr[self._MSGS_IN],
+            'msgs_out': ctr[self._MSGS_OUT],
+        }
+
+    def close_writer(self):
+        with self._lock:
+            self._flags[self._W_CLOSED] = 1
+            # wakes the reader up so that it notices the EOF
+            self._data_evt.set()
+
+    def close_reader(self):
+        with self._lock:
+            self._flags[self._R_CLOSED] = 1
+            # wakes any blocked writer up so that it notices the broken pipe
+            self._space_evt.set()
+
+    def release(self):
+        """ Frees the wakeup descriptors once both ends are closed """
+        self._data_evt.close()
+        self._space_evt.close()
+
+
+class _Connection(object):
+    """ Base class for the ends of the channels defined in this module
+
+    Subclasses mimic the multiprocessing.Connection interface (send, recv,
+    send_bytes, recv_bytes, poll, close, fileno), so that instances can be
+    used wherever a multiprocessing.Pipe end is expected.
+
+    :cvar by_reference: whether messages are handed over to the receiving
+        end as Python objects, without being serialized
+    :cvar process_safe: whether both ends may live in different processes
+    """
+    by_reference = False
+    process_safe = False
+
+    def __init__(self, queue, readable, writable):
+        self._queue = queue
+        self._readable = readable
+        self._writable = writable
+        self._closed = False
+        self._stop_evt = None
+
+    def _check_readable(self):
+        if self._closed:
+            raise OSError('handle is closed')
+        if not self._readable:
+            raise OSError('connection is write-only')
+
+    def _check_writable(self):
+        if self._closed:
+            raise OSError('handle is closed')
+        if not self._writable:
+            raise OSError('connection is read-only')
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def readable(self):
+        return self._readable
+
+    @property
+    def writable(self):
+        return self._writable
+
+    def fileno(self):
+        """ Returns a file descriptor that is readable whenever a message is
+        pending or the writing end was closed
+        """
+        return self._queue._data_evt.fileno()
+
+    def set_stop_wakeup(self, wakeup):
+        """ Makes the sends blocked on a full channel raise SendInterrupted
+        once wakeup is set
+
+        :param wakeup: a Wakeup, such as the stop wakeup of the writer
+        """
+        self._stop_evt = wakeup
+
+    def _get_record(self):
+        while True:
+            rec = self._queue.get()
+            if rec is not None:
+                return rec
+            if self._queue.writer_closed():
+                raise EOFError
+            self._queue._data_evt.wait()
+
+    def send_many(self, objs, raw=False):
+        """ Sends several messages at once
+
+        :param objs: a list of messages
+        :param raw: whether the messages are bytes-like objects to be sent
+            as they are, as with send_bytes
+        """
+        self._check_writable()
+        self._queue.put_many([self._encode(obj, raw) for obj in objs],
+                             self._stop_evt)
+
+    def send_envelopes(self, envs):
+        """ Sends several messages wrapped into Envelope instances
+
+        :param envs: a list of Envelope
+        """
+        self._check_writable()
+        self._queue.put_many([self._encode_envelope(env) for env in envs],
+                             self._stop_evt)
+
+    def recv_many(self, out, max_n=None, raw=False):
+        """ Receives the messages that are currently pending, without
+        blocking
+
+        :param out: list to which the received messages are appended
+        :param max_n: maximum number of messages to receive; all if None
+        :param raw: whether to return the messages as they were sent,
+            as with recv_bytes
+        @raise EOFError if no message is pending and the writing end is
+            closed
+        """
+        self._check_readable()
+        records = self._queue.get_many(max_n)
+        if not records and self._queue.writer_closed():
+            raise EOFError
+        out.extend(self._decode(rec, raw) for rec in records)
+
+    @property
+    def drops(self):
+        """ Number of messages dropped by the channel policy so far """
+        return self._queue.drops
+
+    def configure(self, capacity=None, policy=None, sample_rate=None):
+        """ Changes the bound and the policy of the channel
+
+        :param capacity: the bound of the channel; in bytes for shared-memory
+            rings, in messages for deque channels
+        :param policy: one of the Policy values
+        :param sample_rate: with Policy.SAMPLE, one message out of
+            sample_rate is accepted once the channel is half full
+        """
+        self._queue.configure(capacity, policy, sample_rate)
+
+    def stats(self):
+        """ Returns the counters of the channel
+
+        :return: a dict with the number of queued messages (depth) and
+            bytes (depth_bytes, if known), the bound of the channel
+            (capacity), and the numbers of dropped, sent and received
+            messages (drops, msgs_in and msgs_out)
+        """
+        ret = self._queue.stats()
+        ret['type'] = type(self).__name__
+        return ret
+
+    def poll(self, timeout=0.0):
+        self._check_readable()
+        if not self._queue.is_empty() or self._queue.writer_closed():
+            return True
+        return self._queue._data_evt.wait(timeout)
+
+    def detach(self):
+        """ Forgets about this end in the current process, without closing
+        the channel
+
+        Used once the end has been handed over to a child process, which
+        remains in charge of closing it.
+        """
+        self._closed = True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writable:
+            self._queue.close_writer()
+        if self._readable:
+            self._queue.close_reader()
+        if self._queue.writer_closed() and self._queue.reader_closed():
+            self._queue.release()
+
+
+class ShmRingConnection(_Connection):
+    """ One end of a shared-memory ring channel
+
+    Messages of type bytes are stored as-is in the ring; any other object is
+    pickled. Sending frames therefore involves neither a pickle nor, during
+    bursts, a syscall.
+    """
+    process_safe = True
+
+    def send_bytes(self, buf, offset=0, size=None):
+        self._check_writable()
+        m = memoryview(buf).cast('B')
+        if size is None:
+            size = len(m) - offset
+        self._queue.put(self._queue.KIND_RAW, m[offset:offset + size],
+                        self._stop_evt)
+
+    def _encode(self, obj, raw=False):
+        if raw or type(obj) is bytes:
+            return self._queue.KIND_RAW, obj
+        return (self._queue.KIND_PICKLE,
+                pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+    def _encode_envelope(self, env):
+        if type(env.obj) is bytes:
+            return self._queue.KIND_RAW, env.obj
+        return self._queue.KIND_PICKLE, env.pickled()
+
+    def _decode(self, record, raw=False):
+        kind, data = record
+        if kind == self._queue.KIND_PICKLE and not raw:
+            return pickle.loads(data)
+        return data
+
+    def send(self, obj):
+        self._check_writable()
+        if type(obj) is bytes:
+            self._queue.put(self._queue.KIND_RAW, obj, self._stop_evt)
+        else:
+            self._queue.put(self._queue.KIND_PICKLE,
+                            pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+                            self._stop_evt)
+
+    def recv_bytes(self, maxlength=None):
+        self._check_readable()
+        _, data = self._get_record()
+        if maxlength is not None and len(data) > maxlength:
+            raise OSError('bad message length')
+        return data
+
+    def recv(self):
+        self._check_readable()
+        return self._decode(self._get_record())
+
+
+def ShmRingPipe(capacity=1 << 22, policy=Policy.BLOCK, sample_rate=10):
+    """ Creates a one-way shared-memory ring channel
+
+    The returned pair is ordered the same way as the multiprocessing.Pipe
+    ends used by ThreadedAbilityBase.__or__: messages sent on the first end
+    are received on the second one.
+
+    :param capacity: size of the ring, in bytes
+    :param policy: what to do when the ring is full; see Policy
+    :param sample_rate: with Policy.SAMPLE, one message out of sample_rate
+        is accepted once the ring is half full
+    :return: a (sending end, receiving end) tuple of ShmRingConnection
+    """
+    ring = _ShmRing(capacity, policy, sample_rate)
+    return (ShmRingConnection(ring, readable=False, writable=True),
+            ShmRingConnection(ring, readable=True, writable=False))
+
+
+# number of seconds between two checks of the stop wakeup of a writer
+# waiting for room in a _DequeQueue
+_STOP_POLL_INTERVAL = 0.1
+
+
+class _DequeQueue(_Bounded):
+    """ In-process queue of Python objects
+
+    The data wakeup flag follows the same empty/non-empty transitions as
+    _ShmRing, so that the receiving end may be passed to select(). The
+    bound of the queue, if any, is expressed in messages.
+    """
+
+    def __init__(self, capacity=None, policy=Policy.BLOCK, sample_rate=10):
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._data_evt = Wakeup()
+        self._w_closed = False
+        self._r_closed = False
+        self.drops = 0
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self.limit = None
+        self._init_policy(capacity, policy, sample_rate)
+
+    def _set_limit(self, capacity):
+        if capacity < 1:
+            raise ValueError('Invalid queue bound: {}'.format(capacity))
+        self.limit = capacity
+
+    def fill(self):
+        return len(self._items)
+
+    def is_empty(self):
+        return len(self._items) == 0
+
+    def writer_closed(self):
+        return self._w_closed
+
+    def reader_closed(self):
+        return self._r_closed
+
+    def put(self, obj, stop_evt=None):
+        if self.limit is not None:
+            return self.put_many((obj,), stop_evt) == 1
+        with self._lock:
+            if self._w_closed or self._r_closed:
+                raise BrokenPipeError('Queue is closed')
+            self._items.append(obj)
+            self.msgs_in += 1
+            if len(self._items) == 1:
+                self._data_evt.set()
+            return True
+
+    def put_many(self, objs, stop_evt=None):
+        """ Appends several objects to the queue
+
+        :param stop_evt: an optional Wakeup interrupting the wait for room
+        :return: the number of objects queued; the others were dropped
+        @raise SendInterrupted if stop_evt is set while waiting for room
+        """
+        with self._lock:
+            if self._w_closed or self._r_closed:
+                raise BrokenPipeError('Queue is closed')
+            if self.limit is None:
+                was_empty = not self._items
+                self._items.extend(objs)
+                self.msgs_in += len(objs)
+                if was_empty and self._items:
+                    self._data_evt.set()
+                return len(objs)
+            written = 0
+            for obj in objs:
+                verdict = self._admit(1, len(self._items))
+                while verdict == _Verdict.WAIT:
+                    if stop_evt is None:
+                        self._space.wait()
+                    elif not self._space.wait(_STOP_POLL_INTERVAL):
+                        if stop_evt.wait(0):
+                            raise SendInterrupted(
+                                'Writer stopped while the queue is full')
+                    if self._r_closed:
+                        raise BrokenPipeError('Queue is closed')
+                    verdict = self._admit(1, len(self._items))
+                if verdict == _Verdict.DROP:
+                    self.drops += 1
+                    continue
+                if verdict == _Verdict.EVICT:
+                    self._items.popleft()
+                    self.drops += 1
+                self._items.append(obj)
+                written += 1
+                if len(self._items) == 1:
+                    self._data_evt.set()
+            self.msgs_in += written
+            return written
+
+    def get_many(self, max_n=None):
+        with self._lock:
+            if max_n is None or max_n >= len(self._items):
+                objs = list(self._items)
+                self._items.clear()
+            else:
+                objs = [self._items.popleft() for _ in range(max_n)]
+            self.msgs_out += len(objs)
+            if not self._items and not self._w_closed:
+                self._data_evt.clear()
+            if objs and self.limit is not None:
+                self._space.notify()
+            return objs
+
+    def get(self):
+        with self._lock:
+            if not self._items:
+                return None
+            obj = self._items.popleft()
+            self.msgs_out += 1
+            if not self._items and not self._w_closed:
+                self._data_evt.clear()
+            if self.limit is not None:
+                self._space.notify()
+            return obj
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'depth_bytes': None,
+            'capacity': self.limit,
+            'drops': self.drops,
+            'msgs_in': self.msgs_in,
+            'msgs_out': self.msgs_out,
+        }
+
+    def close_writer(self):
+        with self._lock:
+            self._w_closed = True
+            self._data_evt.set()
+
+    def close_reader(self):
+        with self._lock:
+            self._r_closed = True
+            self._items.clear()
+            self._space.notify_all()
+
+    def release(self):
+        self._data_evt.close()
+
+
+class DequeConnection(_Connection):
+    """ One end of an in-process channel
+
+    Messages are handed over by reference: they are neither pickled nor
+    copied, so the sender must not modify an object once it was sent. Both
+    ends must be used by threads of the same process.
+    """
+    by_reference = True
+
+    @staticmethod
+    def _encode(obj, raw=False):
+        return obj
+
+    @staticmethod
+    def _encode_envelope(env):
+        return env.obj
+
+    @staticmethod
+    def _decode(obj, raw=False):
+        return obj
+
+    def send(self, obj):
+        self._check_writable()
+        self._queue.put(obj, self._stop_evt)
+
+    def send_bytes(self, buf, offset=0, size=None):
+        self._check_writable()
+        m = memoryview(buf).cast('B')
+        if size is None:
+            size = len(m) - offset
+        self._queue.put(m[offset:offset + size].tobytes(), self._stop_evt)
+
+    def recv(self):
+        self._check_readable()
+        return self._get_record()
+
+    def recv_bytes(self, maxlength=None):
+        self._check_readable()
+        data = self._get_record()
+        if not isinstance(data, bytes):
+            raise OSError('message is not a bytes object')
+        if maxlength is not None and len(data) > maxlength:
+            raise OSError('bad message length')
+        return data
+
+
+def DequePipe(capacity=None, policy=Policy.BLOCK, sample_rate=10):
+    """ Creates a one-way in-process channel
+
+    :param capacity: maximum number of queued messages; unbounded if None
+    :param policy: what to do when the queue is full; see Policy
+    :param sample_rate: with Policy.SAMPLE, one message out of sample_rate
+        is accepted once the queue is half full
+    :return: a (sending end, receiving end) tuple of DequeConnection
+    """
+    queue = _DequeQueue(capacity, policy, sample_rate)
+    return (DequeConnection(queue, readable=False, writable=True),
+            DequeConnection(queue, readable=True, writable=False))
+
+
+class Envelope(object):
+    """ Message fanned out to several connections
+
+    The message is pickled at most once, the first time a connection needs
+    its serialized form; the same buffer is then written to every
+    connection. Connections that hand messages over by reference, or that
+    store bytes messages as they are, do not trigger any serialization.
+    """
+    __slots__ = ('obj', '_pickled')
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._pickled = None
+
+    def pickled(self):
+        if self._pickled is None:
+            self._pickled = multiprocessing.reduction.ForkingPickler.dumps(
+                self.obj, pickle.HIGHEST_PROTOCOL
+            )
+        return self._pickled
+
+
+def send_envelopes(conn, envs):
+    """ Sends several Envelope instances on any connection
+
+    For multiprocessing.Pipe ends, the pickled buffer is written with
+    send_bytes, which the receiving end unpickles with a regular recv().
+
+    :param conn: a connection, such as a multiprocessing.Pipe end
+    :param envs: a list of Envelope
+    """
+    if hasattr(conn, 'send_envelopes'):
+        conn.send_envelopes(envs)
+    else:
+        for env in envs:
+            conn.send_bytes(env.pickled())
+
+
+def send_many(conn, msgs, raw=False):
+    """ Sends several messages on any connection, using its batched
+    interface when there is one
+
+    :param conn: a connection, such as a multiprocessing.Pipe end
+    :param msgs: a list of messages
+    :param raw: whether the messages are bytes-like objects to be sent
+        with send_bytes
+    """
+    if hasattr(conn, 'send_many'):
+        conn.send_many(msgs, raw)
+    elif raw:
+        for msg in msgs:
+            conn.send_bytes(msg)
+    else:
+        for msg in msgs:
+            conn.send(msg)
+
+
+def recv_many(conn, out, max_n=None, raw=False):
+    """ Receives the messages currently pending on any connection, without
+    blocking
+
+    :param conn: a connection, such as a multiprocessing.Pipe end
+    :param out: list to which the received messages are appended
+    :param max_n: maximum number of messages to receive; all if None
+    :param raw: whether to receive the messages with recv_bytes
+    @raise EOFError if the writing end is closed
+    """
+    if hasattr(conn, 'recv_many'):
+        conn.recv_many(out, max_n, raw)
+        return
+    recv = conn.recv_bytes if raw else conn.recv
+    n = 0
+    while (max_n is None or n < max_n) and conn.poll():
+        out.append(recv())
+        n += 1
+
+
+def detach(conn):
+    """ Forgets about a connection in the current process once it has been
+    handed over to a child process
+
+    For multiprocessing.Pipe ends, this closes the file descriptor of the
+    current process only, so that the child process remains the sole owner
+    of the connection.
+
+    :param conn: a connection, such as a multiprocessing.Pipe end
+    """
+    if hasattr(conn, 'detach'):
+        conn.detach()
+    else:
+        conn.close()
+
+
+def stats(conn):
+    """ Returns the counters of any connection
+
+    multiprocessing.Pipe ends have no counters: only their type is
+    reported.
+
+    :param conn: a connection, such as a multiprocessing.Pipe end
+    :return: a dict; see _Connection.stats
+    """
+    if hasattr(conn, 'stats'):
+        return conn.stats()
+    return {
+        'type': type(conn).__name__, 'depth': None, 'depth_bytes': None,
+        'capacity': None, 'drops': None, 'msgs_in': None, 'msgs_out': None
+    }
+
+
+class Link(object):
+    """ Describes the channel to create when two abilities are piped
+
+    A Link may be inserted in a | composition to select the channel used
+    between two abilities, instead of the default multiprocessing.Pipe::
+
+        ring = Link(ShmRingPipe, capacity=1 << 20)
+        inst1 | ring | inst2 | ring | inst3
+
+    The same Link instance may be reused for a whole pipeline; a new channel
+    is created for each pair of abilities.
+    """
+
+    def __init__(self, factory=multiprocessing.Pipe, **kwargs):
+        """
+        :param factory: a callable returning a (sending end, receiving end)
+            pair, such as multiprocessing.Pipe, ShmRingPipe or DequePipe
+        :param kwargs: parameters passed to the factory
+        """
+        self._factory = factory
+        self._kwargs = kwargs
+
+    # size of the ring slot reserved for each message when a bound
+    # expressed in messages is converted to a ShmRingPipe one, in bytes
+    RING_SLOT_SIZE = 4096
+
+    def new_channel(self, process_safe=False):
+        """ Creates a new channel
+
+        :param process_safe: whether the ends of the channel must be usable
+            from different processes; if the factory creates channels that
+            are not, a ShmRingPipe with the same policy is created instead,
+            whose capacity, if any, is converted from messages to slots of
+            RING_SLOT_SIZE bytes
+        :return: a (sending end, receiving end) tuple
+        """
+        sender, receiver = self._factory(**self._kwargs)
+        if not process_safe or getattr(sender, 'process_safe', True):
+            return sender, receiver
+        sender.close()
+        receiver.close()
+        kwargs = {
+            'policy': self._kwargs.get('policy', Policy.BLOCK),
+            'sample_rate': self._kwargs.get('sample_rate', 10),
+        }
+        if self._kwargs.get('capacity') is not None:
+            kwargs['capacity'] = (self._kwargs['capacity']
+                                  * self.RING_SLOT_SIZE)
+        return ShmRingPipe(**kwargs)
+
+
+class LinkedAbility(object):
+    """ Left-hand side of a | composition that specified a Link """
+
+    def __init__(self, ability, link):
+        self._ability = ability
+        self._link = link
+
+    def __or__(self, other):
+        return self._ability.pipe(other, self._link)
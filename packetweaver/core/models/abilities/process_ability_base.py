@@ -0,0 +1,146 @@
+import multiprocessing
+import pickle
+import weakref
+
+from packetweaver.core.models.abilities import ability_base
+from packetweaver.core.models.abilities import channel
+from packetweaver.core.models.abilities import threaded_ability_base
+
+
+class ProcessAbilityBase(threaded_ability_base.ThreadedAbilityBase):
+    """ Ability whose main method runs in a child process
+
+    The child process is forked when the ability is started, so that
+    CPU-bound abilities do not compete with the other abilities of the
+    pipeline for the GIL. The contract is the same as ThreadedAbilityBase:
+    main, _send, _recv, _wait and stop behave identically, and instances may
+    be piped to and from threaded abilities.
+
+    Pipes touching a process ability are shared-memory rings by default;
+    they must be created with pipe() or the | operator before the ability
+    is started. The value returned by main is sent back to the parent
+    process, hence it must be picklable.
+    """
+    _runs_in_process = True
+    # started instances, so that they can be stopped when the app quits
+    _instances = weakref.WeakSet()
+
+    def __init__(self, *args, **kwargs):
+        super(ProcessAbilityBase, self).__init__(*args, **kwargs)
+        self._mp_ctx = multiprocessing.get_context('fork')
+        # shared with the child process; read without any lock or syscall
+        self._stop_flag = self._mp_ctx.RawValue('b', 0)
+        self._process = None
+        self._in_child = False
+        self._result_r = None
+        self._result_w = None
+
+    @classmethod
+    def running_instances(cls):
+        return [inst for inst in cls._instances if not inst.is_stopped()]
+
+    def start(self, deepcopy=True, *args, **kwargs):
+        """ Forks the child process that runs main
+
+        @raise ValueError if an input or output pipe cannot cross the process
+            boundary
+        """
+        for p in self._builtin_in_pipes + self._builtin_out_pipes:
+            if not getattr(p, 'process_safe', True):
+                raise ValueError(
+                    '[{}] cannot run in a child process: one of its pipes '
+                    'is an in-process channel'.format(self._info.get_name())
+                )
+        self._store_args(deepcopy, args, kwargs)
+        self._result_r, self._result_w = self._mp_ctx.Pipe(duplex=False)
+        self._started_status = True
+        self.logger.debug('[{}] forking process'.format(self._info.get_name()))
+        self._process = self._mp_ctx.Process(
+            target=self._run_child, name=self._info.get_name()
+        )
+        self._process.start()
+        ProcessAbilityBase._instances.add(self)
+        # the child process now owns the pipes and the result writing end
+        self._result_w.close()
+        for p in self._builtin_in_pipes + self._builtin_out_pipes:
+            channel.detach(p)
+
+    def _run_child(self):
+        self._in_child = True
+        self._result_r.close()
+        own = set(self._builtin_in_pipes + self._builtin_out_pipes)
+        for p in list(threaded_ability_base.os_pipe_ends):
+            if p not in own:
+                p.close()
+        try:
+            self.run()
+        finally:
+            for p in self._builtin_in_pipes + self._builtin_out_pipes:
+                p.close()
+            try:
+                self._result_w.send(self._ret_value)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                self.logger.warning(
+                    '[{}] result cannot be sent to the parent process: '
+                    '{}'.format(self._info.get_name(), e)
+                )
+            self._result_w.close()
+
+    def _fetch_result(self, timeout):
+        if self._result_r is None or not self._result_r.poll(timeout):
+            return
+        try:
+            self._ret_value = self._result_r.recv()
+        except EOFError:
+            pass
+        self._result_r.close()
+        self._result_r = None
+
+    def result(self):
+        self._fetch_result(0)
+        return super(ProcessAbilityBase, self).result()
+
+    def join(self, timeout=None):
+        if self._process is None:
+            return
+        self._fetch_result(timeout)
+        self._process.join(timeout)
+        if not self._process.is_alive():
+            self._started_status = False
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def terminate(self):
+        """ Kills the child process, for abilities that ignore stop()
+
+        The pipes of the ability are not closed properly in that case.
+        """
+        if self.is_alive():
+            self._process.terminate()
+
+    @property
+    def pid(self):
+        """ Identifier of the child process, or None if not started """
+        return None if self._process is None else self._process.pid
+
+    def _wait(self):
+        self.logger.debug('[{}] waiting'.format(self._info.get_name()))
+        while not self._is_stop_requested():
+            self._stop_wakeup.wait()
+        self.logger.debug('[{}] leave wait'.format(self._info.get_name()))
+
+    def stop(self):
+        ability_base.AbilityBase.stop(self)
+        self._stop_flag.value = 1
+        # the wakeup descriptor is shared with the child process
+        self._stop_wakeup.set()
+        self.logger.debug('[{}] stop notified'.format(self._info.get_name()))
+
+    def is_stopped(self):
+        if self._in_child:
+            return self._is_stop_requested()
+        return self._is_stop_requested() or not self.is_alive()
+
+    def _is_stop_requested(self):
+        return self._stop_flag.value != 0
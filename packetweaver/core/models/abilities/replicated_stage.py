@@ -0,0 +1,197 @@
+import collections
+
+from packetweaver.core.models.abilities import ability_info
+from packetweaver.core.models.abilities import channel
+from packetweaver.core.models.abilities import threaded_ability_base
+from packetweaver.core.models import status
+from packetweaver.libs.sys import frame_batch
+
+
+class ReplicatedStage(threaded_ability_base.ThreadedAbilityBase):
+    """ Pipeline stage made of several replicas of an ability
+
+    The stage itself is the dispatcher: it reads the messages piped into
+    it and forwards each of them to one of the replicas, either in a
+    round-robin fashion or according to the hash of a key computed from the
+    message. The outputs of the replicas are merged into whatever the stage
+    is piped into::
+
+        workers = ReplicatedStage(
+            [self.get_dependency('parser') for _ in range(4)],
+            key=lambda frame: frame[26:34]
+        )
+        capture | workers | writer
+
+    Starting, stopping and joining the stage starts, stops and joins the
+    replicas as well, so the stage is used like a regular ability.
+
+    With ordered=True, the outputs are forwarded in the order of the inputs,
+    at the cost of an additional merging thread. This requires the replicas
+    to emit exactly one message per message they receive.
+    """
+    _info = ability_info.AbilityInfo(
+        name='Replicated Stage',
+        description='Dispatches messages to several replicas of an ability',
+        authors=['pw-team', ],
+        tags=[status.Tag.THREADED],
+        type=status.AbilityType.COMPONENT
+    )
+
+    def __init__(self, replicas, key=None, ordered=False, link=None):
+        """
+        :param replicas: the ThreadedAbilityBase or ProcessAbilityBase
+            instances that process the messages
+        :param key: a callable returning a hashable key for a message, such
+            as its 5-tuple; messages with the same key are dispatched to the
+            same replica. Messages are dispatched in a round-robin fashion if
+            None, as are the messages whose key is None or could not be
+            computed
+        :param ordered: whether the outputs must be merged in input order
+        :param link: a channel.Link describing the channels between the
+            dispatcher, the replicas and the merging thread
+        """
+        super(ReplicatedStage, self).__init__(None, {})
+        if len(replicas) == 0:
+            raise ValueError('A replicated stage needs at least one replica')
+        self._replicas = list(replicas)
+        self._key = key
+        self._next = 0
+        # number of messages for which key raised an exception
+        self.key_errors = 0
+        # indexes of the replicas that were handed the in-flight messages
+        self._order = collections.deque() if ordered else None
+        self._merger = _OrderedMerge(self._order) if ordered else None
+        for abl in self._replicas:
+            threaded_ability_base.ThreadedAbilityBase.pipe(self, abl, link)
+            if self._merger is not None:
+                abl.pipe(self._merger, link)
+
+    def _stage_outputs(self):
+        if self._merger is not None:
+            return [self._merger]
+        return self._replicas
+
+    def pipe(self, other, link=None):
+        """ Pipes the merged outputs of the replicas into another ability """
+        for abl in self._stage_outputs():
+            abl.pipe(other, link)
+        return other
+
+    def _round_robin(self):
+        idx = self._next
+        self._next = (idx + 1) % len(self._replicas)
+        return idx
+
+    def _pick(self, msg):
+        if self._key is None:
+            return self._round_robin()
+        try:
+            key = self._key(msg)
+        except Exception as e:
+            if self.key_errors == 0:
+                self.logger.warning(
+                    'Cannot compute the dispatch key of a message, '
+                    'dispatching it round-robin: {}'.format(e))
+            self.key_errors += 1
+            key = None
+        if key is None:
+            return self._round_robin()
+        return hash(key) % len(self._replicas)
+
+    def get_stats(self):
+        ret = super(ReplicatedStage, self).get_stats()
+        ret['key_errors'] = self.key_errors
+        return ret
+
+    def start(self, deepcopy=True, *args, **kwargs):
+        for abl in self._replicas:
+            abl.start()
+        if self._merger is not None:
+            self._merger.start()
+        super(ReplicatedStage, self).start(deepcopy, *args, **kwargs)
+
+    def stop(self):
+        super(ReplicatedStage, self).stop()
+        for abl in self._replicas:
+            abl.stop()
+        if self._merger is not None:
+            self._merger.stop()
+
+    def join(self, timeout=None):
+        super(ReplicatedStage, self).join(timeout)
+        for abl in self._replicas:
+            abl.join(timeout)
+        if self._merger is not None:
+            self._merger.join(timeout)
+
+    def main(self):
+        outs = list(self._builtin_out_pipes)
+        try:
+            while not self.is_stopped():
+                msgs = self._recv_many()
+                if self._key is not None:
+                    # keys are computed on frames, not on whole batches
+                    msgs = frame_batch.iter_frames(msgs)
+                batches = [[] for _ in outs]
+                for msg in msgs:
+                    idx = self._pick(msg)
+                    batches[idx].append(msg)
+                    if self._order is not None:
+                        self._order.append(idx)
+                for out, batch in zip(outs, batches):
+                    if len(batch) > 0:
+                        channel.send_many(out, batch)
+        except (IOError, EOFError):
+            pass
+
+
+class _OrderedMerge(threaded_ability_base.ThreadedAbilityBase):
+    """ Forwards the outputs of the replicas of a ReplicatedStage in the
+    order in which the dispatcher handed the inputs over
+    """
+    _info = ability_info.AbilityInfo(
+        name='Ordered Merge',
+        description='Merges the outputs of replicas in input order',
+        authors=['pw-team', ],
+        tags=[status.Tag.THREADED],
+        type=status.AbilityType.COMPONENT
+    )
+
+    def __init__(self, order):
+        super(_OrderedMerge, self).__init__(None, {})
+        self._order = order
+
+    def _pop_in_order(self, pending, closed):
+        out = []
+        while len(self._order) > 0:
+            idx = self._order[0]
+            if len(pending[idx]) > 0:
+                out.append(pending[idx].popleft())
+            elif not closed[idx]:
+                break
+            # else the replica is gone and will never answer: skip
+            self._order.popleft()
+        return out
+
+    def main(self):
+        sources = list(self._builtin_in_pipes)
+        index = {p: i for i, p in enumerate(sources)}
+        pending = [collections.deque() for _ in sources]
+        closed = [False] * len(sources)
+        while not self._is_source() and not self.is_stopped():
+            for p in self._select_in_pipes(None):
+                i = index[p]
+                msgs = []
+                try:
+                    channel.recv_many(p, msgs)
+                except (IOError, EOFError):
+                    closed[i] = True
+                    self._builtin_in_pipes.remove(p)
+                pending[i].extend(msgs)
+            out = self._pop_in_order(pending, closed)
+            if len(out) > 0:
+                self._send_many(out)
+        # messages that were emitted beyond the one-to-one contract
+        leftover = [msg for q in pending for msg in q]
+        if len(leftover) > 0 and not self._is_sink():
+            self._send_many(leftover)
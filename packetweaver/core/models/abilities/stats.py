@@ -0,0 +1,159 @@
+import mmap
+import time
+
+from packetweaver.libs.sys import frame_batch
+
+
+def format_duration(seconds):
+    """ Formats a duration for display, or '-' if it is None """
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return '{:.0f}us'.format(seconds * 1e6)
+    if seconds < 1:
+        return '{:.1f}ms'.format(seconds * 1e3)
+    return '{:.2f}s'.format(seconds)
+
+
+class Histogram(object):
+    """ Log2 histogram of durations, stored in a shared memoryview
+
+    Bucket i counts the durations d such that 2**(i-1) <= d < 2**i
+    microseconds; bucket 0 counts the durations below one microsecond.
+    """
+    N_BUCKETS = 32
+
+    def __init__(self, buckets):
+        """
+        :param buckets: a memoryview of N_BUCKETS unsigned 64-bit integers
+        """
+        self._buckets = buckets
+
+    def record(self, seconds, count=1):
+        idx = min(int(seconds * 1e6).bit_length(), self.N_BUCKETS - 1)
+        self._buckets[idx] += count
+
+    def count(self):
+        return sum(self._buckets)
+
+    def percentile(self, pct):
+        """ Returns an upper bound of the given percentile, in seconds, or
+        None if nothing was recorded
+        """
+        total = self.count()
+        if total == 0:
+            return None
+        threshold = total * pct / 100.0
+        seen = 0
+        for idx, n in enumerate(self._buckets):
+            seen += n
+            if seen >= threshold:
+                return (1 << idx) / 1e6
+        return (1 << (self.N_BUCKETS - 1)) / 1e6
+
+
+class AbilityStats(object):
+    """ Cheap counters of a ThreadedAbilityBase
+
+    Counters live in an anonymous shared mapping, so that the parent
+    process reads up-to-date values for a ProcessAbilityBase as well. They
+    are updated by the thread running the ability only, hence without any
+    lock.
+
+    The processing time is the time an ability spends between two reads of
+    its input pipes, divided by the number of messages it read; it is only
+    measured for one read out of sample_rate. So is the latency, i.e. the
+    time elapsed since the capture of the first frame of a read, for the
+    messages carrying capture metadata, such as FrameRecord instances.
+    """
+    MSGS_IN, MSGS_OUT, BYTES_IN, BYTES_OUT, READS = range(5)
+    RECV_WAIT, SEND_WAIT = range(2)
+    _N_COUNTERS = 8
+    _N_TIMES = 4
+
+    # types whose length is accounted as the size of a message
+    SIZED_TYPES = (bytes, bytearray, memoryview, str)
+
+    def __init__(self, sample_rate=64):
+        size = 8 * (self._N_COUNTERS + 2 * Histogram.N_BUCKETS
+                    + self._N_TIMES)
+        self._map = mmap.mmap(-1, size)
+        view = memoryview(self._map)
+        hist_start = 8 * self._N_COUNTERS
+        latency_start = hist_start + 8 * Histogram.N_BUCKETS
+        times_start = latency_start + 8 * Histogram.N_BUCKETS
+        self.counters = view[:hist_start].cast('Q')
+        self.processing = Histogram(view[hist_start:latency_start].cast('Q'))
+        self.latency = Histogram(view[latency_start:times_start].cast('Q'))
+        self.times = view[times_start:].cast('d')
+        self.sample_rate = sample_rate
+        # start of the sampled processing period, and its message count
+        self._sample_start = None
+        self._sample_n = 0
+
+    def count_in(self, msgs):
+        """ Accounts for a batch of received messages
+
+        :param msgs: a list of messages
+        """
+        c = self.counters
+        c[self.MSGS_IN] += len(msgs)
+        c[self.BYTES_IN] += sum(
+            len(m) for m in msgs if isinstance(m, self.SIZED_TYPES)
+        )
+        if len(msgs) > 0 and c[self.READS] % self.sample_rate == 0:
+            ts_ns = frame_batch.capture_ts(msgs[0])
+            if ts_ns is not None:
+                self.latency.record(max(0.0, time.time() - ts_ns / 1e9))
+
+    def count_out(self, msgs):
+        """ Accounts for a batch of sent messages """
+        c = self.counters
+        c[self.MSGS_OUT] += len(msgs)
+        c[self.BYTES_OUT] += sum(
+            len(m) for m in msgs if isinstance(m, self.SIZED_TYPES)
+        )
+
+    def end_processing(self):
+        """ Called when the ability reads its input pipes again """
+        if self._sample_start is not None:
+            self.processing.record(
+                (time.perf_counter() - self._sample_start) / self._sample_n,
+                self._sample_n
+            )
+            self._sample_start = None
+
+    def start_processing(self, n):
+        """ Called when the ability got n messages from its input pipes """
+        c = self.counters
+        c[self.READS] += 1
+        if n > 0 and c[self.READS] % self.sample_rate == 0:
+            self._sample_n = n
+            self._sample_start = time.perf_counter()
+
+    def add_recv_wait(self, seconds):
+        self.times[self.RECV_WAIT] += seconds
+
+    def add_send_wait(self, seconds):
+        self.times[self.SEND_WAIT] += seconds
+
+    def as_dict(self):
+        c = self.counters
+        return {
+            'msgs_in': c[self.MSGS_IN],
+            'msgs_out': c[self.MSGS_OUT],
+            'bytes_in': c[self.BYTES_IN],
+            'bytes_out': c[self.BYTES_OUT],
+            'recv_wait': self.times[self.RECV_WAIT],
+            'send_wait': self.times[self.SEND_WAIT],
+            'processing': {
+                'samples': self.processing.count(),
+                'p50': self.processing.percentile(50),
+                'p99': self.processing.percentile(99),
+            },
+            'latency': {
+                'samples': self.latency.count(),
+                'p50': self.latency.percentile(50),
+                'p99': self.latency.percentile(99),
+            },
+        }
@@ -0,0 +1,240 @@
+import select
+import threading
+import time
+import multiprocessing
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.core.models.abilities.threaded_ability_base as tab
+
+
+class Relay(tab.ThreadedAbilityBase):
+    def main(self):
+        pass
+
+
+def check_stop_blocked_writer(w, r):
+    """ Checks that a writer blocked on a full channel holding one 40-byte
+    message is released by its stop wakeup
+    """
+    stop = channel.Wakeup()
+    w.set_stop_wakeup(stop)
+    w.send(b'x' * 40)
+    errors = []
+
+    def send():
+        try:
+            w.send(b'y' * 40)
+        except channel.SendInterrupted as e:
+            errors.append(e)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    time.sleep(0.05)
+    stop.set()
+    sender.join(2)
+    assert not sender.is_alive()
+    assert len(errors) == 1
+    assert r.recv() == b'x' * 40
+
+
+class TestShmRingPipe:
+    def test_send_recv(self):
+        w, r = channel.ShmRingPipe()
+        w.send(b'\x00\x01frame')
+        w.send({'a': [1, 2]})
+        w.send_bytes(b'raw')
+        assert r.recv() == b'\x00\x01frame'
+        assert r.recv() == {'a': [1, 2]}
+        assert r.recv_bytes() == b'raw'
+        assert r.poll() is False
+
+    def test_wrap_around(self):
+        w, r = channel.ShmRingPipe(capacity=64)
+        for i in range(100):
+            msg = bytes([i]) * (i % 40 + 1)
+            w.send(msg)
+            assert r.recv() == msg
+
+    def test_full_ring(self):
+        w, r = channel.ShmRingPipe(capacity=64,
+                                   policy=channel.Policy.DROP_NEWEST)
+        w.send_bytes(b'a' * 50)
+        w.send_bytes(b'b' * 10)
+        assert w.drops == 1
+        # a message that can never fit is dropped as well
+        w.send(b'c' * 64)
+        assert w.drops == 2
+        assert r.recv_bytes() == b'a' * 50
+        assert not r.poll()
+
+    def test_too_large_block(self):
+        w, r = channel.ShmRingPipe(capacity=64)
+        with pytest.raises(channel.MessageTooLarge):
+            w.send_many([b'a', b'c' * 64])
+        assert not r.poll()
+
+    def test_stop_blocked_writer(self):
+        check_stop_blocked_writer(*channel.ShmRingPipe(capacity=64))
+
+    def test_drop_oldest(self):
+        w, r = channel.ShmRingPipe(capacity=64,
+                                   policy=channel.Policy.DROP_OLDEST)
+        for i in range(10):
+            w.send_bytes(bytes([i]) * 10)
+        assert w.drops == 6
+        assert [r.recv_bytes()[0] for _ in range(4)] == [6, 7, 8, 9]
+
+    def test_block(self):
+        w, r = channel.ShmRingPipe(capacity=64)
+        sender = threading.Thread(
+            target=w.send_many, args=([b'x' * 20] * 20,), kwargs={'raw': True}
+        )
+        sender.start()
+        received = []
+        while len(received) < 20:
+            r.poll(1)
+            r.recv_many(received, raw=True)
+        sender.join()
+        assert received == [b'x' * 20] * 20
+        assert w.drops == 0
+
+    def test_select_and_eof(self):
+        w, r = channel.ShmRingPipe()
+        assert select.select([r], [], [], 0)[0] == []
+        w.send(b'a')
+        w.send(b'b')
+        assert select.select([r], [], [], 0)[0] == [r]
+        assert r.recv() == b'a'
+        assert select.select([r], [], [], 0)[0] == [r]
+        assert r.recv() == b'b'
+        assert select.select([r], [], [], 0)[0] == []
+        w.close()
+        assert r.poll()
+        with pytest.raises(EOFError):
+            r.recv()
+
+    def test_broken_pipe(self):
+        w, r = channel.ShmRingPipe()
+        r.close()
+        with pytest.raises(IOError):
+            w.send(b'a')
+        with pytest.raises(IOError):
+            r.recv()
+
+
+class TestDequePipe:
+    def test_by_reference(self):
+        w, r = channel.DequePipe()
+        obj = {'a': [1, 2]}
+        w.send(obj)
+        w.send_bytes(b'raw')
+        assert r.recv() is obj
+        assert r.recv_bytes() == b'raw'
+
+    def test_stop_blocked_writer(self):
+        check_stop_blocked_writer(*channel.DequePipe(capacity=1))
+
+    def test_select_and_eof(self):
+        w, r = channel.DequePipe()
+        assert select.select([r], [], [], 0)[0] == []
+        w.send(1)
+        assert select.select([r], [], [], 0)[0] == [r]
+        assert r.recv() == 1
+        assert not r.poll()
+        w.close()
+        assert select.select([r], [], [], 0)[0] == [r]
+        with pytest.raises(EOFError):
+            r.recv()
+
+    def test_broken_pipe(self):
+        w, r = channel.DequePipe()
+        r.close()
+        with pytest.raises(IOError):
+            w.send(1)
+
+    def test_policies(self):
+        w, r = channel.DequePipe(capacity=4,
+                                 policy=channel.Policy.DROP_NEWEST)
+        w.send_many(range(10))
+        assert w.drops == 6
+        out = []
+        r.recv_many(out)
+        assert out == [0, 1, 2, 3]
+
+        w.configure(policy=channel.Policy.DROP_OLDEST)
+        w.send_many(range(10))
+        assert w.drops == 12
+        out = []
+        r.recv_many(out)
+        assert out == [6, 7, 8, 9]
+
+        w.configure(capacity=100, policy=channel.Policy.SAMPLE,
+                    sample_rate=5)
+        w.send_many(range(100))
+        out = []
+        r.recv_many(out)
+        assert len(out) == 50 + 10
+
+        with pytest.raises(ValueError):
+            w.configure(policy='unknown')
+
+    def test_block(self):
+        w, r = channel.DequePipe(capacity=2)
+        sender = threading.Thread(target=w.send_many, args=(range(100),))
+        sender.start()
+        received = []
+        while len(received) < 100:
+            r.poll(1)
+            r.recv_many(received)
+        sender.join()
+        assert received == list(range(100))
+
+
+class TestLink:
+    def test_pipe_composition(self):
+        a, b, c = Relay(None, {}), Relay(None, {}), Relay(None, {})
+        ring = channel.Link(channel.ShmRingPipe, capacity=1024)
+        assert (a | ring | b | c) is c
+        assert isinstance(a._builtin_out_pipes[0],
+                          channel.ShmRingConnection)
+        assert isinstance(b._builtin_in_pipes[0], channel.ShmRingConnection)
+        assert not isinstance(b._builtin_out_pipes[0],
+                              channel.ShmRingConnection)
+
+        a._send(b'frame')
+        assert b._recv() == b'frame'
+
+    def test_bounded_out_pipe(self):
+        a, b = Relay(None, {}), Relay(None, {})
+        a | channel.Link(channel.DequePipe, capacity=1,
+                         policy=channel.Policy.DROP_NEWEST) | b
+        a._send(1)
+        a._send(2)
+        assert a._builtin_out_pipes[0].drops == 1
+        assert b._recv() == 1
+
+        w, r = channel.DequePipe()
+        a.add_out_pipe(w, capacity=1, policy=channel.Policy.DROP_OLDEST)
+        w.send_many([1, 2])
+        assert r.recv() == 2
+
+        w, r = multiprocessing.Pipe()
+        with pytest.raises(ValueError):
+            a.add_out_pipe(w, capacity=1)
+
+    def test_process_safe_capacity(self):
+        link = channel.Link(channel.DequePipe, capacity=2,
+                            policy=channel.Policy.DROP_NEWEST)
+        w, r = link.new_channel(process_safe=True)
+        assert isinstance(w, channel.ShmRingConnection)
+        assert w.stats()['capacity'] == 2 * link.RING_SLOT_SIZE
+        w.send_bytes(b'x' * link.RING_SLOT_SIZE)
+        w.send_bytes(b'x' * link.RING_SLOT_SIZE)
+        assert w.drops == 1
+        w.close()
+        r.close()
+
+        w, r = channel.Link(channel.DequePipe).new_channel(True)
+        assert w.stats()['capacity'] == 1 << 22
+        w.close()
+        r.close()
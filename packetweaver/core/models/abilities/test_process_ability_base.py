@@ -0,0 +1,78 @@
+import os
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.core.models.abilities.process_ability_base as pab
+import packetweaver.core.models.abilities.threaded_ability_base as tab
+
+
+class Source(tab.ThreadedAbilityBase):
+    def main(self):
+        for i in range(1000):
+            self._send(i)
+
+
+class Square(pab.ProcessAbilityBase):
+    def main(self):
+        while True:
+            try:
+                msg = self._recv()
+            except (IOError, EOFError):
+                break
+            self._send((os.getpid(), msg * msg))
+
+
+class Sink(tab.ThreadedAbilityBase):
+    def main(self):
+        msgs = []
+        while True:
+            try:
+                msgs.append(self._recv())
+            except (IOError, EOFError):
+                break
+        return msgs
+
+
+class Waiter(pab.ProcessAbilityBase):
+    def main(self):
+        self._wait()
+        return os.getpid()
+
+
+class TestProcessAbilityBase:
+    def test_mixed_pipeline(self):
+        src, sq, sink = Source(None, {}), Square(None, {}), Sink(None, {})
+        src | channel.Link(channel.DequePipe) | sq | sink
+        assert isinstance(src._builtin_out_pipes[0],
+                          channel.ShmRingConnection)
+        assert isinstance(sink._builtin_in_pipes[0],
+                          channel.ShmRingConnection)
+        for abl in (sink, sq, src):
+            abl.start()
+        for abl in (src, sq, sink):
+            abl.join(10)
+
+        res = sink.result()
+        assert [v for _, v in res] == [i * i for i in range(1000)]
+        assert {pid for pid, _ in res} == {sq.pid}
+        assert sq.pid != os.getpid()
+        assert sq.is_stopped()
+        # counters of the child process are visible from the parent
+        assert sq.get_stats()['msgs_in'] == 1000
+        assert sq.get_stats()['msgs_out'] == 1000
+
+    def test_stop_and_result(self):
+        abl = Waiter(None, {})
+        assert abl.is_stopped()
+        abl.start()
+        assert not abl.is_stopped()
+        abl.stop()
+        abl.join(10)
+        assert not abl.is_alive()
+        assert abl.result() == abl.pid
+
+    def test_in_process_pipe_rejected(self):
+        abl = Waiter(None, {})
+        w, r = channel.DequePipe()
+        abl.add_in_pipe(r)
+        with pytest.raises(ValueError):
+            abl.start()
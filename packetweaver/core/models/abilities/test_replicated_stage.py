@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.core.models.abilities.process_ability_base as pab
+import packetweaver.core.models.abilities.replicated_stage as rs
+import packetweaver.core.models.abilities.threaded_ability_base as tab
+
+
+class Source(tab.ThreadedAbilityBase):
+    def main(self, n=200):
+        for i in range(n):
+            self._send(i)
+
+
+class Worker(tab.ThreadedAbilityBase):
+    def main(self):
+        while True:
+            try:
+                msg = self._recv()
+            except (IOError, EOFError):
+                break
+            # later messages are processed faster, to shuffle the outputs
+            time.sleep(0.001 if msg % 7 == 0 else 0)
+            self._send((threading.get_ident(), msg))
+
+
+class ProcessWorker(pab.ProcessAbilityBase):
+    def main(self):
+        while True:
+            try:
+                msg = self._recv()
+            except (IOError, EOFError):
+                break
+            self._send((os.getpid(), msg))
+
+
+class Sink(tab.ThreadedAbilityBase):
+    def main(self):
+        msgs = []
+        while True:
+            try:
+                msgs.extend(self._recv_many())
+            except (IOError, EOFError):
+                break
+        return msgs
+
+
+def run(stage):
+    src, sink = Source(None, {}), Sink(None, {})
+    src | stage | sink
+    for abl in (sink, stage, src):
+        abl.start()
+    for abl in (src, stage, sink):
+        abl.join(10)
+    return sink.result()
+
+
+class TestReplicatedStage:
+    def test_round_robin(self):
+        workers = [Worker(None, {}) for _ in range(3)]
+        res = run(rs.ReplicatedStage(workers))
+        assert sorted(msg for _, msg in res) == list(range(200))
+        for ident in {worker.ident for worker in workers}:
+            assert len([1 for i, _ in res if i == ident]) in (66, 67)
+
+    def test_keyed(self):
+        workers = [Worker(None, {}) for _ in range(4)]
+        res = run(rs.ReplicatedStage(workers, key=lambda msg: msg % 5))
+        assert sorted(msg for _, msg in res) == list(range(200))
+        by_key = {}
+        for ident, msg in res:
+            by_key.setdefault(msg % 5, set()).add(ident)
+        assert all(len(idents) == 1 for idents in by_key.values())
+
+    def test_failing_key(self):
+        def key(msg):
+            if msg % 2:
+                raise TypeError('odd')
+            return None if msg % 4 else 0
+
+        workers = [Worker(None, {}) for _ in range(2)]
+        stage = rs.ReplicatedStage(workers, key=key)
+        res = run(stage)
+        assert sorted(msg for _, msg in res) == list(range(200))
+        assert stage.get_stats()['key_errors'] == 100
+
+    def test_ordered(self):
+        workers = [Worker(None, {}) for _ in range(3)]
+        res = run(rs.ReplicatedStage(workers, ordered=True))
+        assert [msg for _, msg in res] == list(range(200))
+
+    def test_process_replicas(self):
+        workers = [ProcessWorker(None, {}) for _ in range(2)]
+        stage = rs.ReplicatedStage(workers, ordered=True,
+                                   link=channel.Link(channel.DequePipe))
+        res = run(stage)
+        assert [msg for _, msg in res] == list(range(200))
+        assert {pid for pid, _ in res} == {w.pid for w in workers}
+
+    def test_no_replica(self):
+        with pytest.raises(ValueError):
+            rs.ReplicatedStage([])
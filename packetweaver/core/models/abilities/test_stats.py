@@ -0,0 +1,78 @@
+import gc
+import time
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.core.models.abilities.stats as stats
+import packetweaver.core.models.abilities.threaded_ability_base as tab
+import packetweaver.libs.sys.frame_batch as frame_batch
+
+
+class Relay(tab.ThreadedAbilityBase):
+    def main(self):
+        pass
+
+
+class TestHistogram:
+    def test_percentiles(self):
+        st = stats.AbilityStats()
+        hist = st.processing
+        assert hist.percentile(50) is None
+        hist.record(0.5e-6)
+        hist.record(3e-6, 8)
+        hist.record(1e-3)
+        assert hist.count() == 10
+        assert hist.percentile(5) == 1e-6
+        assert hist.percentile(50) == 4e-6
+        assert hist.percentile(100) == 1024e-6
+
+    def test_format_duration(self):
+        assert stats.format_duration(None) == '-'
+        assert stats.format_duration(4e-6) == '4us'
+        assert stats.format_duration(0.0125) == '12.5ms'
+
+
+class TestAbilityStats:
+    def test_counters(self):
+        abl = Relay(None, {})
+        abl._stats.sample_rate = 1
+        w_in, r_in = channel.DequePipe()
+        w_out, r_out = channel.ShmRingPipe(policy=channel.Policy.DROP_NEWEST)
+        abl.add_in_pipe(r_in)
+        abl.add_out_pipe(w_out)
+        w_in.send_many([b'abc', b'de', 42])
+        abl._send_many(abl._recv_many())
+        abl._recv(timeout=0.01)
+
+        st = abl.get_stats()
+        assert (st['msgs_in'], st['bytes_in']) == (3, 5)
+        assert (st['msgs_out'], st['bytes_out']) == (3, 5)
+        assert st['recv_wait'] > 0
+        assert st['processing']['samples'] == 3
+        assert st['in_pipes'][0]['msgs_out'] == 3
+        assert st['out_pipes'][0]['depth'] == 3
+        assert st['out_pipes'][0]['type'] == 'ShmRingConnection'
+
+        r_out.recv()
+        assert abl.get_stats()['out_pipes'][0]['depth'] == 2
+
+    def test_pipeline_stats(self):
+        parent, child = Relay(None, {}), Relay(None, {})
+        parent._track_dependency(child)
+        entries = parent.get_pipeline_stats()
+        assert [e['level'] for e in entries] == [0, 1]
+        assert entries[1]['msgs_in'] == 0
+
+        # dependencies are not kept alive by their parent
+        del child
+        gc.collect()
+        assert len(parent.get_pipeline_stats()) == 1
+        parent._track_dependency(Relay(None, {}))
+        assert len(parent._dependency_instances) == 1
+
+    def test_capture_latency(self):
+        st = stats.AbilityStats(sample_rate=1)
+        st.count_in([b'no metadata'])
+        assert st.latency.count() == 0
+        ts_ns = int((time.time() - 0.002) * 1e9)
+        st.count_in([frame_batch.FrameRecord(b'frame', ts_ns)])
+        assert st.as_dict()['latency']['samples'] == 1
+        assert 1e-3 <= st.as_dict()['latency']['p50'] <= 1
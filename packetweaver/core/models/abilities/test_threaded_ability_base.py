@@ -0,0 +1,237 @@
+import multiprocessing
+import threading
+import time
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.core.models.abilities.threaded_ability_base as tab
+import packetweaver.libs.sys.frame_batch as frame_batch
+
+
+class Component(tab.ThreadedAbilityBase):
+    def main(self):
+        pass
+
+
+@pytest.fixture(params=[multiprocessing.Pipe, channel.ShmRingPipe,
+                        channel.DequePipe])
+def factory(request):
+    return request.param
+
+
+class TestBatchedIO:
+    def test_recv_many(self, factory):
+        abl = Component(None, {})
+        w1, r1 = factory()
+        w2, r2 = factory()
+        abl.add_in_pipe(r1)
+        abl.add_in_pipe(r2)
+        for i in range(3):
+            w1.send(i)
+        w2.send(b'frame')
+
+        assert sorted(abl._recv_many(), key=str) == [0, 1, 2, b'frame']
+        assert abl._drain() == []
+        assert abl._recv_many(timeout=0.01) == []
+
+        for i in range(5):
+            w1.send(i)
+        assert abl._recv_many(max_n=2) == [0, 1]
+        assert abl._drain() == [2, 3, 4]
+
+    def test_recv_many_eof(self, factory):
+        abl = Component(None, {})
+        w, r = factory()
+        abl.add_in_pipe(r)
+        w.send(1)
+        w.close()
+        assert abl._recv_many() == [1]
+        with pytest.raises(IOError):
+            abl._recv_many()
+
+    def test_send_many(self, factory):
+        abl = Component(None, {})
+        w1, r1 = factory()
+        w2, r2 = factory()
+        abl.add_out_pipe(w1)
+        abl.add_out_pipe(w2)
+        abl._send_many([b'a', 'b', 3])
+        for r in (r1, r2):
+            assert [r.recv() for _ in range(3)] == [b'a', 'b', 3]
+
+        r2.close()
+        abl._send_many([4])
+        assert r1.recv() == 4
+        assert abl._builtin_out_pipes == [w1]
+
+
+class TestStopAwareRecv:
+    def test_recv_timeout(self, factory):
+        abl = Component(None, {})
+        w, r = factory()
+        abl.add_in_pipe(r)
+        assert abl._recv(timeout=0.01) is None
+        w.send(b'a')
+        assert abl._recv(timeout=0.01) == b'a'
+
+    def test_stop_wakes_blocked_recv(self, factory):
+        abl = Component(None, {})
+        w, r = factory()
+        abl.add_in_pipe(r)
+        result = []
+
+        def reader():
+            try:
+                abl._recv()
+            except EOFError:
+                result.append('stopped')
+            result.append(abl._recv_many())
+
+        t = threading.Thread(target=reader)
+        t.start()
+        time.sleep(0.05)
+        abl.stop()
+        t.join(1)
+        assert not t.is_alive()
+        assert result == ['stopped', []]
+        assert not abl._poll(1)
+
+
+class TestFanOut:
+    def test_serialize_once(self, monkeypatch):
+        abl = Component(None, {})
+        pairs = [multiprocessing.Pipe(), channel.ShmRingPipe(),
+                 channel.DequePipe(), multiprocessing.Pipe()]
+        for w, _ in pairs:
+            abl.add_out_pipe(w)
+        dumps = []
+        orig_pickled = channel.Envelope.pickled
+
+        def pickled(env):
+            if env._pickled is None:
+                dumps.append(env.obj)
+            return orig_pickled(env)
+
+        monkeypatch.setattr(channel.Envelope, 'pickled', pickled)
+        obj = {'frame': b'abc'}
+        abl._send(obj)
+        abl._send_many([b'x', [1]])
+        assert dumps == [obj, b'x', [1]]
+        for _, r in pairs:
+            assert r.recv() == obj
+            assert r.recv() == b'x'
+            assert r.recv() == [1]
+        assert pairs[2][1]._queue.fill() == 0
+
+    def test_dead_outputs(self):
+        abl = Component(None, {})
+        pairs = [multiprocessing.Pipe() for _ in range(3)]
+        for w, _ in pairs:
+            abl.add_out_pipe(w)
+        pairs[0][1].close()
+        pairs[2][1].close()
+        abl._send(b'a')
+        assert abl._builtin_out_pipes == [pairs[1][0]]
+        assert pairs[1][1].recv() == b'a'
+
+    def test_raw(self, factory):
+        abl = Component(None, {})
+        w, r = factory()
+        abl.add_out_pipe(w)
+        abl.add_in_pipe(r)
+        abl._send(b'\x00raw', raw=True)
+        abl._send_many([b'a', b'b'], raw=True)
+        assert abl._recv(raw=True) == b'\x00raw'
+        assert abl._recv_many(raw=True) == [b'a', b'b']
+
+
+class Double(tab.ThreadedAbilityBase):
+    def process(self, msg):
+        if msg % 3 == 0:
+            return None
+        return (threading.get_ident(), msg * 2)
+
+
+class Tag(tab.ThreadedAbilityBase):
+    def process(self, msg):
+        ident, value = msg
+        self._send((ident, threading.get_ident(), value))
+
+
+class Collect(tab.ThreadedAbilityBase):
+    def main(self):
+        msgs = []
+        while True:
+            try:
+                msgs.append(self._recv())
+            except (IOError, EOFError):
+                break
+        return msgs
+
+
+class TestFusion:
+    def _run(self, abls, inputs):
+        w, r = multiprocessing.Pipe()
+        abls[0].add_in_pipe(r)
+        for abl in abls:
+            abl.start()
+        for msg in inputs:
+            w.send(msg)
+        w.close()
+        for abl in abls:
+            abl.join(5)
+        return abls[-1].result()
+
+    def test_fused_chain(self):
+        double, tag, sink = Double(None, {}), Tag(None, {}), Collect(None, {})
+        assert (double | tag | sink) is sink
+        assert double._fused_next is tag
+        assert tag._builtin_in_pipes == []
+        assert len(sink._builtin_in_pipes) == 1
+
+        res = self._run([double, tag, sink], range(6))
+        assert [v for _, _, v in res] == [2, 4, 8, 10]
+        assert all(i1 == i2 == double.ident for i1, i2, _ in res)
+        assert tag.is_stopped()
+
+    def test_link_prevents_fusion(self):
+        double, tag, sink = Double(None, {}), Tag(None, {}), Collect(None, {})
+        double | channel.Link(channel.DequePipe) | tag | sink
+        assert double._fused_next is None
+
+        res = self._run([double, tag, sink], range(6))
+        assert [v for _, _, v in res] == [2, 4, 8, 10]
+        assert all(i1 != i2 for i1, i2, _ in res)
+
+    def test_unfuse(self):
+        double, tag, sink = Double(None, {}), Tag(None, {}), Collect(None, {})
+        double | tag | sink
+        w, r = multiprocessing.Pipe()
+        tag.add_in_pipe(r)
+        assert double._fused_next is None
+        assert len(tag._builtin_in_pipes) == 2
+        w.send((0, 42))
+        w.close()
+
+        res = self._run([double, tag, sink], range(3))
+        assert sorted(v for _, _, v in res) == [2, 4, 42]
+
+
+class Length(tab.ThreadedAbilityBase):
+    def process(self, frame):
+        return len(frame)
+
+
+class TestFrameBatch:
+    def test_process_unpacks_batches(self):
+        length, sink = Length(None, {}), Collect(None, {})
+        length | channel.Link(channel.DequePipe) | sink
+        w, r = multiprocessing.Pipe()
+        length.add_in_pipe(r)
+        for abl in (length, sink):
+            abl.start()
+        w.send(b'a')
+        w.send(frame_batch.FrameBatch.pack([b'bb', b'ccc']))
+        w.close()
+        for abl in (length, sink):
+            abl.join(5)
+        assert sink.result() == [1, 2, 3]
@@ -1,19 +1,41 @@
 import copy
 import multiprocessing
+import multiprocessing.connection
 import select
 import threading
+import time
 import logging
+import weakref
 
 from packetweaver.core.models.abilities import ability_base
+from packetweaver.core.models.abilities import channel
+from packetweaver.core.models.abilities import stats
+from packetweaver.libs.sys import frame_batch
+
+# multiprocessing.Pipe ends created by pipe(); a forked child process closes
+# the ones it does not use, otherwise their peers would never get an EOF
+os_pipe_ends = weakref.WeakSet()
 
 
 class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
+    # whether main() runs in a process of its own; see ProcessAbilityBase
+    _runs_in_process = False
+    # per-message hook of fusible components; see process()
+    process = None
+
     def __init__(self, *args, **kwargs):
         threading.Thread.__init__(self)
         ability_base.AbilityBase.__init__(self, *args, **kwargs)
         self._stop_condition = threading.Condition()
+        # readable once stop() is called; selected along with the in pipes
+        self._stop_wakeup = channel.Wakeup()
         self._builtin_in_pipes = []
+        self._ready_in_pipes = []
         self._builtin_out_pipes = []
+        # neighbours running in the same thread; see _can_fuse_with()
+        self._fused_prev = None
+        self._fused_next = None
+        self._stats = stats.AbilityStats()
         self._ret_value = None
         self._started_status = False
         self.logger = logging.getLogger(__name__)
@@ -27,13 +49,27 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
 
     def stop(self):
         ability_base.AbilityBase.stop(self)
+        self._stop_wakeup.set()
         with self._stop_condition:
             self._stop_condition.notify()
             self.logger.debug('[{}] stop notified'.format(
                 self._info.get_name())
             )
+        if self._fused_prev is not None:
+            self._fusion_head().stop()
 
     def start(self, deepcopy=True, *args, **kwargs):
+        self._store_args(deepcopy, args, kwargs)
+        self._started_status = True
+        if self._fused_prev is not None:
+            self.logger.debug('[{}] fused into [{}]'.format(
+                self._info.get_name(), self._fusion_head()._info.get_name())
+            )
+            return
+        self.logger.debug('[{}] running thread'.format(self._info.get_name()))
+        threading.Thread.start(self)
+
+    def _store_args(self, deepcopy, args, kwargs):
         # deepcopy argument is necessary in case the arguments contains stuff
         #  cannot be deep-copied (some fd, for instance)
         if deepcopy:
@@ -49,9 +85,11 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
             self._args = args
             self._kwargs = kwargs
 
-        self._started_status = True
-        self.logger.debug('[{}] running thread'.format(self._info.get_name()))
-        threading.Thread.start(self)
+    def join(self, timeout=None):
+        if self._fused_prev is not None:
+            # runs in the thread of the head of its fused chain
+            return
+        threading.Thread.join(self, timeout)
 
     def run(self):
         try:
@@ -60,6 +98,11 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
             )
             self._ret_value = self.main(*self._args, **self._kwargs)
             self.logger.debug('[{}] end of main'.format(self._info.get_name()))
+            stage = self._fused_next
+            while stage is not None:
+                for out in stage._builtin_out_pipes:
+                    out.close()
+                stage = stage._fused_next
             if not self._is_source():
                 self.logger.debug(
                     '[{}] is source, closing {} builtin_in_pipes'.format(
@@ -81,16 +124,121 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
         if self._ret_value is not None:
             return self._ret_value
 
-    def __or__(self, other):
+    def main(self, *args, **kwargs):
+        """ Default main of the components defining process(): applies it
+        to every received message and sends the results in batches
+        """
+        if self.process is None:
+            raise NotImplementedError(
+                '{} defines neither main() nor process()'.format(
+                    type(self).__name__)
+            )
+        try:
+            while not self.is_stopped():
+                self._feed(self._recv_many())
+        except (IOError, EOFError):
+            pass
+
+    def _feed(self, msgs):
+        """ Runs process() on a batch of messages and forwards the results
+        as a batch, so that a fused chain handles whole batches stage after
+        stage
+
+        FrameBatch messages, such as the ones of a batching capture, are
+        unpacked: process() is called on each of their frames.
+        """
+        fused = self._fused_prev is not None
+        if fused:
+            # fused stages never read their input pipes: account here
+            self._stats.count_in(msgs)
+            self._stats.start_processing(len(msgs))
+        out = []
+        for msg in frame_batch.iter_frames(msgs):
+            res = self.process(msg)
+            if res is not None:
+                out.append(res)
+        if fused:
+            self._stats.end_processing()
+        if len(out) > 0:
+            self._send_many(out)
+
+    def _can_fuse_with(self, other):
+        """ Tells whether other may run in the thread of this ability,
+        instead of being connected to it with a channel
+
+        Both abilities must define the process() hook, run in this process,
+        and be connected to each other only.
+        """
+        return (
+            self.process is not None and other.process is not None
+            and not self._runs_in_process and not other._runs_in_process
+            and self._fused_next is None and self._is_sink()
+            and other._fused_prev is None and other._is_source()
+        )
+
+    def _fusion_head(self):
+        stage = self
+        while stage._fused_prev is not None:
+            stage = stage._fused_prev
+        return stage
+
+    def _unfuse(self):
+        """ Replaces the fusion with the next stage by an in-process
+        channel, because either stage got another neighbour
+        """
+        nxt = self._fused_next
+        self.logger.debug('[{}] unfused from [{}]'.format(
+            self._info.get_name(), nxt._info.get_name())
+        )
+        self._fused_next = None
+        nxt._fused_prev = None
+        sender, receiver = channel.DequePipe()
+        self._builtin_out_pipes.append(sender)
+        nxt._builtin_in_pipes.append(receiver)
+
+    def pipe(self, other, link=None):
+        """ Pipes the standard output of this ability into the standard
+        input of another ability
+
+        When one of the abilities runs in a process of its own, the channel
+        is created so that it can cross the process boundary: a shared-memory
+        ring is used by default, and links creating in-process channels are
+        upgraded to shared-memory rings.
+
+        :param other: the ThreadedAbilityBase instance to pipe into
+        :param link: a channel.Link describing the channel to create;
+            a multiprocessing.Pipe is used if None
+        :return: other, so that calls may be chained
+        """
+        if link is None and self._can_fuse_with(other):
+            self.logger.debug('[{}] fused with [{}]'.format(
+                self._info.get_name(), other._info.get_name())
+            )
+            self._fused_next = other
+            other._fused_prev = self
+            return other
         self.logger.debug(
             '[{}] new out pipe to [{}]'.format(self._info.get_name(),
                                                other._info.get_name())
         )
-        input, output = multiprocessing.Pipe()
+        cross_process = self._runs_in_process or other._runs_in_process
+        if link is None and cross_process:
+            link = channel.Link(channel.ShmRingPipe)
+        if link is None:
+            input, output = multiprocessing.Pipe()
+        else:
+            input, output = link.new_channel(cross_process)
+        if isinstance(input, multiprocessing.connection.Connection):
+            os_pipe_ends.update((input, output))
         other.add_in_pipe(output)
         self.add_out_pipe(input)
         return other
 
+    def __or__(self, other):
+        if isinstance(other, channel.Link):
+            return channel.LinkedAbility(self, other)
+        return self.pipe(other)
+
     def _transfer_in(self, other):
         self.logger.debug('[{}] transfer {} in pipes to [{}]'.format(
             self._info.get_name(),
@@ -100,6 +248,7 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
         for p in self._builtin_in_pipes:
             other.add_in_pipe(p)
         self._builtin_in_pipes = []
+        self._ready_in_pipes = []
 
     def _transfer_out(self, other):
         self.logger.debug('[{}] transfer {} out pipes to [{}]'.format(
@@ -116,6 +265,8 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
             other.add_out_pipe(out)
 
     def add_in_pipe(self, p):
+        if self._fused_prev is not None:
+            self._fused_prev._unfuse()
         if p not in self._builtin_in_pipes:
             self._builtin_in_pipes.append(p)
         self.logger.debug('[{}] has {} in pipe'.format(
@@ -123,7 +274,26 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
             len(self._builtin_in_pipes))
         )
 
-    def add_out_pipe(self, p):
+    def add_out_pipe(self, p, capacity=None, policy=None):
+        """ Registers an output pipe, optionally bounding it
+
+        :param p: the sending end of a channel
+        :param capacity: the bound of the channel; see Link for its unit
+        :param policy: what to do when the channel is full; see
+            channel.Policy
+        @raise ValueError if the channel cannot be bounded
+        """
+        if capacity is not None or policy is not None:
+            if not hasattr(p, 'configure'):
+                raise ValueError(
+                    'This channel type does not support bounds or policies'
+                )
+            p.configure(capacity, policy)
+        if hasattr(p, 'set_stop_wakeup'):
+            # a send blocked on a full channel ends when this ability stops
+            p.set_stop_wakeup(self._stop_wakeup)
+        if self._fused_next is not None:
+            self._unfuse()
         if p not in self._builtin_out_pipes:
             self._builtin_out_pipes.append(p)
         self.logger.debug('[{}] has {} out pipe'.format(
@@ -132,61 +302,257 @@ class ThreadedAbilityBase(threading.Thread, ability_base.AbilityBase):
         )
 
     def is_stopped(self):
+        if self._fused_prev is not None:
+            return (ability_base.AbilityBase.is_stopped(self)
+                    or self._fusion_head().is_stopped())
         return (
             not threading.Thread.is_alive(self)
             or ability_base.AbilityBase.is_stopped(self)
         )
 
-    def _recv_one(self):
-        while len(self._builtin_in_pipes) > 0:
-            ready_to_read, _, _ = select.select(self._builtin_in_pipes, [], [])
-            for p in ready_to_read:
+    def _is_stop_requested(self):
+        return ability_base.AbilityBase.is_stopped(self)
+
+    def _select_in_pipes(self, timeout):
+        """ Waits for input pipes to be readable or for stop() to be called
+
+        :return: the list of readable input pipes; empty if the timeout
+            expired or if the ability was stopped
+        """
+        start = time.perf_counter()
+        ready, _, _ = select.select(
+            self._builtin_in_pipes + [self._stop_wakeup], [], [], timeout
+        )
+        self._stats.add_recv_wait(time.perf_counter() - start)
+        if self._stop_wakeup in ready:
+            return []
+        return ready
+
+    def _recv(self, timeout=None, raw=False):
+        """ Receives the next message from the input pipes
+
+        Input pipes are read in a round-robin fashion. The call blocks until
+        a message is available, the timeout expires or stop() is called.
+
+        :param timeout: maximum time to wait, in seconds; forever if None
+        :param raw: whether to read a message sent with _send(raw=True)
+        :return: the message, or None if the timeout expired
+        @raise EOFError if the ability is stopped
+        @raise IOError if there is no (more) input pipe
+        """
+        self._stats.end_processing()
+        while True:
+            if self._is_source():
+                raise IOError(
+                    'No input pipe for this ability instance: {}'.format(
+                        type(self).get_name())
+                )
+            if self._is_stop_requested():
+                raise EOFError(
+                    'Ability stopped: {}'.format(type(self).get_name())
+                )
+            if len(self._ready_in_pipes) == 0:
+                self._ready_in_pipes = self._select_in_pipes(timeout)
+                if len(self._ready_in_pipes) == 0:
+                    if self._is_stop_requested():
+                        continue
+                    return None
+            p = self._ready_in_pipes.pop(0)
+            try:
+                msg = p.recv_bytes() if raw else p.recv()
+            except (IOError, EOFError):
+                if p in self._builtin_in_pipes:
+                    self._builtin_in_pipes.remove(p)
+                continue
+            self._stats.count_in((msg,))
+            self._stats.start_processing(1)
+            return msg
+
+    def _recv_many(self, max_n=None, timeout=None, raw=False):
+        """ Receives all the messages currently queued on the input pipes
+
+        Waits until at least one message is available, then reads every
+        pending message of every ready input pipe, without blocking again.
+
+        :param max_n: maximum number of messages to return; all if None
+        :param timeout: maximum time to wait for a first message, in seconds;
+            wait forever if None
+        :param raw: whether to read messages sent with _send(raw=True)
+        :return: a list of messages, empty if the timeout expired or if the
+            ability is stopped
+        @raise IOError if there is no (more) input pipe
+        """
+        self._stats.end_processing()
+        while True:
+            if self._is_source():
+                raise IOError(
+                    'No input pipe for this ability instance: {}'.format(
+                        type(self).get_name())
+                )
+            if self._is_stop_requested():
+                return []
+            ready = self._select_in_pipes(timeout)
+            self._ready_in_pipes = []
+            msgs = []
+            for p in ready:
+                if max_n is not None and len(msgs) >= max_n:
+                    break
                 try:
-                    msg = p.recv()
-                    yield msg
+                    channel.recv_many(
+                        p, msgs, None if max_n is None else max_n - len(msgs),
+                        raw
+                    )
                 except (IOError, EOFError):
-                    self._builtin_in_pipes.pop(self._builtin_in_pipes.index(p))
-        raise IOError(
-            'No input pipe for this ability instance: {}'.format(
-                type(self).get_name())
-        )
+                    self._builtin_in_pipes.remove(p)
+            if (len(msgs) > 0 or timeout is not None
+                    or self._is_stop_requested()):
+                self._stats.count_in(msgs)
+                self._stats.start_processing(len(msgs))
+                return msgs
 
-    def _recv(self):
-        if len(self._builtin_in_pipes) == 0:
+    def _drain(self, max_n=None):
+        """ Receives the messages currently queued on the input pipes,
+        without waiting
+
+        :param max_n: maximum number of messages to return; all if None
+        :return: a list of messages, possibly empty
+        """
+        return self._recv_many(max_n, timeout=0)
+
+    def _poll(self, timeout=0.1):
+        """ Checks whether a message is available on the input pipes
+
+        :param timeout: maximum time to wait, in seconds; the call returns
+            early if stop() is called
+        :return: True if a message may be read without blocking
+        """
+        if self._is_source():
             raise IOError(
                 'No input pipe for this ability instance: {}'.format(
                     type(self).get_name())
             )
+        return len(self._select_in_pipes(timeout)) > 0
+
+    def _drop_out_pipes(self, dead):
+        """ Forgets about output pipes whose reading end is closed """
+        self.logger.debug('[{}] dropping {} dead out pipes'.format(
+            self._info.get_name(), len(dead))
+        )
+        self._builtin_out_pipes = [
+            out for out in self._builtin_out_pipes if out not in dead
+        ]
+
+    def _write_pipe(self, out, dead, send, *args):
+        """ Calls send(*args) to write to an output pipe, and records the
+        pipe in dead if its reading end is closed
 
+        @raise SendInterrupted if this ability was stopped while the pipe
+            was full
+        """
         try:
-            return next(self._recv_gen)
-        except AttributeError:
-            self._recv_gen = self._recv_one()
-            return next(self._recv_gen)
+            send(*args)
+        except channel.MessageTooLarge as e:
+            self.logger.error('[{}] message dropped: {}'.format(
+                self._info.get_name(), e))
+        except channel.SendInterrupted:
+            raise
+        except IOError:
+            dead.append(out)
 
-    def _poll(self, timeout=0.1):
-        if self._is_source():
+    def _send(self, msg, raw=False):
+        """ Sends a message to every output pipe
+
+        When there are several output pipes, the message is serialized at
+        most once and the same buffer is written to each of them.
+
+        :param msg: the message; any picklable object
+        :param raw: if True, msg must be a bytes-like object, which is sent
+            without any pickle envelope; readers must then use
+            _recv(raw=True)
+        """
+        self._stats.count_out((msg,))
+        if self._fused_next is not None:
+            self._fused_next._feed((msg,))
+            return
+        if self._is_sink():
             raise IOError(
-                'No input pipe for this ability instance: {}'.format(
+                'No output pipe for this ability instance: {}'.format(
                     type(self).get_name())
             )
-        r, w, x = select.select(self._builtin_in_pipes, [], [], timeout)
-        return len(r) > 0
+        start = time.perf_counter()
+        dead = []
+        if raw:
+            for out in self._builtin_out_pipes:
+                self._write_pipe(out, dead, out.send_bytes, msg)
+        elif len(self._builtin_out_pipes) == 1:
+            out = self._builtin_out_pipes[0]
+            self._write_pipe(out, dead, out.send, msg)
+        else:
+            envs = [channel.Envelope(msg)]
+            for out in self._builtin_out_pipes:
+                self._write_pipe(out, dead, channel.send_envelopes, out, envs)
+        self._stats.add_send_wait(time.perf_counter() - start)
+        if len(dead) > 0:
+            self._drop_out_pipes(dead)
 
-    def _send(self, msg):
+    def _send_many(self, msgs, raw=False):
+        """ Sends several messages to every output pipe
+
+        Writes are coalesced per output pipe whenever the pipe supports it,
+        and each message is serialized at most once.
+
+        :param msgs: a list of messages
+        :param raw: whether the messages are bytes-like objects to be sent
+            without any pickle envelope, as with _send
+        """
+        self._stats.count_out(msgs)
+        if self._fused_next is not None:
+            self._fused_next._feed(msgs)
+            return
         if self._is_sink():
             raise IOError(
                 'No output pipe for this ability instance: {}'.format(
                     type(self).get_name())
             )
-        for out in self._builtin_out_pipes:
-            try:
-                out.send(msg)
-            except IOError:
-                self._builtin_out_pipes.pop(self._builtin_out_pipes.index(out))
+        if len(msgs) == 0:
+            return
+        start = time.perf_counter()
+        dead = []
+        if raw or len(self._builtin_out_pipes) == 1:
+            for out in self._builtin_out_pipes:
+                self._write_pipe(out, dead, channel.send_many, out, msgs,
+                                 raw)
+        else:
+            envs = [channel.Envelope(msg) for msg in msgs]
+            for out in self._builtin_out_pipes:
+                self._write_pipe(out, dead, channel.send_envelopes, out, envs)
+        self._stats.add_send_wait(time.perf_counter() - start)
+        if len(dead) > 0:
+            self._drop_out_pipes(dead)
+
+    def get_stats(self):
+        """ Returns the counters of this ability and of its pipes
+
+        Counters are cumulative since the creation of the ability. They may
+        be read from another thread, or from the parent process of a
+        ProcessAbilityBase, while the ability runs.
+
+        :return: a dict with the numbers of messages and bytes received and
+            sent (msgs_in, msgs_out, bytes_in, bytes_out; only bytes-like
+            and str messages are accounted in bytes), the time spent waiting
+            for input and writing output, in seconds (recv_wait, send_wait),
+            a summary of the sampled per-message processing time
+            (processing), and the counters of the input and output pipes
+            (in_pipes, out_pipes; see channel.stats)
+        """
+        ret = self._stats.as_dict()
+        ret['name'] = self._info.get_name()
+        ret['in_pipes'] = [channel.stats(p) for p in self._builtin_in_pipes]
+        ret['out_pipes'] = [channel.stats(p) for p in self._builtin_out_pipes]
+        return ret
 
     def _is_source(self):
         return len(self._builtin_in_pipes) == 0
 
     def _is_sink(self):
-        return len(self._builtin_out_pipes) == 0
+        return len(self._builtin_out_pipes) == 0 and self._fused_next is None
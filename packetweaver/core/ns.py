@@ -4,6 +4,15 @@ from packetweaver.core.models.abilities.ability_base import (
 from packetweaver.core.models.abilities.threaded_ability_base import (
     ThreadedAbilityBase
 )
+from packetweaver.core.models.abilities.process_ability_base import (
+    ProcessAbilityBase
+)
+from packetweaver.core.models.abilities.replicated_stage import (
+    ReplicatedStage
+)
+from packetweaver.core.models.abilities.channel import (
+    DequePipe, Link, Policy, ShmRingPipe, send_many
+)
 from packetweaver.core.models.status import (
     Reliability, Tag, OptNames, AbilityType
 )
@@ -15,6 +24,9 @@ from packetweaver.core.models.abilities.ability_dependency import (
     AbilityDependency
 )
 from packetweaver.core.models.abilities.ability_info import AbilityInfo
+from packetweaver.libs.sys.frame_batch import (
+    FrameBatch, FrameRecord, iter_frames, iter_records
+)
 
 # Imports that require external dependencies
 from packetweaver.libs.sys.pcap import *
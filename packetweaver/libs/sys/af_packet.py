@@ -0,0 +1,393 @@
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import subprocess
+
+HAS_AF_PACKET = hasattr(socket, 'AF_PACKET')
+
+# linux/if_ether.h and linux/if_packet.h
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+SO_ATTACH_FILTER = 26
+PACKET_RX_RING = 5
+PACKET_TX_RING = 13
+PACKET_STATISTICS = 6
+PACKET_ORIGDEV = 9
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_LB = 1
+PACKET_FANOUT_CPU = 2
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+TPACKET_V2 = 1
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_SENDING = 2
+
+DLT_EN10MB = 1
+# classic BPF "ret #k" instruction
+BPF_RET_K = 0x06
+
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+_BLOCK_STATUS_OFF = 8
+_BLOCK_HDR = struct.Struct('III')  # block_status, num_pkts, first_pkt
+# struct tpacket3_hdr: next_offset, sec, nsec, snaplen, len, status, mac
+_FRAME_HDR = struct.Struct('IIIIIIH')
+# struct sockaddr_ll follows the 48-byte tpacket3_hdr; its ifindex is at 4
+_SLL_IFINDEX_OFF = 52
+_IFINDEX = struct.Struct('i')
+_STATUS = struct.Struct('I')
+# struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+_STATS = struct.Struct('III')
+_FANOUT = struct.Struct('I')
+# struct tpacket2_hdr: tp_status, tp_len; a TX frame starts right after the
+# 32-byte header
+_TX_HDR = struct.Struct('II')
+_TX_DATA_OFF = 32
+
+FANOUT_MODES = {
+    'hash': PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG,
+    'lb': PACKET_FANOUT_LB,
+    'cpu': PACKET_FANOUT_CPU,
+}
+
+
+def fanout_arg(group_id, mode):
+    """ Returns the PACKET_FANOUT socket option value of a fanout group
+
+    In hash mode, the frames of a flow are always delivered to the same
+    socket, in both directions, since the kernel flow hash is symmetric.
+    IP fragments are reassembled before being hashed so that they follow
+    the flow they belong to.
+
+    :param group_id: a 16-bit identifier, shared by the sockets of the group
+    :param mode: one of the keys of FANOUT_MODES
+    @raise ValueError if the mode is unknown
+    """
+    if mode not in FANOUT_MODES:
+        raise ValueError('Unknown fanout mode [{}]'.format(mode))
+    return (group_id & 0xffff) | (FANOUT_MODES[mode] << 16)
+
+
+def compile_bpf(expr, snaplen=65535):
+    """ Compiles a BPF expression into classic BPF instructions
+
+    pcapy is used if available, tcpdump otherwise.
+
+    :param expr: the filter, in pcap-filter syntax
+    :param snaplen: the number of bytes of the accepted frames that the
+        program keeps
+    :return: a list of (code, jt, jf, k) tuples
+    @raise ValueError if the expression cannot be compiled
+    """
+    try:
+        import pcapy
+        try:
+            prog = pcapy.compile(DLT_EN10MB, snaplen, expr, 1, 0xffffffff)
+            return [tuple(insn) for insn in prog.get_bpf()]
+        except (pcapy.PcapError, AttributeError):
+            pass
+    except ImportError:
+        pass
+    try:
+        out = subprocess.check_output(
+            ['tcpdump', '-ddd', '-y', 'EN10MB', '-s', str(snaplen), expr],
+            stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        raise ValueError('Cannot compile BPF [{}]'.format(expr))
+    lines = out.decode().split('\n')
+    return [tuple(int(v) for v in line.split())
+            for line in lines[1:] if len(line.strip()) > 0]
+
+
+class TPacketV3Socket(object):
+    """ AF_PACKET socket receiving frames through a TPACKET_V3 mmap ring
+
+    The kernel fills whole blocks of frames in the ring and hands each of
+    them over to user space at once, either when it is full or when the
+    block timeout expires. Frames are read in place from the mapping: a
+    block costs a single poll() and no per-frame system call.
+    """
+
+    def __init__(self, iface, bpf=None, block_size=1 << 20, block_nr=64,
+                 frame_size=2048, block_timeout=10, fanout=None,
+                 snaplen=None):
+        """
+        :param iface: the name of the interface to capture on
+        :param bpf: an optional BPF filter expression
+        :param block_size: size of a ring block, a multiple of the page size
+        :param block_nr: number of blocks in the ring
+        :param frame_size: the minimum room reserved for a frame
+        :param block_timeout: milliseconds after which a block that is not
+            full is handed over to user space
+        :param fanout: an optional value returned by fanout_arg, to join a
+            fanout group
+        :param snaplen: the maximum number of bytes of a frame copied into
+            the ring, or None to copy whole frames; the wire length of the
+            frames is kept in their metadata
+        @raise OSError if the socket cannot be created, e.g. missing
+            CAP_NET_RAW
+        @raise ValueError if the BPF cannot be compiled
+        """
+        self._block_size = block_size
+        self._block_nr = block_nr
+        self._cur = 0
+        self._packets = 0
+        self._drops = 0
+        # protocol 0: nothing is received until the socket is bound, so that
+        # no frame escapes the filter
+        self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            if bpf:
+                self._attach_filter(compile_bpf(bpf, snaplen or 65535))
+            elif snaplen:
+                # the kernel truncates frames to the value returned by the
+                # filter
+                self._attach_filter([(BPF_RET_K, 0, 0, snaplen)])
+            self._sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            # frames captured on a bridge report the port they came in
+            # through rather than the bridge itself
+            self._sock.setsockopt(SOL_PACKET, PACKET_ORIGDEV, 1)
+            req = struct.pack(
+                'IIIIIII', block_size, block_nr, frame_size,
+                (block_size // frame_size) * block_nr, block_timeout, 0, 0
+            )
+            self._sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+            self._map = mmap.mmap(self._sock.fileno(), block_size * block_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+            self._sock.bind((iface, ETH_P_ALL))
+            if fanout is not None:
+                # the defrag flag does not fit in a signed int
+                self._sock.setsockopt(SOL_PACKET, PACKET_FANOUT,
+                                      _FANOUT.pack(fanout))
+        except Exception:
+            self.close()
+            raise
+        self._poller = select.poll()
+        self._poller.register(self._sock.fileno(),
+                              select.POLLIN | select.POLLERR)
+
+    def _attach_filter(self, insns):
+        prog = b''.join(struct.pack('HBBI', *insn) for insn in insns)
+        self._filter_buf = ctypes.create_string_buffer(prog)
+        fprog = struct.pack('HL', len(insns),
+                            ctypes.addressof(self._filter_buf))
+        self._sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def add_wakeup(self, fd):
+        """ Makes read() return as soon as fd is readable
+
+        :param fd: a file descriptor, such as the one of a channel.Wakeup
+        """
+        self._poller.register(fd, select.POLLIN)
+
+    def _block_ready(self):
+        off = self._cur * self._block_size
+        status = _STATUS.unpack_from(self._map, off + _BLOCK_STATUS_OFF)[0]
+        return status & TP_STATUS_USER != 0
+
+    def _read_block(self, out, meta):
+        mm = self._map
+        blk = self._cur * self._block_size
+        _, num_pkts, first = _BLOCK_HDR.unpack_from(mm,
+                                                    blk + _BLOCK_STATUS_OFF)
+        off = blk + first
+        unpack_from = _FRAME_HDR.unpack_from
+        for _ in range(num_pkts):
+            nxt, sec, nsec, snaplen, wirelen, _, mac = unpack_from(mm, off)
+            out.append(mm[off + mac:off + mac + snaplen])
+            if meta is not None:
+                ifindex = _IFINDEX.unpack_from(mm, off + _SLL_IFINDEX_OFF)[0]
+                meta.append((sec * 1000000000 + nsec, wirelen, ifindex))
+            off += nxt
+        # give the block back to the kernel
+        _STATUS.pack_into(mm, blk + _BLOCK_STATUS_OFF, TP_STATUS_KERNEL)
+        self._cur = (self._cur + 1) % self._block_nr
+
+    def read(self, timeout=None, meta=None):
+        """ Returns the frames of all the blocks ready in the ring
+
+        :param timeout: maximum number of seconds to wait for a block; None
+            to wait forever
+        :param meta: None, or a list to which the (ts_ns, wirelen, ifindex)
+            capture metadata of each returned frame is appended
+        :return: a possibly empty list of frames, as bytes
+        """
+        frames = []
+        if not self._block_ready():
+            self._poller.poll(None if timeout is None else timeout * 1000)
+        for _ in range(self._block_nr):
+            if not self._block_ready():
+                break
+            self._read_block(frames, meta)
+        return frames
+
+    def ring_fill(self):
+        """ Returns the fraction of the blocks of the ring that are filled
+        and waiting to be read
+        """
+        ready = 0
+        for i in range(self._block_nr):
+            status = _STATUS.unpack_from(
+                self._map, i * self._block_size + _BLOCK_STATUS_OFF)[0]
+            if status & TP_STATUS_USER:
+                ready += 1
+        return ready / float(self._block_nr)
+
+    def stats(self):
+        """ Returns the number of frames received and dropped by the kernel
+        since the socket was opened
+        """
+        raw = self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS,
+                                    _STATS.size)
+        packets, drops, _ = _STATS.unpack(raw)
+        # reading the statistics resets the kernel counters
+        self._packets += packets
+        self._drops += drops
+        return self._packets, self._drops
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class RawSender(object):
+    """ AF_PACKET socket sending frames through a TPACKET_V2 TX mmap ring
+
+    Frames are copied into the slots of the ring, which the kernel sends
+    all at once on the next send() call: a whole list of frames costs a
+    single system call. If the TX ring cannot be set up, frames are sent
+    with one send() call each.
+
+    Once a TX ring is set up, the kernel only sends the slots of the ring
+    on its socket: frames larger than a slot are sent through a second
+    socket, without a ring.
+    """
+
+    def __init__(self, iface, frame_size=2048, frame_nr=256):
+        """
+        :param iface: the name of the interface to send on
+        :param frame_size: size of a ring slot, a power of two; larger frames
+            are sent without the ring
+        :param frame_nr: number of slots in the ring
+        @raise OSError if the socket cannot be created, e.g. missing
+            CAP_NET_RAW
+        """
+        self._frame_size = frame_size
+        self._frame_nr = frame_nr
+        self._max_len = frame_size - _TX_DATA_OFF
+        self._cur = 0
+        self._map = None
+        self._direct = None
+        self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            self._sock.bind((iface, 0))
+        except Exception:
+            self.close()
+            raise
+        self._iface = iface
+        try:
+            self._sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+            # the ring is a single block; frame_size * frame_nr must not
+            # exceed the maximum allocation size of the kernel
+            req = struct.pack('IIII', frame_size * frame_nr, 1, frame_size,
+                              frame_nr)
+            self._sock.setsockopt(SOL_PACKET, PACKET_TX_RING, req)
+            self._map = mmap.mmap(self._sock.fileno(), frame_size * frame_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        except OSError:
+            self._map = None
+        if self._map is None:
+            self._direct = self._sock
+        self._poller = select.poll()
+        self._poller.register(self._sock.fileno(), select.POLLOUT)
+
+    @property
+    def has_ring(self):
+        return self._map is not None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def _slot_free(self, off):
+        status = _STATUS.unpack_from(self._map, off)[0]
+        return status & (TP_STATUS_SEND_REQUEST | TP_STATUS_SENDING) == 0
+
+    def _send_direct(self, frame):
+        if self._direct is None:
+            # opened on the first frame too large for the ring
+            self._direct = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                         0)
+            self._direct.bind((self._iface, 0))
+        self._direct.send(frame)
+
+    def _kick(self):
+        # blocks until the kernel has sent all the requested slots
+        self._sock.send(b'')
+
+    def send_many(self, frames):
+        """ Sends frames, in order
+
+        :param frames: an iterable of bytes-like objects
+        :return: the number of frames sent
+        @raise OSError if the frames cannot be sent, e.g. the interface is
+            down
+        """
+        sent = 0
+        pending = 0
+        for frame in frames:
+            if self._map is None or len(frame) > self._max_len:
+                if pending > 0:
+                    self._kick()
+                    pending = 0
+                self._send_direct(frame)
+                sent += 1
+                continue
+            off = self._cur * self._frame_size
+            while not self._slot_free(off):
+                if pending > 0:
+                    self._kick()
+                    pending = 0
+                else:
+                    self._poller.poll(100)
+            n = len(frame)
+            self._map[off + _TX_DATA_OFF:off + _TX_DATA_OFF + n] = frame
+            _TX_HDR.pack_into(self._map, off, TP_STATUS_SEND_REQUEST, n)
+            self._cur = (self._cur + 1) % self._frame_nr
+            pending += 1
+            sent += 1
+            if pending == self._frame_nr:
+                self._kick()
+                pending = 0
+        if pending > 0:
+            self._kick()
+        return sent
+
+    def send(self, frame):
+        return self.send_many((frame,))
+
+    def close(self):
+        if self._direct is not None and self._direct is not self._sock:
+            self._direct.close()
+        self._direct = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,232 @@
+import array
+import time
+
+
+class FrameRecord(object):
+    """ A captured frame along with its capture metadata """
+    __slots__ = ('data', 'ts_ns', 'wirelen', 'ifindex', 'ifname')
+
+    def __init__(self, data, ts_ns=None, wirelen=None, ifindex=None,
+                 ifname=None):
+        """
+        :param data: the captured bytes of the frame
+        :param ts_ns: the capture time, in nanoseconds since the epoch, or
+            None if unknown
+        :param wirelen: the length of the frame on the wire, which exceeds
+            caplen if the frame was truncated; len(data) if None
+        :param ifindex: the index of the interface the frame was captured
+            on, or None if unknown; negative for the interfaces of a file
+            that do not exist on this host
+        :param ifname: the name of that interface, if not the local name of
+            ifindex, e.g. as read from a pcapng file
+        """
+        self.data = data
+        self.ts_ns = ts_ns
+        self.wirelen = len(data) if wirelen is None else wirelen
+        self.ifindex = ifindex
+        self.ifname = ifname
+
+    @property
+    def caplen(self):
+        return len(self.data)
+
+    def __getstate__(self):
+        return self.data, self.ts_ns, self.wirelen, self.ifindex, self.ifname
+
+    def __setstate__(self, state):
+        (self.data, self.ts_ns, self.wirelen, self.ifindex,
+         self.ifname) = state
+
+
+class FrameBatch(object):
+    """ Several frames packed into a single buffer, sent as one message
+
+    Sending a batch instead of each frame separately amortizes the cost of
+    a channel write, and of pickling for the channels that cross a process
+    boundary, over all the frames of the batch.
+
+    The capture metadata of the frames, if any, is stored in arrays parallel
+    to the offsets, rather than in a FrameRecord per frame.
+    """
+    __slots__ = ('buf', 'offsets', 'ts_ns', 'wirelen', 'ifindex')
+
+    def __init__(self, buf, offsets, ts_ns=None, wirelen=None,
+                 ifindex=None):
+        """
+        :param buf: the frames, concatenated
+        :param offsets: an array of len(self) + 1 offsets; frame i spans
+            from offsets[i] to offsets[i + 1]
+        :param ts_ns: None, or an array of the capture times of the frames,
+            0 if unknown
+        :param wirelen: None, or an array of the wire lengths of the frames
+        :param ifindex: None, or an array of the interface indexes of the
+            frames, 0 if unknown
+        """
+        self.buf = buf
+        self.offsets = offsets
+        self.ts_ns = ts_ns
+        self.wirelen = wirelen
+        self.ifindex = ifindex
+
+    @classmethod
+    def pack(cls, frames, meta=None):
+        """ Builds a batch from a list of frames
+
+        :param frames: a list of bytes-like objects
+        :param meta: None, or a list of (ts_ns, wirelen, ifindex) tuples,
+            one per frame
+        """
+        offsets = array.array('I', [0])
+        end = 0
+        for f in frames:
+            end += len(f)
+            offsets.append(end)
+        if meta is None:
+            return cls(b''.join(frames), offsets)
+        return cls(
+            b''.join(frames), offsets,
+            array.array('Q', [m[0] for m in meta]),
+            array.array('I', [m[1] for m in meta]),
+            array.array('i', [m[2] for m in meta]),
+        )
+
+    def record(self, i):
+        """ Returns the i-th frame as a FrameRecord """
+        if self.ts_ns is None:
+            return FrameRecord(self[i])
+        return FrameRecord(self[i], self.ts_ns[i], self.wirelen[i],
+                           self.ifindex[i])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('frame index out of range')
+        return self.buf[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        buf, offsets = self.buf, self.offsets
+        for i in range(len(offsets) - 1):
+            yield buf[offsets[i]:offsets[i + 1]]
+
+    def __getstate__(self):
+        return self.buf, self.offsets, self.ts_ns, self.wirelen, self.ifindex
+
+    def __setstate__(self, state):
+        (self.buf, self.offsets, self.ts_ns, self.wirelen,
+         self.ifindex) = state
+
+
+def iter_frames(msgs):
+    """ Iterates over the frames of a list of messages, each of which is
+    either a frame, a FrameRecord or a FrameBatch
+    """
+    for msg in msgs:
+        if isinstance(msg, FrameBatch):
+            for frame in msg:
+                yield frame
+        elif isinstance(msg, FrameRecord):
+            yield msg.data
+        else:
+            yield msg
+
+
+def iter_records(msgs):
+    """ Iterates over the frames of a list of messages as FrameRecord
+    instances, whose metadata is None if the messages have none
+    """
+    for msg in msgs:
+        if isinstance(msg, FrameBatch):
+            for i in range(len(msg)):
+                yield msg.record(i)
+        elif isinstance(msg, FrameRecord):
+            yield msg
+        else:
+            yield FrameRecord(msg)
+
+
+def capture_ts(msg):
+    """ Returns the capture time of the first frame of a message, in
+    nanoseconds since the epoch, or None if unknown
+    """
+    if isinstance(msg, FrameRecord):
+        return msg.ts_ns
+    if isinstance(msg, FrameBatch) and msg.ts_ns:
+        return msg.ts_ns[0] or None
+    return None
+
+
+class FrameBatcher(object):
+    """ Pipe-like object accumulating frames and sending them as FrameBatch
+    messages
+
+    A batch is sent as soon as it holds max_frames frames or max_bytes
+    bytes, when flush() is called, or when tick() is called more than
+    timeout seconds after the first frame of the batch was added.
+    """
+
+    def __init__(self, pipe, max_frames=64, max_bytes=1 << 18,
+                 timeout=0.01, metadata=False):
+        """
+        :param pipe: the pipe end in which the batches are sent
+        :param max_frames: maximum number of frames per batch
+        :param max_bytes: maximum size of a batch, in bytes
+        :param timeout: maximum number of seconds a frame waits for its
+            batch to be sent, provided that tick() is called often enough
+        :param metadata: whether the batches carry the capture metadata
+            given to send_record
+        """
+        self.pipe = pipe
+        self._max_frames = max_frames
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._frames = []
+        self._meta = [] if metadata else None
+        self._size = 0
+        self._deadline = None
+
+    def send_record(self, frame, ts_ns, wirelen, ifindex):
+        """ Adds a frame along with its capture metadata """
+        if self._meta is not None:
+            self._meta.append((ts_ns, wirelen, ifindex))
+        self._add(frame)
+
+    def send(self, frame):
+        """ Adds a frame whose capture metadata is unknown """
+        if self._meta is not None:
+            self._meta.append((0, len(frame), 0))
+        self._add(frame)
+
+    def _add(self, frame):
+        if len(self._frames) == 0:
+            self._deadline = time.monotonic() + self._timeout
+        self._frames.append(frame)
+        self._size += len(frame)
+        if (
+            len(self._frames) >= self._max_frames
+            or self._size >= self._max_bytes
+        ):
+            self.flush()
+
+    def tick(self):
+        """ Sends the pending batch if its time budget is exhausted """
+        if len(self._frames) > 0 and time.monotonic() >= self._deadline:
+            self.flush()
+
+    def flush(self):
+        """ Sends the pending frames, if any """
+        if len(self._frames) == 0:
+            return
+        frames, meta = self._frames, self._meta
+        self._frames = []
+        if meta is not None:
+            self._meta = []
+        self._size = 0
+        self.pipe.send(FrameBatch.pack(frames, meta))
+
+    def close(self):
+        self.flush()
+        self.pipe.close()
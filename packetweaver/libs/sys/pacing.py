@@ -0,0 +1,169 @@
+import time
+
+# below this number of seconds, waits spin on the clock instead of sleeping,
+# since sleeps may last a scheduler tick longer than requested
+_SPIN_THRESHOLD = 0.002
+
+
+def wait_until(deadline, stop_evt=None, clock=time.perf_counter):
+    """ Waits until clock() reaches deadline, sleeping then spinning for
+    the last _SPIN_THRESHOLD seconds
+
+    :param deadline: the time to wait for, as returned by clock
+    :param stop_evt: an optional object whose wait(timeout) method returns
+        True once the wait must be interrupted, such as a threading.Event
+        or a channel.Wakeup
+    :param clock: function returning the current time, in seconds
+    :return: False if the wait was interrupted by stop_evt
+    """
+    while True:
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return True
+        if remaining > _SPIN_THRESHOLD:
+            delay = remaining - _SPIN_THRESHOLD
+            if stop_evt is None:
+                time.sleep(delay)
+            elif stop_evt.wait(delay):
+                return False
+
+
+class TokenBucket(object):
+    """ Token bucket refilled at a constant rate, up to its capacity
+
+    Costs larger than the capacity are accepted as soon as the bucket is
+    full, leaving it in debt, so that any frame eventually goes through.
+    """
+
+    def __init__(self, rate, capacity, now):
+        """
+        :param rate: number of tokens added per second
+        :param capacity: maximum number of tokens in the bucket
+        :param now: the current time, in seconds; the bucket starts full
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = now
+
+    def reserve(self, cost, now):
+        """ Takes cost tokens from the bucket, as soon as possible
+
+        :param cost: the number of tokens
+        :param now: the current time, in seconds
+        :return: the time at which the tokens are available, >= now
+        """
+        tokens = min(self.capacity,
+                     self._tokens + (now - self._last) * self.rate)
+        need = min(cost, self.capacity)
+        at = now
+        if tokens < need:
+            at += (need - tokens) / self.rate
+            tokens = need
+        self._tokens = tokens - cost
+        self._last = at
+        return at
+
+
+class Pacer(object):
+    """ Splits lists of frames into chunks sent no faster than a frame rate
+    and a bit rate, and measures the achieved rates
+
+    The frame bucket holds burst frames, so that up to burst frames are
+    sent back to back before the rate applies; the bit bucket holds as
+    many bits as burst frames of 1514 bytes. A rate of 0 is not limited.
+    """
+
+    def __init__(self, pps=0, bps=0, burst=1, clock=time.perf_counter):
+        """
+        :param pps: maximum number of frames per second; 0 for no limit
+        :param bps: maximum number of bits of frame data per second; 0 for
+            no limit
+        :param burst: maximum number of frames sent back to back
+        :param clock: function returning the current time, in seconds
+        """
+        self._clock = clock
+        now = clock()
+        burst = max(1, int(burst))
+        self._buckets = []
+        if pps > 0:
+            self._buckets.append((TokenBucket(pps, burst, now), False))
+        if bps > 0:
+            self._buckets.append(
+                (TokenBucket(bps, burst * 1514 * 8, now), True)
+            )
+        self.frames = 0
+        self.bytes = 0
+        self._first = None
+        self._first_chunk = (0, 0)
+        self._last = None
+
+    def _reserve(self, frame_len):
+        now = self._clock()
+        at = now
+        for bucket, bits in self._buckets:
+            at = max(at, bucket.reserve(frame_len * 8 if bits else 1, now))
+        return at
+
+    def _count(self, chunk):
+        now = self._clock()
+        size = sum(len(f) for f in chunk)
+        if self._first is None:
+            self._first = now
+            self._first_chunk = (len(chunk), size)
+        self._last = now
+        self.frames += len(chunk)
+        self.bytes += size
+
+    def pace(self, frames, stop_evt=None):
+        """ Yields the frames in chunks, each of which is due right away
+
+        :param frames: an iterable of bytes-like objects
+        :param stop_evt: see wait_until; the remaining frames are dropped
+            as soon as it interrupts a wait
+        """
+        chunk = []
+        for frame in frames:
+            if len(self._buckets) > 0:
+                deadline = self._reserve(len(frame))
+                if deadline > self._clock():
+                    if len(chunk) > 0:
+                        self._count(chunk)
+                        yield chunk
+                        chunk = []
+                    if not wait_until(deadline, stop_evt, self._clock):
+                        return
+            chunk.append(frame)
+        if len(chunk) > 0:
+            self._count(chunk)
+            yield chunk
+
+    def stats(self):
+        """ Returns the number of frames and bytes released, and the rates
+        achieved between the first and the last chunk
+        """
+        elapsed = 0.0
+        if self._first is not None:
+            elapsed = self._last - self._first
+        if elapsed <= 0:
+            return {'frames': self.frames, 'bytes': self.bytes,
+                    'elapsed': 0.0, 'pps': 0.0, 'bps': 0.0}
+        # the frames of the first chunk were released at the start of the
+        # measured period
+        first_frames, first_bytes = self._first_chunk
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'elapsed': elapsed,
+            'pps': (self.frames - first_frames) / elapsed,
+            'bps': (self.bytes - first_bytes) * 8 / elapsed,
+        }
+
+    @staticmethod
+    def format(values):
+        """ Formats the values returned by stats for display """
+        return (
+            '{} frames, {} B sent in {:.3f}s: {:.0f} frames/s, {:.0f} '
+            'bits/s'.format(values['frames'], values['bytes'],
+                            values['elapsed'], values['pps'], values['bps'])
+        )
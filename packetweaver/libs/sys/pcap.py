@@ -4,32 +4,437 @@ try:
 except ImportError:
     HAS_PCAPY = False
 
+import collections
+import itertools
+import os
+import select
+import socket
 import threading
 import multiprocessing
 import traceback
 import time
 import logging
+from packetweaver.core.models.abilities import channel
+from packetweaver.libs.sys import af_packet
+from packetweaver.libs.sys.af_packet import HAS_AF_PACKET
+from packetweaver.libs.sys.frame_batch import FrameBatcher, FrameRecord, \
+    iter_frames
 logger_pcap = logging.getLogger(__name__)
 
+# maximum number of seconds a blocked capture thread stays idle, so that its
+# statistics are refreshed
+_IDLE_TIMEOUT = 1.0
+
+# default snaplen of the captures
+SNAPLEN = 65535
+# snaplen of the captures keeping only the headers of the frames, enough for
+# VLAN tags, IPv6 extension headers and TCP options in most cases
+HEADERS_SNAPLEN = 256
+
+_ETH_P_IP = 0x0800
+_ETH_P_IPV6 = 0x86dd
+_ETH_P_VLAN = (0x8100, 0x88a8)
+_IPV6_EXT_HEADERS = (0, 43, 60)
+_IPV6_FRAGMENT = 44
+_IPPROTO_TCP = 6
+# UDP, ICMP and ICMPv6 have an 8-byte header
+_IPPROTO_8B_HEADER = (17, 1, 58)
+# TCP and UDP, whose headers start with the source and destination ports
+_IPPROTO_PORTS = (6, 17)
+
+CAPTURE_ENGINE_PCAPY = 'pcapy'
+CAPTURE_ENGINE_AF_PACKET = 'af_packet'
+CAPTURE_ENGINES = [CAPTURE_ENGINE_PCAPY, CAPTURE_ENGINE_AF_PACKET]
+FANOUT_MODES = sorted(af_packet.FANOUT_MODES)
+
+
+def _walk_headers(frame):
+    """ Skips the Ethernet, VLAN and IP headers of a frame
+
+    :param frame: an Ethernet frame, as bytes
+    :return: the offset of the IP header, the IP protocol of the transport
+        header, or None if the frame is not an IP one, and the offset of the
+        transport header, or of the IP header if the frame is not an IP one
+    @raise IndexError if the frame is truncated
+    """
+    off = 14
+    ethertype = (frame[12] << 8) | frame[13]
+    while ethertype in _ETH_P_VLAN:
+        ethertype = (frame[off + 2] << 8) | frame[off + 3]
+        off += 4
+    ip_off = off
+    if ethertype == _ETH_P_IP:
+        proto = frame[off + 9]
+        off += (frame[off] & 0x0f) * 4
+    elif ethertype == _ETH_P_IPV6:
+        proto = frame[off + 6]
+        off += 40
+        while proto in _IPV6_EXT_HEADERS or proto == _IPV6_FRAGMENT:
+            if proto == _IPV6_FRAGMENT:
+                ext_len = 8
+            else:
+                ext_len = (frame[off + 1] + 1) * 8
+            proto = frame[off]
+            off += ext_len
+    else:
+        return ip_off, None, off
+    return ip_off, proto, off
+
+
+def headers_length(frame):
+    """ Returns the length of the Ethernet, IP and transport headers of a
+    frame, or of the headers that could be parsed
+
+    :param frame: an Ethernet frame, as bytes
+    """
+    try:
+        _, proto, off = _walk_headers(frame)
+        if proto == _IPPROTO_TCP:
+            off += (frame[off + 12] >> 4) * 4
+        elif proto in _IPPROTO_8B_HEADER:
+            off += 8
+    except IndexError:
+        return len(frame)
+    return min(off, len(frame))
+
+
+def flow_key(frame):
+    """ Returns the 5-tuple of a frame: source and destination addresses,
+    source and destination ports, and IP protocol
+
+    Ports are 0 for the protocols other than TCP and UDP.
+
+    :param frame: an Ethernet frame, as bytes
+    :return: the 5-tuple, or None if the frame is not an IP one or is
+        truncated
+    """
+    try:
+        ip_off, proto, off = _walk_headers(frame)
+        if proto is None:
+            return None
+        if frame[ip_off] >> 4 == 4:
+            src = bytes(frame[ip_off + 12:ip_off + 16])
+            dst = bytes(frame[ip_off + 16:ip_off + 20])
+        else:
+            src = bytes(frame[ip_off + 8:ip_off + 24])
+            dst = bytes(frame[ip_off + 24:ip_off + 40])
+        sport = dport = 0
+        if proto in _IPPROTO_PORTS:
+            sport = (frame[off] << 8) | frame[off + 1]
+            dport = (frame[off + 2] << 8) | frame[off + 3]
+    except IndexError:
+        return None
+    return src, dst, sport, dport, proto
+
+
+def _capture_snaplen(snaplen, headers_only):
+    if headers_only:
+        return min(snaplen or SNAPLEN, HEADERS_SNAPLEN)
+    return snaplen or SNAPLEN
+
+
+class StopEvent(threading.Event):
+    """ Event stopping a capture thread, selectable so that the thread
+    blocks on its capture handle instead of polling it
+    """
+
+    def __init__(self):
+        super(StopEvent, self).__init__()
+        self._wakeup = channel.Wakeup()
+
+    def set(self):
+        super(StopEvent, self).set()
+        self._wakeup.set()
+
+    def fileno(self):
+        """ Returns a file descriptor readable once the event is set """
+        return self._wakeup.fileno()
+
+
+class CaptureStats(object):
+    """ Kernel counters of a capture, refreshed by the capture thread at
+    most every interval seconds and when it stops, and readable from any
+    other thread
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._next_refresh = 0
+        # replaced as a whole, so that readers get a consistent snapshot
+        self._values = {
+            'received': 0,
+            'dropped': 0,
+            'if_dropped': 0,
+            'ring_fill': None,
+        }
+
+    def refresh(self, getter, force=False):
+        """ Updates the counters if they are due for a refresh
+
+        :param getter: a callable returning the dict of the new counters
+        :param force: whether to refresh regardless of the interval
+        """
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        self._next_refresh = now + self.interval
+        try:
+            self._values = getter()
+        except Exception as e:
+            logger_pcap.debug('Capture statistics unavailable: {}'.format(e))
+
+    def as_dict(self):
+        """
+        :return: a dict with the number of frames received by the kernel,
+            including the dropped ones (received), dropped by the kernel for
+            lack of buffer space (dropped), dropped by the interface
+            (if_dropped), and the fraction of the ring waiting to be read
+            (ring_fill; None with pcapy)
+        """
+        return dict(self._values)
+
+    @staticmethod
+    def merge(l_stats):
+        """ Sums the counters of several captures, and keeps the highest
+        ring fill level
+        """
+        ret = CaptureStats().as_dict()
+        for st in l_stats:
+            values = st.as_dict()
+            for k in ('received', 'dropped', 'if_dropped'):
+                ret[k] += values[k]
+            if values['ring_fill'] is not None:
+                ret['ring_fill'] = max(ret['ring_fill'] or 0,
+                                       values['ring_fill'])
+        return ret
+
+    @staticmethod
+    def format(values):
+        """ Formats the values returned by as_dict or merge for display """
+        ret = (
+            '{} frames received, {} dropped by the kernel, {} dropped by '
+            'the interface'.format(values['received'], values['dropped'],
+                                   values['if_dropped'])
+        )
+        if values['ring_fill'] is not None:
+            ret += ', ring {:.0%} full'.format(values['ring_fill'])
+        return ret
+
+
+def _af_packet_stats(sock):
+    received, dropped = sock.stats()
+    return {
+        'received': received,
+        'dropped': dropped,
+        'if_dropped': 0,
+        'ring_fill': sock.ring_fill(),
+    }
+
+
+def _pcapy_stats(h):
+    received, dropped, if_dropped = h.stats()
+    return {
+        'received': received,
+        'dropped': dropped,
+        'if_dropped': if_dropped,
+        'ring_fill': None,
+    }
+
+
+def select_capture_engine(engine=None):
+    """ Returns the capture engine to use, given the requested one
+
+    pcapy is the default engine and the fallback whenever the AF_PACKET
+    engine is not supported on this system. AF_PACKET is used if pcapy is
+    missing.
+
+    :param engine: one of CAPTURE_ENGINES, or None for the default engine
+    :return: one of CAPTURE_ENGINES
+    @raise ValueError if the engine is unknown
+    """
+    if engine is None:
+        engine = CAPTURE_ENGINE_PCAPY
+    if engine not in CAPTURE_ENGINES:
+        raise ValueError('Unknown capture engine [{}]'.format(engine))
+    if engine == CAPTURE_ENGINE_AF_PACKET and not HAS_AF_PACKET:
+        logger_pcap.warning('AF_PACKET is not supported: falling back to '
+                            'pcapy')
+        engine = CAPTURE_ENGINE_PCAPY
+    elif engine == CAPTURE_ENGINE_PCAPY and not HAS_PCAPY and HAS_AF_PACKET:
+        engine = CAPTURE_ENGINE_AF_PACKET
+    return engine
+
+
+def af_packet_capture_thread(stop_evt, pkts_pipe, iface, bpf=None,
+                             buf_access_timeout=0.1, fanout=None,
+                             capture_stats=None, snaplen=None,
+                             headers_only=False):
+    """ Captures frames through a TPACKET_V3 ring, falling back to pcapy
+    if the AF_PACKET socket cannot be opened
+
+    :param buf_access_timeout: maximum number of seconds between two checks
+        of stop_evt, unless it is a StopEvent, which interrupts the wait for
+        frames as soon as it is set
+    :param fanout: an optional af_packet.fanout_arg value; there is no
+        fallback in that case, since the other members of the group would
+        miss the frames of this one
+
+    As with capture_thread, frames are sent with pkts_pipe.send_record if
+    pkts_pipe has such a method, capture_stats is refreshed if given, and
+    frames are truncated according to snaplen and headers_only.
+    """
+    try:
+        sock = af_packet.TPacketV3Socket(
+            iface, bpf, fanout=fanout,
+            snaplen=_capture_snaplen(snaplen, headers_only)
+        )
+    except OSError as e:
+        if not HAS_PCAPY or fanout is not None:
+            logger_pcap.warning('AF_PACKET capture on [{}] failed: '
+                                '{}'.format(iface, e))
+            stop_evt.set()
+            return
+        logger_pcap.warning(
+            'AF_PACKET capture on [{}] failed ({}): falling back to '
+            'pcapy'.format(iface, e)
+        )
+        return capture_thread(stop_evt, pkts_pipe, iface, bpf,
+                              capture_stats=capture_stats, snaplen=snaplen,
+                              headers_only=headers_only)
+    except ValueError as e:
+        logger_pcap.warning('AF_PACKET capture on [{}] failed: {}'.format(
+            iface, e))
+        stop_evt.set()
+        return
+    if hasattr(stop_evt, 'fileno'):
+        sock.add_wakeup(stop_evt.fileno())
+        buf_access_timeout = _IDLE_TIMEOUT
+    try:
+        logger_pcap.debug('AF_PACKET capture started')
+        send_record = getattr(pkts_pipe, 'send_record', None)
+        meta = None if send_record is None else []
+        while not stop_evt.is_set():
+            frames = sock.read(buf_access_timeout, meta)
+            if headers_only:
+                frames = [f[:headers_length(f)] for f in frames]
+            if send_record is None:
+                for frame in frames:
+                    pkts_pipe.send(frame)
+            else:
+                for frame, m in zip(frames, meta):
+                    send_record(frame, *m)
+                del meta[:]
+            # the kernel already batched the frames of a block, within its
+            # block timeout
+            if len(frames) > 0:
+                _flush(pkts_pipe)
+            if capture_stats is not None:
+                capture_stats.refresh(lambda: _af_packet_stats(sock))
+        _flush(pkts_pipe)
+        logger_pcap.debug('AF_PACKET capture ended')
+    except (EOFError, IOError):
+        logger_pcap.warning('AF_PACKET capture traffic failed')
+        traceback.print_exc()
+        stop_evt.set()
+    finally:
+        if capture_stats is not None:
+            capture_stats.refresh(lambda: _af_packet_stats(sock), True)
+        sock.close()
+
+
+def _flush(pkts_pipe):
+    if hasattr(pkts_pipe, 'flush'):
+        pkts_pipe.flush()
+
+
+def _tick(pkts_pipe):
+    if hasattr(pkts_pipe, 'tick'):
+        pkts_pipe.tick()
+
+
+def _ifindex(iface):
+    try:
+        return socket.if_nametoindex(iface)
+    except OSError:
+        return 0
+
+
+def _pcapy_poller(h, stop_evt):
+    """ Returns a poll object watching the capture handle and the stop
+    event, or None if either is not selectable
+    """
+    if not hasattr(stop_evt, 'fileno'):
+        return None
+    try:
+        fd = h.getfd()
+    except (AttributeError, pcapy.PcapError):
+        return None
+    if fd < 0:
+        return None
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    poller.register(stop_evt.fileno(), select.POLLIN)
+    return poller
+
 
 def capture_thread(stop_evt, pkts_pipe, iface,
-                   bpf=None, buf_access_timeout=0.01):
+                   bpf=None, buf_access_timeout=0.01, capture_stats=None,
+                   blocking=True, snaplen=None, headers_only=False):
+    """ Captures frames with pcapy
+
+    Frames are sent with pkts_pipe.send_record, along with their capture
+    metadata, if pkts_pipe has such a method, and with pkts_pipe.send
+    otherwise.
+
+    :param buf_access_timeout: number of seconds to sleep whenever the
+        capture buffer is empty, when not blocking
+    :param capture_stats: an optional CaptureStats to refresh
+    :param blocking: whether to block on the selectable file descriptor of
+        the handle until frames are available or stop_evt is set, which
+        requires stop_evt to be a StopEvent; the handle is polled every
+        buf_access_timeout otherwise
+    :param snaplen: the maximum number of bytes of a frame that are
+        captured; SNAPLEN if None
+    :param headers_only: whether the frames are truncated right after their
+        transport header, see headers_length
+    """
+    send_record = getattr(pkts_pipe, 'send_record', None)
+    ifindex = _ifindex(iface)
     try:
         logger_pcap.debug('Pcapy open_live call')
-        h = pcapy.open_live(iface, 65535, 1, 1)
+        h = pcapy.open_live(iface, _capture_snaplen(snaplen, headers_only),
+                            1, 1)
         # making h.next() call non blocking, (hdr=None, _) is returned instead
         h.setnonblock(1)
         if not isinstance(bpf, type(None)):
             h.setfilter(bpf)
+        poller = _pcapy_poller(h, stop_evt) if blocking else None
         while not stop_evt.is_set():
             hdr, payld = h.next()
             # do not block on an empty packet buffer
             if hdr is not None:
-                if not isinstance(hdr, type(None)):
+                if headers_only:
+                    payld = payld[:headers_length(payld)]
+                if send_record is None:
                     pkts_pipe.send(payld)
+                else:
+                    sec, usec = hdr.getts()
+                    send_record(payld, sec * 1000000000 + usec * 1000,
+                                hdr.getlen(), ifindex)
+                _tick(pkts_pipe)
             else:
-                # wait some times before trying to access the buffer again
-                time.sleep(buf_access_timeout)
+                _flush(pkts_pipe)
+                if poller is not None:
+                    poller.poll(_IDLE_TIMEOUT * 1000)
+                else:
+                    # wait some times before trying to access the buffer
+                    # again
+                    time.sleep(buf_access_timeout)
+            if capture_stats is not None:
+                capture_stats.refresh(lambda: _pcapy_stats(h))
+        _flush(pkts_pipe)
+        if capture_stats is not None:
+            capture_stats.refresh(lambda: _pcapy_stats(h), True)
         h.close()
         logger_pcap.debug('Pcapy open_live ended')
         h = None
@@ -39,41 +444,419 @@ def capture_thread(stop_evt, pkts_pipe, iface,
         stop_evt.set()
 
 
-def start_capture(iface, bpf=None, in_pkt_pipe=None):
-    stop_evt = threading.Event()
+def start_capture(iface, bpf=None, in_pkt_pipe=None, engine=None,
+                  capture_stats=None, blocking=True, snaplen=None,
+                  headers_only=False):
+    """ Starts a thread capturing the frames of iface
+
+    :param iface: the name of the interface to capture on
+    :param bpf: an optional BPF filter expression
+    :param in_pkt_pipe: the pipe end in which the frames are sent; a new
+        pipe is created if None
+    :param engine: one of CAPTURE_ENGINES; see select_capture_engine
+    :param capture_stats: an optional CaptureStats, refreshed with the
+        kernel counters of the capture
+    :param blocking: with pcapy, whether the thread blocks until frames are
+        available instead of polling the handle; see capture_thread
+    :param snaplen: the maximum number of bytes of a frame that are
+        captured; SNAPLEN if None
+    :param headers_only: whether the frames are truncated right after their
+        transport header, see headers_length
+    :return: the thread, its StopEvent and the receiving end of the pipe
+        created if in_pkt_pipe was None
+    """
+    stop_evt = StopEvent()
+    engine = select_capture_engine(engine)
+    kwargs = {'capture_stats': capture_stats, 'snaplen': snaplen,
+              'headers_only': headers_only}
+    if engine == CAPTURE_ENGINE_AF_PACKET:
+        target = af_packet_capture_thread
+    else:
+        target = capture_thread
+        kwargs['blocking'] = blocking
     if isinstance(in_pkt_pipe, type(None)):
         pp, cp = multiprocessing.Pipe()
-        t = threading.Thread(target=capture_thread,
+        t = threading.Thread(target=target,
                              name='Packet Capture',
-                             args=(stop_evt, cp, iface, bpf))
+                             args=(stop_evt, cp, iface, bpf),
+                             kwargs=kwargs)
     else:
         pp = None
-        t = threading.Thread(target=capture_thread,
+        t = threading.Thread(target=target,
                              name='Packet Capture',
-                             args=(stop_evt, in_pkt_pipe, iface, bpf))
+                             args=(stop_evt, in_pkt_pipe, iface, bpf),
+                             kwargs=kwargs)
 
     t.start()
-    logger_pcap.debug('Run pcapy capture thread on iface [{}]'.format(iface))
+    logger_pcap.debug('Run {} capture thread on iface [{}]'.format(
+        engine, iface))
     return t, stop_evt, pp
 
 
-def sending_raw_traffic_thread(stop_evt, poller, receiver, iface):
+class _RecordSender(object):
+    """ Pipe-like object sending frames as FrameRecord instances """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def send(self, frame):
+        self.pipe.send(FrameRecord(frame))
+
+    def send_record(self, frame, ts_ns, wirelen, ifindex):
+        self.pipe.send(FrameRecord(frame, ts_ns, wirelen, ifindex))
+
+
+class _FanOut(object):
+    """ Pipe-like object sending each frame to several consumer pipes
+
+    A consumer whose pipe is closed is dropped; EOFError is raised once no
+    consumer is left, which stops the capture thread.
+    """
+
+    def __init__(self, pipes=(), shared=False, batch_size=1,
+                 batch_timeout=0.01, metadata=False):
+        """
+        :param pipes: the consumer pipes
+        :param shared: whether several capture threads send frames through
+            this object, in which case the sends are serialized
+        :param batch_size: see add
+        :param batch_timeout: see add
+        :param metadata: see add
+        """
+        # (pipe, sender) pairs, replaced and never mutated, so that the
+        # capture thread iterates over a consistent tuple without holding a
+        # lock
+        self._members = ()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock() if shared else None
+        self.add(pipes, batch_size, batch_timeout, metadata)
+
+    def add(self, pipes, batch_size=1, batch_timeout=0.01, metadata=False):
+        """ Adds consumers
+
+        :param pipes: the consumer pipes
+        :param batch_size: maximum number of frames sent in a single
+            FrameBatch message; 1 to send each frame as its own message
+        :param batch_timeout: maximum number of seconds a frame waits for
+            its batch to be sent
+        :param metadata: whether the capture metadata of the frames is sent
+            along with them, as FrameRecord instances or in the FrameBatch
+        """
+        if batch_size > 1:
+            members = tuple(
+                (p, FrameBatcher(p, batch_size, timeout=batch_timeout,
+                                 metadata=metadata))
+                for p in pipes
+            )
+        elif metadata:
+            members = tuple((p, _RecordSender(p)) for p in pipes)
+        else:
+            members = tuple((p, p) for p in pipes)
+        with self._lock:
+            self._members += members
+
+    def remove(self, pipes):
+        """ Removes consumers and returns the number of remaining ones """
+        with self._lock:
+            self._members = tuple(
+                m for m in self._members if m[0] not in pipes
+            )
+            return len(self._members)
+
+    def _apply(self, method, *args):
+        dead = []
+        for p, sender in self._members:
+            try:
+                if hasattr(sender, method):
+                    getattr(sender, method)(*args)
+                elif method == 'send_record':
+                    # the consumer wants the frame only
+                    sender.send(args[0])
+            except (EOFError, IOError):
+                dead.append(p)
+        if len(dead) > 0 and self.remove(dead) == 0:
+            raise EOFError('No consumer left')
+
+    def _locked_apply(self, method, *args):
+        if self._send_lock is not None:
+            with self._send_lock:
+                self._apply(method, *args)
+        else:
+            self._apply(method, *args)
+
+    def send(self, frame):
+        self._locked_apply('send', frame)
+
+    def send_record(self, frame, ts_ns, wirelen, ifindex):
+        self._locked_apply('send_record', frame, ts_ns, wirelen, ifindex)
+
+    def tick(self):
+        self._locked_apply('tick')
+
+    def flush(self):
+        self._locked_apply('flush')
+
+
+class SharedCapture(object):
+    """ A capture handle and its thread, shared by all the consumers of
+    frames of an interface that use the same BPF and engine
+
+    Instances are obtained with subscribe_capture; the capture stops when
+    its last consumer unsubscribes.
+    """
+
+    def __init__(self, key, iface, bpf, engine, pipes, batch_size=1,
+                 batch_timeout=0.01, metadata=False, snaplen=None,
+                 headers_only=False):
+        self.key = key
+        self.iface = iface
+        self.engine = engine
+        self._fanout = _FanOut(pipes, batch_size=batch_size,
+                               batch_timeout=batch_timeout,
+                               metadata=metadata)
+        self.stats = CaptureStats()
+        self.thread, self.stop_evt, _ = start_capture(
+            iface, bpf, self._fanout, engine, self.stats,
+            snaplen=snaplen, headers_only=headers_only
+        )
+
+    def unsubscribe(self, pipes):
+        """ Stops sending frames into pipes, and stops the capture if no
+        other consumer is left
+
+        :param pipes: the pipes given to subscribe_capture
+        """
+        with _shared_captures_lock:
+            if self._fanout.remove(pipes) > 0:
+                return
+            if _shared_captures.get(self.key) is self:
+                del _shared_captures[self.key]
+        self.stop_evt.set()
+        self.thread.join()
+
+
+_shared_captures_lock = threading.Lock()
+_shared_captures = {}
+
+
+def _normalize_bpf(bpf):
+    if bpf is None:
+        return ''
+    return ' '.join(bpf.split())
+
+
+def subscribe_capture(iface, pipes, bpf=None, engine=None, batch_size=1,
+                      batch_timeout=0.01, metadata=False, snaplen=None,
+                      headers_only=False):
+    """ Sends the frames of iface into each of the pipes
+
+    A single capture handle and thread is opened per interface, BPF, engine
+    and truncation settings in the process; subsequent subscriptions with a
+    compatible BPF, i.e. the same expression up to whitespace, reuse it.
+
+    :param iface: the name of the interface to capture on
+    :param pipes: the pipe ends in which the frames are sent
+    :param bpf: an optional BPF filter expression
+    :param engine: one of CAPTURE_ENGINES; see select_capture_engine
+    :param batch_size: maximum number of frames sent in a single FrameBatch
+        message; 1 to send each frame as its own message
+    :param batch_timeout: maximum number of seconds a frame waits for its
+        batch to be sent
+    :param metadata: whether the capture timestamp, wire length and
+        interface index of the frames are sent along with them, as
+        FrameRecord instances or in the FrameBatch
+    :param snaplen: see start_capture
+    :param headers_only: see start_capture
+    :return: the SharedCapture, whose unsubscribe method must be called
+        with the same pipes once done
+    """
+    engine = select_capture_engine(engine)
+    bpf = _normalize_bpf(bpf)
+    snaplen = _capture_snaplen(snaplen, headers_only)
+    key = (iface, bpf, engine, snaplen, headers_only)
+    with _shared_captures_lock:
+        cap = _shared_captures.get(key)
+        if cap is not None and not cap.stop_evt.is_set():
+            cap._fanout.add(pipes, batch_size, batch_timeout, metadata)
+            logger_pcap.debug('Reuse capture handle of iface [{}]'.format(
+                iface))
+            return cap
+        cap = SharedCapture(key, iface, bpf, engine, pipes, batch_size,
+                            batch_timeout, metadata, snaplen, headers_only)
+        _shared_captures[key] = cap
+        return cap
+
+
+_fanout_groups = itertools.count(os.getpid())
+
+
+def start_fanout_capture(iface, pipes, workers, bpf=None, mode='hash',
+                         batch_size=1, batch_timeout=0.01, metadata=False,
+                         snaplen=None, headers_only=False):
+    """ Starts several AF_PACKET capture threads in a PACKET_FANOUT group,
+    so that the kernel spreads the frames of iface among them
+
+    :param iface: the name of the interface to capture on
+    :param pipes: either one pipe end per worker, in which case each worker
+        feeds its own pipe, or any other number of pipe ends, each of which
+        receives the merged frames of all the workers
+    :param workers: the number of capture threads
+    :param bpf: an optional BPF filter expression
+    :param mode: one of FANOUT_MODES; 'hash' keeps the frames of a flow on
+        the same worker, 'cpu' keeps them on the CPU that received them, and
+        'lb' round-robins the frames
+    :param batch_size: see subscribe_capture
+    :param batch_timeout: see subscribe_capture
+    :param metadata: see subscribe_capture
+    :param snaplen: see start_capture
+    :param headers_only: see start_capture
+    :return: the list of threads, their common StopEvent and the list of
+        their CaptureStats
+    @raise ValueError if the mode is unknown
+    """
+    fanout = af_packet.fanout_arg(next(_fanout_groups), mode)
+    if len(pipes) == workers:
+        outs = [_FanOut([p], batch_size=batch_size,
+                        batch_timeout=batch_timeout, metadata=metadata)
+                for p in pipes]
+    else:
+        outs = [_FanOut(pipes, shared=True, batch_size=batch_size,
+                        batch_timeout=batch_timeout,
+                        metadata=metadata)] * workers
+    stop_evt = StopEvent()
+    threads = []
+    l_stats = []
+    for i, out in enumerate(outs):
+        l_stats.append(CaptureStats())
+        t = threading.Thread(target=af_packet_capture_thread,
+                             name='Packet Capture {}'.format(i),
+                             args=(stop_evt, out, iface, bpf),
+                             kwargs={'fanout': fanout,
+                                     'capture_stats': l_stats[-1],
+                                     'snaplen': snaplen,
+                                     'headers_only': headers_only})
+        t.start()
+        threads.append(t)
+    logger_pcap.debug('Run {} fanout capture threads on iface [{}]'.format(
+        workers, iface))
+    return threads, stop_evt, l_stats
+
+
+def sending_raw_traffic_thread(stop_evt, poller, receiver, iface,
+                               pacer=None):
+    """ Sends the frames returned by receiver on iface
+
+    :param poller: callable taking a timeout and returning whether a frame
+        may be received without blocking; None if receiver already blocks
+        until a frame is available and raises EOFError or IOError once the
+        sender must stop
+    :param receiver: callable returning the next frame to send
+    :param pacer: an optional pacing.Pacer limiting the rate of the frames
+    """
     h = pcapy.open_live(iface, 65535, 1, 1)
     while not stop_evt.is_set():
-        if poller(0.1):
+        if poller is None or poller(0.1):
             try:
                 s = receiver()
-                h.sendpacket(s)
+                if s is None:
+                    continue
+                if pacer is None:
+                    h.sendpacket(s)
+                else:
+                    for chunk in pacer.pace((s,), stop_evt):
+                        h.sendpacket(chunk[0])
             except (EOFError, IOError):
                 stop_evt.set()
 
 
-def send_raw_traffic(iface, poller, receiver):
+def _unbatch(batch_receiver):
+    """ Turns a callable returning lists of messages into one returning a
+    single frame per call, or None if there is none
+    """
+    pending = collections.deque()
+
+    def receiver():
+        if len(pending) == 0:
+            pending.extend(iter_frames(batch_receiver()))
+        return pending.popleft() if len(pending) > 0 else None
+    return receiver
+
+
+def af_packet_sending_thread(stop_evt, batch_receiver, iface, pacer=None):
+    """ Sends the frames returned by batch_receiver on iface through an
+    AF_PACKET TX ring, falling back to pcapy if the socket cannot be opened
+
+    All the frames returned by a call to batch_receiver are handed over to
+    the kernel with a single system call, unless a pacer splits them into
+    chunks due at different times.
+
+    :param batch_receiver: callable returning a list of messages, each of
+        which is a frame, a FrameRecord or a FrameBatch; it blocks until a
+        message is available and returns an empty list or raises EOFError
+        or IOError once the sender must stop
+    :param pacer: an optional pacing.Pacer limiting the rate of the frames
+    """
+    try:
+        sender = af_packet.RawSender(iface)
+    except OSError as e:
+        if not HAS_PCAPY:
+            logger_pcap.warning('AF_PACKET sender on [{}] failed: '
+                                '{}'.format(iface, e))
+            stop_evt.set()
+            return
+        logger_pcap.warning(
+            'AF_PACKET sender on [{}] failed ({}): falling back to '
+            'pcapy'.format(iface, e)
+        )
+        return sending_raw_traffic_thread(stop_evt, None,
+                                          _unbatch(batch_receiver), iface,
+                                          pacer)
+    try:
+        while not stop_evt.is_set():
+            try:
+                msgs = batch_receiver()
+            except (EOFError, IOError):
+                stop_evt.set()
+                break
+            if pacer is None:
+                sender.send_many(iter_frames(msgs))
+                continue
+            for chunk in pacer.pace(iter_frames(msgs), stop_evt):
+                sender.send_many(chunk)
+    except OSError:
+        logger_pcap.warning('AF_PACKET sender on [{}] failed'.format(iface))
+        traceback.print_exc()
+        stop_evt.set()
+    finally:
+        sender.close()
+
+
+def send_raw_traffic(iface, poller, receiver, engine=None,
+                     batch_receiver=None, pacer=None):
+    """ Starts a thread sending frames on iface
+
+    :param iface: the name of the interface to send on
+    :param poller: see sending_raw_traffic_thread
+    :param receiver: see sending_raw_traffic_thread
+    :param engine: one of CAPTURE_ENGINES; see select_capture_engine
+    :param batch_receiver: see af_packet_sending_thread; if given, the
+        AF_PACKET engine uses it instead of poller and receiver, and so does
+        the pcapy engine if receiver is None
+    :param pacer: an optional pacing.Pacer limiting the rate of the frames
+    :return: the thread and the threading.Event stopping it
+    """
     stop_evt = threading.Event()
-    t = threading.Thread(
-        target=sending_raw_traffic_thread, name='Raw Traffic Emitter',
-        args=(stop_evt, poller, receiver, iface)
-    )
+    engine = select_capture_engine(engine)
+    if engine == CAPTURE_ENGINE_AF_PACKET and batch_receiver is not None:
+        target = af_packet_sending_thread
+        args = (stop_evt, batch_receiver, iface, pacer)
+    else:
+        if receiver is None:
+            poller, receiver = None, _unbatch(batch_receiver)
+        target = sending_raw_traffic_thread
+        args = (stop_evt, poller, receiver, iface, pacer)
+    t = threading.Thread(target=target, name='Raw Traffic Emitter',
+                         args=args)
     t.start()
 
     return t, stop_evt
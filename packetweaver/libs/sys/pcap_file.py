@@ -0,0 +1,771 @@
+import gzip
+import logging
+import mmap
+import os
+import queue
+import shutil
+import socket
+import struct
+import threading
+import time
+try:
+    import lzma
+    HAS_LZMA = True
+except ImportError:
+    HAS_LZMA = False
+logger_pcap_file = logging.getLogger(__name__)
+
+# pcap file format; the magic number tells the byte order of the file and
+# the resolution of its timestamps
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+# magic, version_major, version_minor, thiszone, sigfigs, snaplen, linktype
+_PCAP_HDR = 'IHHiIII'
+_PCAP_HDR_SIZE = struct.calcsize('<' + _PCAP_HDR)
+# ts_sec, ts_frac, caplen, wirelen
+_PCAP_REC_HDR = 'IIII'
+
+# pcapng file format: a file is a sequence of blocks, each starting with its
+# type and total length, and ending with its total length again
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_ISB = 0x00000005
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_OPT_ENDOFOPT = 0
+PCAPNG_OPT_IF_NAME = 2
+PCAPNG_OPT_IF_TSRESOL = 9
+PCAPNG_OPT_IF_TSOFFSET = 14
+PCAPNG_OPT_ISB_STARTTIME = 2
+PCAPNG_OPT_ISB_ENDTIME = 3
+PCAPNG_OPT_ISB_IFRECV = 4
+PCAPNG_OPT_ISB_IFDROP = 5
+PCAPNG_OPT_ISB_USRDELIV = 8
+_PCAPNG_BLOCK_HDR = 'II'
+# linktype, reserved, snaplen
+_PCAPNG_IDB = 'HHI'
+# interface_id, ts_high, ts_low, caplen, wirelen
+_PCAPNG_EPB = 'IIIII'
+# interface_id, drops_count, ts_high, ts_low, caplen, wirelen
+_PCAPNG_PB = 'HHIIII'
+_PCAPNG_OPT_HDR = 'HH'
+
+LINKTYPE_ETHERNET = 1
+
+
+def _pad4(n):
+    return (n + 3) & ~3
+
+
+class Interface(object):
+    """ An interface described by a pcapng Interface Description Block """
+    __slots__ = ('if_id', 'linktype', 'snaplen', 'name', 'ts_mul', 'ts_div',
+                 'ts_offset_ns')
+
+    def __init__(self, if_id, linktype, snaplen, name=None):
+        self.if_id = if_id
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.name = name
+        # timestamps are in microseconds unless if_tsresol says otherwise
+        self.ts_mul = 1000
+        self.ts_div = 1
+        self.ts_offset_ns = 0
+
+    def set_tsresol(self, value):
+        exp = value & 0x7f
+        if value & 0x80:
+            # negative power of 2
+            self.ts_mul, self.ts_div = 1000000000, 1 << exp
+        elif exp <= 9:
+            self.ts_mul, self.ts_div = 10 ** (9 - exp), 1
+        else:
+            self.ts_mul, self.ts_div = 1, 10 ** (exp - 9)
+
+    def ts_ns(self, units):
+        return units * self.ts_mul // self.ts_div + self.ts_offset_ns
+
+
+class PcapReader(object):
+    """ Reader of pcap and pcapng files, mapped in memory
+
+    Records are returned without being dissected nor copied: their data is
+    a memoryview of the mapping. Views must be converted with bytes() to
+    outlive the reader, or to be sent in a pipe.
+
+    Both byte orders are supported, as well as the nanosecond variant of
+    pcap and the timestamp resolutions of pcapng interfaces.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path of the pcap or pcapng file
+        @raise ValueError if the file is neither a pcap nor a pcapng file
+        @raise IOError if the file cannot be read
+        """
+        self.path = path
+        self._map = None
+        self._view = None
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                raise ValueError('Not a pcap file: [{}]'.format(path))
+        self._view = memoryview(self._map)
+        if len(self._map) >= 4 and self._map[:4] == b'\x0a\x0d\x0d\x0a':
+            self.pcapng = True
+            self.linktype = None
+        else:
+            self.pcapng = False
+            self._read_pcap_header()
+
+    def _read_pcap_header(self):
+        if len(self._map) < _PCAP_HDR_SIZE:
+            self.close()
+            raise ValueError('Not a pcap file: [{}]'.format(self.path))
+        for order in ('<', '>'):
+            magic = struct.unpack_from(order + 'I', self._map)[0]
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                break
+        else:
+            self.close()
+            raise ValueError('Not a pcap file: [{}]'.format(self.path))
+        self._order = order
+        self._frac_ns = 1 if magic == PCAP_MAGIC_NS else 1000
+        hdr = struct.unpack_from(order + _PCAP_HDR, self._map)
+        self.snaplen, self.linktype = hdr[5], hdr[6]
+
+    def _pcap_records(self):
+        mm, view = self._map, self._view
+        rec_hdr = struct.Struct(self._order + _PCAP_REC_HDR)
+        frac_ns = self._frac_ns
+        off = _PCAP_HDR_SIZE
+        end = len(mm)
+        while off + rec_hdr.size <= end:
+            sec, frac, caplen, wirelen = rec_hdr.unpack_from(mm, off)
+            off += rec_hdr.size
+            if off + caplen > end:
+                return
+            yield (sec * 1000000000 + frac * frac_ns, caplen, wirelen,
+                   view[off:off + caplen], None)
+            off += caplen
+
+    def _read_idb(self, order, body, length, if_id):
+        linktype, _, snaplen = struct.unpack_from(order + _PCAPNG_IDB,
+                                                  self._map, body)
+        itf = Interface(if_id, linktype, snaplen)
+        opt_hdr = struct.Struct(order + _PCAPNG_OPT_HDR)
+        off = body + struct.calcsize(_PCAPNG_IDB)
+        end = body + length
+        while off + opt_hdr.size <= end:
+            code, opt_len = opt_hdr.unpack_from(self._map, off)
+            off += opt_hdr.size
+            if code == PCAPNG_OPT_ENDOFOPT:
+                break
+            if code == PCAPNG_OPT_IF_NAME:
+                itf.name = bytes(self._map[off:off + opt_len]).decode(
+                    'utf-8', 'replace')
+            elif code == PCAPNG_OPT_IF_TSRESOL and opt_len >= 1:
+                itf.set_tsresol(self._map[off])
+            elif code == PCAPNG_OPT_IF_TSOFFSET and opt_len >= 8:
+                sec = struct.unpack_from(order + 'q', self._map, off)[0]
+                itf.ts_offset_ns = sec * 1000000000
+            off += _pad4(opt_len)
+        return itf
+
+    def _pcapng_records(self):
+        mm, view = self._map, self._view
+        end = len(mm)
+        off = 0
+        order = '<'
+        interfaces = []
+        while off + 12 <= end:
+            btype, blen = struct.unpack_from(order + _PCAPNG_BLOCK_HDR, mm,
+                                             off)
+            if btype == PCAPNG_SHB:
+                # the type reads the same in both byte orders, but a new
+                # section may switch to the other one
+                bom = struct.unpack_from('<I', mm, off + 8)[0]
+                order = '<' if bom == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                blen = struct.unpack_from(order + 'I', mm, off + 4)[0]
+                interfaces = []
+            if blen < 12 or off + blen > end:
+                return
+            body = off + 8
+            if btype == PCAPNG_EPB:
+                if_id, hi, lo, caplen, wirelen = struct.unpack_from(
+                    order + _PCAPNG_EPB, mm, body)
+                data = body + 20
+                itf = interfaces[if_id] if if_id < len(interfaces) else None
+                ts = None if itf is None else itf.ts_ns((hi << 32) | lo)
+                yield ts, caplen, wirelen, view[data:data + caplen], itf
+            elif btype == PCAPNG_SPB:
+                wirelen = struct.unpack_from(order + 'I', mm, body)[0]
+                caplen = min(wirelen, blen - 16)
+                if len(interfaces) > 0 and interfaces[0].snaplen:
+                    caplen = min(caplen, interfaces[0].snaplen)
+                data = body + 4
+                itf = interfaces[0] if len(interfaces) > 0 else None
+                yield None, caplen, wirelen, view[data:data + caplen], itf
+            elif btype == PCAPNG_PB:
+                if_id, _, hi, lo, caplen, wirelen = struct.unpack_from(
+                    order + _PCAPNG_PB, mm, body)
+                data = body + 20
+                itf = interfaces[if_id] if if_id < len(interfaces) else None
+                ts = None if itf is None else itf.ts_ns((hi << 32) | lo)
+                yield ts, caplen, wirelen, view[data:data + caplen], itf
+            elif btype == PCAPNG_IDB:
+                interfaces.append(self._read_idb(order, body, blen - 12,
+                                                 len(interfaces)))
+                if self.linktype is None:
+                    self.linktype = interfaces[-1].linktype
+            off += blen
+
+    def records(self, with_interface=False):
+        """ Iterates over the records of the file
+
+        :param with_interface: whether the Interface the frame was captured
+            on, or None if unknown as in pcap files, is appended to each
+            tuple
+        :return: an iterator over (ts_ns, caplen, wirelen, data) tuples,
+            where ts_ns is the capture time in nanoseconds since the epoch,
+            or None if unknown, and data is a memoryview
+        """
+        if self.pcapng:
+            records = self._pcapng_records()
+        else:
+            records = self._pcap_records()
+        if with_interface:
+            return records
+        return (rec[:4] for rec in records)
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # records are still referenced; the mapping is released
+                # along with the last of them
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_pcap(path):
+    """ Iterates over the records of a pcap or pcapng file, without
+    dissecting nor copying them; see PcapReader
+
+    :param path: the path of the file
+    :return: an iterator over (ts_ns, caplen, wirelen, data) tuples
+    @raise ValueError if the file is neither a pcap nor a pcapng file
+    """
+    with PcapReader(path) as reader:
+        for rec in reader:
+            yield rec
+
+
+class _PcapFormat(object):
+    """ Encoder of the header and records of a pcap file """
+
+    def __init__(self, linktype, snaplen, nanoseconds):
+        self._div = 1 if nanoseconds else 1000
+        self._rec_hdr = struct.Struct('<' + _PCAP_REC_HDR)
+        magic = PCAP_MAGIC_NS if nanoseconds else PCAP_MAGIC_US
+        self._header = struct.pack('<' + _PCAP_HDR, magic, 2, 4, 0, 0,
+                                   snaplen, linktype)
+
+    def header(self):
+        return self._header
+
+    def record_size(self, caplen):
+        return self._rec_hdr.size + caplen
+
+    def describe(self, ifindex, ifname):
+        return b''
+
+    def append(self, buf, data, ts_ns, wirelen, ifindex):
+        sec, frac = divmod(ts_ns, 1000000000)
+        buf += self._rec_hdr.pack(sec, frac // self._div, len(data), wirelen)
+        buf += data
+
+    def set_stats(self, ifindex, received, dropped):
+        pass
+
+    def footer(self, ts_ns):
+        return b''
+
+
+class _PcapngFormat(object):
+    """ Encoder of the blocks of a pcapng file
+
+    Each interface, identified by the index given along with the frames,
+    is described by an Interface Description Block the first time it is
+    seen, with a nanosecond timestamp resolution. The footer holds an
+    Interface Statistics Block per interface.
+    """
+
+    def __init__(self, linktype, snaplen):
+        self._linktype = linktype
+        self._snaplen = snaplen
+        self._epb_hdr = struct.Struct('<II' + _PCAPNG_EPB)
+        # interface_id of each interface index, and their IDBs
+        self._ids = {}
+        self._idbs = []
+        # per interface_id: frames written in the current file, time of
+        # the first and last of them, and counters given to set_stats
+        self._counts = {}
+        self._kernel = {}
+
+    @staticmethod
+    def _block(btype, body):
+        body += b'\x00' * (-len(body) % 4)
+        blen = len(body) + 12
+        return (struct.pack('<' + _PCAPNG_BLOCK_HDR, btype, blen) + body
+                + struct.pack('<I', blen))
+
+    @staticmethod
+    def _option(code, value):
+        return (struct.pack('<' + _PCAPNG_OPT_HDR, code, len(value)) + value
+                + b'\x00' * (-len(value) % 4))
+
+    @staticmethod
+    def _ts(ts_ns):
+        return struct.pack('<II', ts_ns >> 32, ts_ns & 0xffffffff)
+
+    def _idb(self, ifindex, ifname):
+        opts = b''
+        if ifname is None and ifindex is not None and ifindex > 0:
+            try:
+                ifname = socket.if_indextoname(ifindex)
+            except OSError:
+                pass
+        if ifname is not None:
+            opts += self._option(PCAPNG_OPT_IF_NAME, ifname.encode())
+        opts += self._option(PCAPNG_OPT_IF_TSRESOL, b'\x09')
+        opts += self._option(PCAPNG_OPT_ENDOFOPT, b'')
+        return self._block(PCAPNG_IDB, struct.pack(
+            '<' + _PCAPNG_IDB, self._linktype, 0, self._snaplen) + opts)
+
+    def header(self):
+        shb = self._block(PCAPNG_SHB, struct.pack(
+            '<IHHq', PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+        # the interfaces seen in the previous files keep their identifier
+        return shb + b''.join(self._idbs)
+
+    def record_size(self, caplen):
+        return self._epb_hdr.size + _pad4(caplen) + 4
+
+    def describe(self, ifindex, ifname):
+        """ Returns the IDB of an interface the first time it is seen,
+        which must be written before its first record, and b'' afterwards
+        """
+        if ifindex in self._ids:
+            return b''
+        self._ids[ifindex] = len(self._idbs)
+        self._idbs.append(self._idb(ifindex, ifname))
+        return self._idbs[-1]
+
+    def append(self, buf, data, ts_ns, wirelen, ifindex):
+        if_id = self._ids[ifindex]
+        caplen = len(data)
+        blen = self.record_size(caplen)
+        buf += self._epb_hdr.pack(PCAPNG_EPB, blen, if_id, ts_ns >> 32,
+                                  ts_ns & 0xffffffff, caplen, wirelen)
+        buf += data
+        buf += b'\x00' * (-caplen % 4)
+        buf += struct.pack('<I', blen)
+        counts = self._counts.get(if_id)
+        if counts is None:
+            self._counts[if_id] = [1, ts_ns, ts_ns]
+        else:
+            counts[0] += 1
+            counts[2] = ts_ns
+
+    def set_stats(self, ifindex, received, dropped):
+        if_id = self._ids.get(ifindex)
+        if if_id is not None:
+            self._kernel[if_id] = (received, dropped)
+
+    def footer(self, ts_ns):
+        """ Returns the Interface Statistics Blocks of the current file,
+        and resets the counts of frames
+        """
+        blocks = []
+        for if_id in sorted(self._counts):
+            delivered, first, last = self._counts[if_id]
+            opts = (self._option(PCAPNG_OPT_ISB_STARTTIME, self._ts(first))
+                    + self._option(PCAPNG_OPT_ISB_ENDTIME, self._ts(last)))
+            if if_id in self._kernel:
+                received, dropped = self._kernel[if_id]
+                opts += self._option(PCAPNG_OPT_ISB_IFRECV,
+                                     struct.pack('<Q', received))
+                opts += self._option(PCAPNG_OPT_ISB_IFDROP,
+                                     struct.pack('<Q', dropped))
+            opts += self._option(PCAPNG_OPT_ISB_USRDELIV,
+                                 struct.pack('<Q', delivered))
+            opts += self._option(PCAPNG_OPT_ENDOFOPT, b'')
+            blocks.append(self._block(
+                PCAPNG_ISB, struct.pack('<I', if_id) + self._ts(ts_ns) + opts
+            ))
+        self._counts = {}
+        return b''.join(blocks)
+
+
+class PcapWriter(object):
+    """ Writer of pcap and pcapng files, buffering whole records in memory
+
+    Record headers and frame bytes are appended to a buffer, which is
+    written to the file once it exceeds buffer_size bytes, when tick() is
+    called more than flush_interval seconds after the previous write, or on
+    flush() and close().
+    """
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=65535,
+                 nanoseconds=False, buffer_size=1 << 20, flush_interval=1.0,
+                 pcapng=False):
+        """
+        :param path: the path of the file, which is truncated
+        :param linktype: the link type of the frames
+        :param snaplen: the maximum number of bytes of a frame written to
+            the file
+        :param nanoseconds: whether timestamps are written with a nanosecond
+            resolution, which some older tools do not support, rather than
+            a microsecond one; pcapng files always use nanoseconds
+        :param buffer_size: number of buffered bytes triggering a write
+        :param flush_interval: maximum number of seconds records stay in
+            the buffer, provided that tick() is called often enough
+        :param pcapng: whether a pcapng file is written, which records the
+            interface of each frame, instead of a pcap one
+        @raise IOError if the file cannot be opened
+        """
+        self.path = path
+        self.snaplen = snaplen
+        self.flush_interval = flush_interval
+        self._buffer_size = buffer_size
+        self._buf = bytearray()
+        self._deadline = time.monotonic() + flush_interval
+        if pcapng:
+            self._format = _PcapngFormat(linktype, snaplen)
+        else:
+            self._format = _PcapFormat(linktype, snaplen, nanoseconds)
+        self._file = self._open(path)
+
+    def _open(self, path):
+        f = open(path, 'wb')
+        f.write(self._format.header())
+        f.flush()
+        return f
+
+    def _write_out(self, buf):
+        self._file.write(buf)
+        self._file.flush()
+
+    def _write_block(self, block):
+        """ Writes blocks that the records refer to, such as pcapng IDBs,
+        after the buffered records
+        """
+        self._buf += block
+
+    def write(self, data, ts_ns=None, wirelen=None, ifindex=None,
+              ifname=None):
+        """ Appends a record
+
+        :param data: the frame, as a bytes-like object
+        :param ts_ns: the capture time, in nanoseconds since the epoch; now
+            if None or 0
+        :param wirelen: the length of the frame on the wire; len(data) if
+            None
+        :param ifindex: the index of the interface the frame was captured
+            on, recorded in pcapng files; None if unknown
+        :param ifname: the name of the interface, if it is not the local
+            name of ifindex; see FrameRecord
+        """
+        if not ts_ns:
+            ts_ns = int(time.time() * 1000000000)
+        if wirelen is None or wirelen < len(data):
+            wirelen = len(data)
+        if len(data) > self.snaplen:
+            data = memoryview(data)[:self.snaplen]
+        block = self._format.describe(ifindex, ifname)
+        if block:
+            self._write_block(block)
+        self._format.append(self._buf, data, ts_ns, wirelen, ifindex)
+        if len(self._buf) >= self._buffer_size:
+            self.flush()
+
+    def set_stats(self, ifindex, received, dropped):
+        """ Sets the counters of the capture on an interface, written in the
+        statistics blocks of pcapng files
+
+        :param ifindex: the interface index given to write
+        :param received: the number of frames received by the capture
+        :param dropped: the number of frames dropped by the capture
+        """
+        self._format.set_stats(ifindex, received, dropped)
+
+    def tick(self):
+        """ Writes the buffer if its time budget is exhausted """
+        if time.monotonic() >= self._deadline:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered records to the file """
+        self._deadline = time.monotonic() + self.flush_interval
+        if len(self._buf) == 0:
+            return
+        self._write_out(self._buf)
+        self._buf = bytearray()
+
+    def close(self):
+        if self._file is None:
+            return
+        self._buf += self._format.footer(int(time.time() * 1000000000))
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# compressors of the completed files of RotatingPcapWriter: open function
+# and file name suffix
+COMPRESSORS = {'gzip': (gzip.open, '.gz')}
+if HAS_LZMA:
+    COMPRESSORS['lzma'] = (lzma.open, '.xz')
+
+# operations of the writer thread of RotatingPcapWriter; _DATA buffers take
+# a slot of the queue and may be dropped, _KEEP ones are always written
+_OPEN = 0
+_DATA = 1
+_STOP = 2
+_KEEP = 3
+
+
+class RotatingPcapWriter(PcapWriter):
+    """ Pcap writer spreading the records over several files, with all the
+    file I/O done in a background thread
+
+    A new file is started whenever the current one would exceed max_bytes,
+    holds max_packets records, or was started more than max_seconds ago.
+    File names are then built from a template, in which {index} is replaced
+    with the number of the file and strftime directives with the time at
+    which it is started; without rotation, the template is used as is.
+
+    Buffered records are handed over to the writer thread through a queue
+    holding at most queue_size buffers of records; they are dropped, and
+    counted in dropped, if the disk does not keep up. Starting a new file
+    never waits for the queue. Completed files are synced to disk, then
+    optionally compressed by yet another thread.
+    """
+
+    def __init__(self, template, max_bytes=0, max_seconds=0, max_packets=0,
+                 compress=None, queue_size=16, **kwargs):
+        """
+        :param template: the path of the file or, if rotation is enabled,
+            the template of the file names, e.g.
+            'capture-%Y%m%d-%H%M%S-{index}.pcap'; '-{index}' is added before
+            the extension if it is missing
+        :param max_bytes: maximum size of a file; 0 for no limit
+        :param max_seconds: maximum number of seconds covered by a file; 0
+            for no limit
+        :param max_packets: maximum number of records in a file; 0 for no
+            limit
+        :param compress: None, or one of COMPRESSORS
+        :param queue_size: maximum number of buffers waiting to be written
+        :param kwargs: see PcapWriter
+        @raise ValueError if the compressor is unknown
+        """
+        if compress is not None and compress not in COMPRESSORS:
+            raise ValueError('Unknown compressor [{}]'.format(compress))
+        self._rotating = bool(max_bytes or max_seconds or max_packets)
+        if self._rotating and '{index}' not in template:
+            base, ext = os.path.splitext(template)
+            template = base + '-{index}' + ext
+        self._template = template
+        self._max_bytes = max_bytes
+        self._max_seconds = max_seconds
+        self._max_packets = max_packets
+        self._compress = compress
+        self._index = 0
+        self._buf_records = 0
+        self.dropped = 0
+        # paths of the completed files, once synced and compressed
+        self.files = []
+        self._error = None
+        # the queue itself is unbounded, so that starting a file never
+        # blocks; only the buffers of records take a slot
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._compress_queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='Pcap Writer')
+        self._compressor = threading.Thread(target=self._compress_loop,
+                                            name='Pcap Compressor')
+        super(RotatingPcapWriter, self).__init__(self._next_path(),
+                                                 **kwargs)
+        self._writer.start()
+        self._compressor.start()
+
+    def _next_path(self):
+        self._index += 1
+        if not self._rotating:
+            return self._template
+        return time.strftime(self._template.format(index=self._index))
+
+    def _open(self, path):
+        header = self._format.header()
+        self._file_bytes = len(header)
+        self._file_packets = 0
+        self._file_start = time.monotonic()
+        self._queue.put((_OPEN, (path, header)))
+        return None
+
+    def _write_out(self, buf):
+        if self._slots.acquire(blocking=False):
+            self._queue.put((_DATA, bytes(buf)))
+        else:
+            self.dropped += self._buf_records
+        self._buf_records = 0
+
+    def _rotation_due(self, size):
+        return self._file_packets > 0 and (
+            (self._max_bytes and self._file_bytes + size > self._max_bytes)
+            or (self._max_packets and self._file_packets >= self._max_packets)
+            or (self._max_seconds
+                and time.monotonic() - self._file_start >= self._max_seconds)
+        )
+
+    def _write_block(self, block):
+        # unlike the buffers of records, these blocks are never dropped:
+        # the following records would refer to a missing interface
+        self.flush()
+        self._queue.put((_KEEP, bytes(block)))
+
+    def _rotate(self):
+        footer = self._format.footer(int(time.time() * 1000000000))
+        if footer:
+            self._write_block(footer)
+        else:
+            self.flush()
+        self._open(self._next_path())
+
+    def write(self, data, ts_ns=None, wirelen=None, ifindex=None,
+              ifname=None):
+        """ Appends a record, starting a new file first if needed
+
+        @raise IOError if the writer thread failed
+        """
+        if self._error is not None:
+            raise IOError('Cannot write pcap: {}'.format(self._error))
+        size = self._format.record_size(min(len(data), self.snaplen))
+        if self._rotation_due(size):
+            self._rotate()
+        self._file_bytes += size
+        self._file_packets += 1
+        self._buf_records += 1
+        super(RotatingPcapWriter, self).write(data, ts_ns, wirelen, ifindex,
+                                              ifname)
+
+    def tick(self):
+        """ Writes the buffer if its time budget is exhausted, and starts a
+        new file if the current one is too old
+        """
+        if self._rotation_due(0):
+            self._rotate()
+        super(RotatingPcapWriter, self).tick()
+
+    def _finish(self, f, path):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        if self._compress is None:
+            self.files.append(path)
+        else:
+            self._compress_queue.put(path)
+
+    def _write_loop(self):
+        f = None
+        path = None
+        while True:
+            op, arg = self._queue.get()
+            if self._error is not None:
+                if op == _DATA:
+                    self._slots.release()
+                if op == _STOP:
+                    break
+                continue
+            try:
+                if op in (_DATA, _KEEP):
+                    f.write(arg)
+                    continue
+                if f is not None:
+                    self._finish(f, path)
+                    f = None
+                if op == _STOP:
+                    break
+                path, header = arg
+                f = open(path, 'wb')
+                f.write(header)
+            except (IOError, OSError) as e:
+                logger_pcap_file.warning(
+                    'Cannot write [{}]: {}'.format(path, e))
+                self._error = e
+            finally:
+                if op == _DATA:
+                    self._slots.release()
+        if f is not None:
+            f.close()
+        self._compress_queue.put(None)
+
+    def _compress_loop(self):
+        while True:
+            path = self._compress_queue.get()
+            if path is None:
+                return
+            open_func, suffix = COMPRESSORS[self._compress]
+            try:
+                with open(path, 'rb') as src, \
+                        open_func(path + suffix, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                os.unlink(path)
+                self.files.append(path + suffix)
+            except (IOError, OSError) as e:
+                logger_pcap_file.warning(
+                    'Cannot compress [{}]: {}'.format(path, e))
+                self.files.append(path)
+
+    def close(self):
+        """ Writes the remaining records and waits for the current file to
+        be completed, and compressed if requested
+        """
+        if self._writer is None:
+            return
+        self._deadline = time.monotonic() + self.flush_interval
+        self._buf += self._format.footer(int(time.time() * 1000000000))
+        if len(self._buf) > 0:
+            # the last records are not dropped
+            self._queue.put((_KEEP, bytes(self._buf)))
+            self._buf = bytearray()
+            self._buf_records = 0
+        self._queue.put((_STOP, None))
+        self._writer.join()
+        self._compressor.join()
+        self._writer = None
@@ -0,0 +1,193 @@
+import os
+import socket
+import time
+import pytest
+import packetweaver.libs.sys.af_packet as af_packet
+import packetweaver.libs.sys.pcap as pcap
+
+
+def open_lo_ring(**kwargs):
+    try:
+        return af_packet.TPacketV3Socket('lo', block_size=1 << 16,
+                                         block_nr=4, **kwargs)
+    except (OSError, AttributeError) as e:
+        pytest.skip('AF_PACKET unavailable: {}'.format(e))
+
+
+def send_udp(payloads, flows=1):
+    # a listening socket avoids ICMP errors quoting the payloads
+    r = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r.bind(('127.0.0.1', 0))
+    senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+               for _ in range(flows)]
+    for i, p in enumerate(payloads):
+        senders[i % flows].sendto(p, r.getsockname())
+    for s in senders:
+        s.close()
+    r.close()
+
+
+def read_until(sock, marker, count, timeout=2):
+    frames = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        frames += [f for f in sock.read(0.05) if marker in f]
+        # lo delivers each frame twice, once per direction
+        if len({f[42:] for f in frames}) >= count:
+            break
+    return frames
+
+
+class TestTPacketV3Socket:
+    def test_read_frames(self):
+        sock = open_lo_ring()
+        try:
+            payloads = [b'pw-af-packet-test-%d' % i for i in range(100)]
+            send_udp(payloads)
+            frames = read_until(sock, b'pw-af-packet-test-', 100)
+            seen = {f[42:] for f in frames}
+            assert seen == set(payloads)
+            # Ethernet + IPv4 + UDP headers precede the payload
+            assert all(f[12:14] == b'\x08\x00' for f in frames)
+            received, drops = sock.stats()
+            assert received >= 100
+            assert drops == 0
+        finally:
+            sock.close()
+
+    def test_metadata(self):
+        sock = open_lo_ring()
+        try:
+            before = time.time()
+            send_udp([b'pw-af-packet-meta'])
+            meta = []
+            deadline = time.time() + 2
+            while len(meta) == 0 and time.time() < deadline:
+                sock.read(0.05, meta)
+            ts_ns, wirelen, ifindex = meta[0]
+            assert before - 1 < ts_ns / 1e9 < time.time() + 1
+            # Ethernet + IPv4 + UDP headers + payload
+            assert wirelen == 14 + 20 + 8 + len(b'pw-af-packet-meta')
+            assert ifindex == socket.if_nametoindex('lo')
+        finally:
+            sock.close()
+
+    def test_read_timeout(self):
+        sock = open_lo_ring(bpf=None)
+        try:
+            start = time.time()
+            sock.read(0.05)
+            assert time.time() - start < 1
+        finally:
+            sock.close()
+
+
+def ether_frame(payload):
+    # IEEE 802 local experimental ethertype, ignored by the host stack
+    return b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01\x88\xb5' + payload
+
+
+class TestRawSender:
+    def open_sender(self, **kwargs):
+        try:
+            return af_packet.RawSender('lo', **kwargs)
+        except (OSError, AttributeError) as e:
+            pytest.skip('AF_PACKET unavailable: {}'.format(e))
+
+    def check_sent(self, sender, payloads):
+        sock = open_lo_ring()
+        try:
+            frames = [ether_frame(p) for p in payloads]
+            assert sender.send_many(frames) == len(frames)
+            seen = set()
+            deadline = time.time() + 2
+            while len(seen) < len(payloads) and time.time() < deadline:
+                seen |= {f[14:] for f in sock.read(0.05)
+                         if f[12:14] == b'\x88\xb5'}
+            assert seen == set(payloads)
+        finally:
+            sock.close()
+
+    def test_send_many(self):
+        sender = self.open_sender(frame_nr=16)
+        try:
+            assert sender.has_ring
+            # more frames than slots, so that the ring wraps around
+            self.check_sent(sender,
+                            [b'pw-tx-ring-%d' % i for i in range(40)])
+        finally:
+            sender.close()
+
+    def test_frame_larger_than_slot(self):
+        # a single page-sized block, which the kernel accepts
+        sender = self.open_sender(frame_size=256, frame_nr=16)
+        try:
+            assert sender.has_ring
+            self.check_sent(sender, [b'pw-tx-small', b'pw-tx-big' * 100,
+                                     b'pw-tx-small-again'])
+        finally:
+            sender.close()
+
+
+class TestFanout:
+    def open_group(self, mode, n=2):
+        arg = af_packet.fanout_arg(os.getpid(), mode)
+        return [open_lo_ring(fanout=arg) for _ in range(n)]
+
+    def read_group(self, socks, marker, count):
+        per_sock = [[] for _ in socks]
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            for i, sock in enumerate(socks):
+                per_sock[i] += [f for f in sock.read(0.01) if marker in f]
+            seen = {f[42:] for frames in per_sock for f in frames}
+            if len(seen) >= count:
+                break
+        return per_sock
+
+    def test_hash_flow_affinity(self):
+        socks = self.open_group('hash')
+        try:
+            payloads = [b'pw-fanout-hash-%d' % i for i in range(200)]
+            send_udp(payloads, flows=20)
+            per_sock = self.read_group(socks, b'pw-fanout-hash-', 200)
+            workers_of_flow = {}
+            for i, frames in enumerate(per_sock):
+                for f in frames:
+                    # UDP source port identifies the flow
+                    workers_of_flow.setdefault(f[34:36], set()).add(i)
+            assert len(workers_of_flow) == 20
+            assert all(len(w) == 1 for w in workers_of_flow.values())
+            seen = {f[42:] for frames in per_sock for f in frames}
+            assert seen == set(payloads)
+        finally:
+            for sock in socks:
+                sock.close()
+
+    def test_load_balance(self):
+        socks = self.open_group('lb')
+        try:
+            payloads = [b'pw-fanout-lb-%d' % i for i in range(100)]
+            send_udp(payloads)
+            per_sock = self.read_group(socks, b'pw-fanout-lb-', 100)
+            assert all(len(frames) > 0 for frames in per_sock)
+        finally:
+            for sock in socks:
+                sock.close()
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            af_packet.fanout_arg(1, 'random')
+
+
+class TestSelectCaptureEngine:
+    def test_default(self):
+        engine = pcap.select_capture_engine()
+        if pcap.HAS_PCAPY:
+            assert engine == pcap.CAPTURE_ENGINE_PCAPY
+        else:
+            assert engine in pcap.CAPTURE_ENGINES
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            pcap.select_capture_engine('libtrace')
@@ -0,0 +1,83 @@
+import pickle
+import time
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.libs.sys.frame_batch as fb
+
+
+class TestFrameBatch:
+    def test_pack(self):
+        frames = [b'first', b'', b'third frame']
+        batch = fb.FrameBatch.pack(frames)
+        assert len(batch) == 3
+        assert list(batch) == frames
+        assert batch[2] == b'third frame'
+        assert batch[-3] == b'first'
+        with pytest.raises(IndexError):
+            batch[3]
+
+    def test_pickle(self):
+        batch = pickle.loads(pickle.dumps(fb.FrameBatch.pack([b'a', b'bc'])))
+        assert list(batch) == [b'a', b'bc']
+
+    def test_iter_frames(self):
+        msgs = [b'a', fb.FrameBatch.pack([b'b', b'c']), fb.FrameRecord(b'd')]
+        assert list(fb.iter_frames(msgs)) == [b'a', b'b', b'c', b'd']
+
+    def test_metadata(self):
+        batch = fb.FrameBatch.pack([b'ab', b'c'],
+                                   [(10, 1500, 2), (20, 1, 3)])
+        batch = pickle.loads(pickle.dumps(batch))
+        rec = batch.record(0)
+        assert (rec.data, rec.ts_ns, rec.caplen, rec.wirelen,
+                rec.ifindex) == (b'ab', 10, 2, 1500, 2)
+        assert fb.capture_ts(batch) == 10
+        assert fb.capture_ts(fb.FrameBatch.pack([b'a'])) is None
+
+    def test_iter_records(self):
+        msgs = [b'a', fb.FrameRecord(b'b', 5, 100, -1, 'remote0'),
+                fb.FrameBatch.pack([b'c'], [(7, 1, 1)])]
+        recs = list(fb.iter_records(msgs))
+        assert [r.data for r in recs] == [b'a', b'b', b'c']
+        assert [r.ts_ns for r in recs] == [None, 5, 7]
+        assert recs[0].wirelen == 1
+        rec = pickle.loads(pickle.dumps(recs[1]))
+        assert (rec.data, rec.ts_ns, rec.wirelen, rec.ifindex,
+                rec.ifname) == (b'b', 5, 100, -1, 'remote0')
+
+
+class TestFrameBatcher:
+    def test_size_threshold(self):
+        w, r = channel.DequePipe()
+        batcher = fb.FrameBatcher(w, max_frames=3, max_bytes=10)
+        for f in [b'a', b'b', b'c', b'dddddddddddd', b'e']:
+            batcher.send(f)
+        assert list(r.recv()) == [b'a', b'b', b'c']
+        assert list(r.recv()) == [b'dddddddddddd']
+        assert not r.poll(0)
+        batcher.close()
+        assert list(r.recv()) == [b'e']
+        with pytest.raises(EOFError):
+            r.recv()
+
+    def test_metadata(self):
+        w, r = channel.DequePipe()
+        batcher = fb.FrameBatcher(w, metadata=True)
+        batcher.send_record(b'a', 42, 60, 3)
+        batcher.send(b'b')
+        batcher.flush()
+        batch = r.recv()
+        assert list(batch.ts_ns) == [42, 0]
+        assert list(batch.wirelen) == [60, 1]
+
+    def test_time_budget(self):
+        w, r = channel.DequePipe()
+        batcher = fb.FrameBatcher(w, timeout=0.01)
+        batcher.send(b'a')
+        batcher.tick()
+        assert not r.poll(0)
+        time.sleep(0.02)
+        batcher.tick()
+        assert list(r.recv()) == [b'a']
+        batcher.tick()
+        assert not r.poll(0)
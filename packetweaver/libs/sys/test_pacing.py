@@ -0,0 +1,59 @@
+import threading
+import time
+import packetweaver.libs.sys.pacing as pacing
+
+
+class TestTokenBucket:
+    def test_burst_then_rate(self):
+        bucket = pacing.TokenBucket(10, 3, 0.0)
+        assert [bucket.reserve(1, 0.0) for _ in range(3)] == [0.0] * 3
+        assert abs(bucket.reserve(1, 0.0) - 0.1) < 1e-9
+        assert abs(bucket.reserve(1, 0.0) - 0.2) < 1e-9
+
+    def test_refill_capped(self):
+        bucket = pacing.TokenBucket(10, 2, 0.0)
+        bucket.reserve(2, 0.0)
+        # an idle period does not accumulate more than the capacity
+        assert bucket.reserve(2, 100.0) == 100.0
+        assert abs(bucket.reserve(1, 100.0) - 100.1) < 1e-9
+
+    def test_cost_above_capacity(self):
+        bucket = pacing.TokenBucket(10, 2, 0.0)
+        assert bucket.reserve(5, 0.0) == 0.0
+        # the debt of 3 tokens is paid back before the next token
+        assert abs(bucket.reserve(1, 0.0) - 0.4) < 1e-9
+
+
+class TestPacer:
+    def test_unlimited(self):
+        pacer = pacing.Pacer()
+        frames = [b'x' * 10] * 100
+        assert list(pacer.pace(frames)) == [frames]
+        assert pacer.stats()['frames'] == 100
+        assert pacer.stats()['bytes'] == 1000
+
+    def test_frame_rate(self):
+        pacer = pacing.Pacer(pps=1000, burst=10)
+        start = time.perf_counter()
+        chunks = list(pacer.pace([b'x'] * 60))
+        elapsed = time.perf_counter() - start
+        assert len(chunks[0]) == 10
+        assert sum(len(c) for c in chunks) == 60
+        # 10 frames in a burst, then 50 frames at 1000 frames/s
+        assert 0.045 < elapsed < 0.5
+        assert 900 < pacer.stats()['pps'] < 1100
+
+    def test_bit_rate(self):
+        pacer = pacing.Pacer(bps=8 * 1514 * 100)
+        start = time.perf_counter()
+        list(pacer.pace([b'x' * 1514] * 6))
+        assert 0.045 < time.perf_counter() - start < 0.5
+
+    def test_stop(self):
+        pacer = pacing.Pacer(pps=1)
+        stop_evt = threading.Event()
+        threading.Timer(0.05, stop_evt.set).start()
+        start = time.perf_counter()
+        chunks = list(pacer.pace([b'a', b'b', b'c'], stop_evt))
+        assert chunks == [[b'a']]
+        assert time.perf_counter() - start < 0.5
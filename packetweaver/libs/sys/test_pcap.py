@@ -0,0 +1,284 @@
+import collections
+import select
+import socket
+import time
+import pytest
+import packetweaver.core.models.abilities.channel as channel
+import packetweaver.libs.sys.af_packet as af_packet
+import packetweaver.libs.sys.frame_batch as frame_batch
+import packetweaver.libs.sys.pcap as pcap
+
+
+@pytest.fixture
+def engine():
+    try:
+        socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0).close()
+    except (OSError, AttributeError) as e:
+        pytest.skip('AF_PACKET unavailable: {}'.format(e))
+    return pcap.CAPTURE_ENGINE_AF_PACKET
+
+
+def send_udp(payload):
+    r = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r.bind(('127.0.0.1', 0))
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.sendto(payload, r.getsockname())
+    s.close()
+    r.close()
+
+
+def wait_for(conn, marker, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if conn.poll(0.05) and marker in conn.recv():
+            return True
+    return False
+
+
+class TestSharedCapture:
+    def test_shared_handle(self, engine):
+        (w1, r1), (w2, r2) = channel.DequePipe(), channel.DequePipe()
+        cap1 = pcap.subscribe_capture('lo', [w1], None, engine)
+        cap2 = pcap.subscribe_capture('lo', [w2], '', engine)
+        assert cap1 is cap2
+        try:
+            # let the ring be bound before sending
+            time.sleep(0.1)
+            send_udp(b'pw-shared-capture')
+            assert wait_for(r1, b'pw-shared-capture')
+            assert wait_for(r2, b'pw-shared-capture')
+        finally:
+            cap1.unsubscribe([w1])
+            assert cap1.thread.is_alive()
+            cap2.unsubscribe([w2])
+        assert not cap1.thread.is_alive()
+
+    def test_batches(self, engine):
+        w, r = channel.DequePipe()
+        cap = pcap.subscribe_capture('lo', [w], None, engine, batch_size=64,
+                                     batch_timeout=0.01)
+        try:
+            time.sleep(0.1)
+            send_udp(b'pw-batched-capture')
+            assert r.poll(2)
+            batch = r.recv()
+            assert isinstance(batch, frame_batch.FrameBatch)
+            assert any(b'pw-batched-capture' in f for f in batch)
+        finally:
+            cap.unsubscribe([w])
+
+    def test_snaplen(self, engine):
+        w, r = channel.DequePipe()
+        cap = pcap.subscribe_capture('lo', [w], None, engine, metadata=True,
+                                     snaplen=64)
+        try:
+            time.sleep(0.1)
+            send_udp(b'pw-snaplen' + b'\x00' * 200)
+            deadline = time.time() + 2
+            rec = None
+            while rec is None and time.time() < deadline:
+                if r.poll(0.05):
+                    msg = r.recv()
+                    if b'pw-snaplen' in msg.data:
+                        rec = msg
+            assert rec.caplen == 64
+            assert rec.wirelen == 14 + 20 + 8 + 210
+        finally:
+            cap.unsubscribe([w])
+
+    def test_distinct_truncation(self, engine):
+        w1, _ = channel.DequePipe()
+        w2, _ = channel.DequePipe()
+        cap1 = pcap.subscribe_capture('lo', [w1], None, engine)
+        cap2 = pcap.subscribe_capture('lo', [w2], None, engine,
+                                      headers_only=True)
+        try:
+            assert cap1 is not cap2
+        finally:
+            cap1.unsubscribe([w1])
+            cap2.unsubscribe([w2])
+
+    def test_distinct_filters(self, engine):
+        w1, _ = channel.DequePipe()
+        w2, _ = channel.DequePipe()
+        cap1 = pcap.subscribe_capture('lo', [w1], None, engine)
+        cap2 = pcap.subscribe_capture('lo', [w2], 'udp', engine)
+        try:
+            assert cap1 is not cap2
+        finally:
+            cap1.unsubscribe([w1])
+            cap2.unsubscribe([w2])
+
+    def test_fanout_merged(self, engine):
+        w, r = channel.DequePipe()
+        threads, stop_evt, _ = pcap.start_fanout_capture('lo', [w], 3)
+        try:
+            time.sleep(0.1)
+            send_udp(b'pw-fanout-merged')
+            assert wait_for(r, b'pw-fanout-merged')
+        finally:
+            stop_evt.set()
+            for t in threads:
+                t.join()
+        assert len(threads) == 3
+
+    def test_capture_stats(self, engine):
+        w, r = channel.DequePipe()
+        cap = pcap.subscribe_capture('lo', [w], None, engine)
+        time.sleep(0.1)
+        send_udp(b'pw-capture-stats')
+        assert wait_for(r, b'pw-capture-stats')
+        cap.unsubscribe([w])
+        values = cap.stats.as_dict()
+        assert values['received'] >= 1
+        assert values['dropped'] == 0
+        assert 0 <= values['ring_fill'] <= 1
+        assert 'frames received' in pcap.CaptureStats.format(values)
+
+    def test_merge_stats(self):
+        st1, st2 = pcap.CaptureStats(), pcap.CaptureStats()
+        st1.refresh(lambda: {'received': 3, 'dropped': 1, 'if_dropped': 0,
+                             'ring_fill': 0.25})
+        st2.refresh(lambda: {'received': 4, 'dropped': 0, 'if_dropped': 2,
+                             'ring_fill': None})
+        assert pcap.CaptureStats.merge([st1, st2]) == {
+            'received': 7, 'dropped': 1, 'if_dropped': 2, 'ring_fill': 0.25
+        }
+        # not due for a refresh yet
+        st1.refresh(lambda: {'received': 0})
+        assert st1.as_dict()['received'] == 3
+
+    def test_stop_interrupts_capture(self, engine):
+        w, r = channel.DequePipe()
+        thr, stop_evt, _ = pcap.start_capture('lo', None, w, engine)
+        time.sleep(0.1)
+        start = time.time()
+        stop_evt.set()
+        thr.join(2)
+        assert not thr.is_alive()
+        # much shorter than the idle timeout of a blocked capture thread
+        assert time.time() - start < pcap._IDLE_TIMEOUT / 2
+
+    def test_stop_event_selectable(self):
+        evt = pcap.StopEvent()
+        assert select.select([evt], [], [], 0)[0] == []
+        evt.set()
+        assert evt.is_set()
+        assert select.select([evt], [], [], 0)[0] == [evt]
+
+    def test_normalize_bpf(self):
+        assert pcap._normalize_bpf(None) == ''
+        assert pcap._normalize_bpf(' udp  and\tport 53 ') == 'udp and port 53'
+
+    def test_closed_consumer_dropped(self):
+        (w1, r1), (w2, r2) = channel.DequePipe(), channel.DequePipe()
+        fanout = pcap._FanOut([w1, w2])
+        r1.close()
+        fanout.send(b'frame')
+        assert r2.recv() == b'frame'
+        r2.close()
+        with pytest.raises(EOFError):
+            fanout.send(b'frame')
+
+
+class TestSendRawTraffic:
+    def test_batches(self, engine):
+        payloads = [b'pw-sendraw-%d' % i for i in range(3)]
+        frames = [b'\xff' * 6 + b'\x02\x00\x00\x00\x00\x01\x88\xb5' + p
+                  for p in payloads]
+        batches = collections.deque([
+            [frames[0], frame_batch.FrameBatch.pack(frames[1:])]
+        ])
+
+        def batch_receiver():
+            if len(batches) == 0:
+                raise EOFError()
+            return batches.popleft()
+
+        sock = af_packet.TPacketV3Socket('lo', block_size=1 << 16,
+                                         block_nr=4)
+        try:
+            t, stop_evt = pcap.send_raw_traffic('lo', None, None, engine,
+                                                batch_receiver)
+            t.join(2)
+            assert stop_evt.is_set()
+            seen = set()
+            deadline = time.time() + 2
+            while len(seen) < len(payloads) and time.time() < deadline:
+                seen |= {f[14:] for f in sock.read(0.05)
+                         if f[12:14] == b'\x88\xb5'}
+            assert seen == set(payloads)
+        finally:
+            sock.close()
+
+    def test_unbatch(self):
+        msgs = collections.deque([
+            [b'a', frame_batch.FrameBatch.pack([b'b', b'c'])], []
+        ])
+        receiver = pcap._unbatch(msgs.popleft)
+        assert [receiver() for _ in range(4)] == [b'a', b'b', b'c', None]
+
+
+class TestHeadersLength:
+    ETH = b'\x00' * 12
+
+    def test_ipv4_udp(self):
+        frame = (self.ETH + b'\x08\x00' + b'\x45' + b'\x00' * 8 + b'\x11'
+                 + b'\x00' * 10 + b'\x00' * 8 + b'payload')
+        assert pcap.headers_length(frame) == 14 + 20 + 8
+
+    def test_vlan_ipv4_tcp_options(self):
+        ip = b'\x46' + b'\x00' * 8 + b'\x06' + b'\x00' * 14
+        tcp = b'\x00' * 12 + b'\x80' + b'\x00' * 19
+        frame = (self.ETH + b'\x81\x00\x00\x01\x08\x00' + ip + tcp
+                 + b'payload')
+        assert pcap.headers_length(frame) == 18 + 24 + 32
+
+    def test_ipv6_extension_header(self):
+        # hop-by-hop options header followed by UDP
+        ip6 = b'\x60' + b'\x00' * 5 + b'\x00' + b'\x00' * 33
+        hbh = b'\x11\x00' + b'\x00' * 6
+        frame = (self.ETH + b'\x86\xdd' + ip6 + hbh + b'\x00' * 8
+                 + b'payload')
+        assert pcap.headers_length(frame) == 14 + 40 + 8 + 8
+
+    def test_unknown_ethertype(self):
+        assert pcap.headers_length(self.ETH + b'\x88\xb5' + b'data') == 14
+
+    def test_short_frame(self):
+        frame = self.ETH + b'\x08\x00\x45'
+        assert pcap.headers_length(frame) == len(frame)
+
+
+class TestFlowKey:
+    ETH = b'\x00' * 12
+    UDP = b'\x30\x39\x00\x35' + b'\x00' * 4
+
+    def ipv4(self, ident, proto=b'\x11'):
+        return (self.ETH + b'\x08\x00' + b'\x45\x00\x00\x40' + ident
+                + b'\x00' * 3 + proto + b'\x00' * 2 + b'\x0a\x00\x00\x01'
+                + b'\x0a\x00\x00\x02')
+
+    def test_ipv4_udp(self):
+        key = pcap.flow_key(self.ipv4(b'\x00\x01') + self.UDP)
+        assert key == (b'\x0a\x00\x00\x01', b'\x0a\x00\x00\x02', 12345,
+                       53, 17)
+        # the identification and checksums of the packets are ignored
+        assert pcap.flow_key(self.ipv4(b'\x00\x02') + self.UDP) == key
+
+    def test_vlan_ipv6_extension_header(self):
+        ip6 = (b'\x60' + b'\x00' * 5 + b'\x00\x40' + b'\x01' * 16
+               + b'\x02' * 16)
+        hbh = b'\x11\x00' + b'\x00' * 6
+        frame = (self.ETH + b'\x81\x00\x00\x01\x86\xdd' + ip6 + hbh
+                 + self.UDP)
+        assert pcap.flow_key(frame) == (b'\x01' * 16, b'\x02' * 16, 12345,
+                                        53, 17)
+
+    def test_no_ports(self):
+        key = pcap.flow_key(self.ipv4(b'\x00\x01', b'\x01') + b'\x08')
+        assert key[2:] == (0, 0, 1)
+
+    def test_not_ip(self):
+        assert pcap.flow_key(self.ETH + b'\x88\xb5' + b'data') is None
+        assert pcap.flow_key(self.ipv4(b'\x00\x01') + b'\x30') is None
@@ -0,0 +1,397 @@
+import os
+import socket
+import struct
+import time
+import pytest
+import packetweaver.libs.sys.pcap_file as pcap_file
+
+
+def write_pcap(path, records, order='<', magic=pcap_file.PCAP_MAGIC_US):
+    with open(path, 'wb') as f:
+        f.write(struct.pack(order + 'IHHiIII', magic, 2, 4, 0, 0, 65535, 1))
+        for sec, frac, data, wirelen in records:
+            f.write(struct.pack(order + 'IIII', sec, frac, len(data),
+                                wirelen))
+            f.write(data)
+
+
+def pcapng_block(order, btype, body):
+    body += b'\x00' * (-len(body) % 4)
+    blen = len(body) + 12
+    return (struct.pack(order + 'II', btype, blen) + body
+            + struct.pack(order + 'I', blen))
+
+
+def pcapng_section(order, interfaces, packets):
+    """ Builds a pcapng section
+
+    :param interfaces: list of if_tsresol option values, None for default
+    :param packets: list of (if_id, ts, data, wirelen)
+    """
+    out = pcapng_block(order, pcap_file.PCAPNG_SHB, struct.pack(
+        order + 'IHHq', pcap_file.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+    for tsresol in interfaces:
+        body = struct.pack(order + 'HHI', 1, 0, 0)
+        if tsresol is not None:
+            body += struct.pack(order + 'HH', 9, 1) + bytes([tsresol]) \
+                + b'\x00' * 3
+        body += struct.pack(order + 'HH', 0, 0)
+        out += pcapng_block(order, pcap_file.PCAPNG_IDB, body)
+    for if_id, ts, data, wirelen in packets:
+        out += pcapng_block(order, pcap_file.PCAPNG_EPB, struct.pack(
+            order + 'IIIII', if_id, ts >> 32, ts & 0xffffffff, len(data),
+            wirelen) + data)
+    return out
+
+
+class TestPcap:
+    RECORDS = [(10, 500, b'first', 5), (11, 0, b'second', 60)]
+
+    @pytest.mark.parametrize('order', ['<', '>'])
+    def test_byte_orders(self, tmp_path, order):
+        path = str(tmp_path / 'f.pcap')
+        write_pcap(path, self.RECORDS, order)
+        assert list(pcap_file.iter_pcap(path)) == [
+            (10000500000, 5, 5, b'first'),
+            (11000000000, 6, 60, b'second'),
+        ]
+
+    def test_nanoseconds(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        write_pcap(path, self.RECORDS, magic=pcap_file.PCAP_MAGIC_NS)
+        assert [r[0] for r in pcap_file.iter_pcap(path)] == [
+            10000000500, 11000000000]
+
+    def test_zero_copy(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        write_pcap(path, self.RECORDS)
+        with pcap_file.PcapReader(path) as reader:
+            assert reader.linktype == pcap_file.LINKTYPE_ETHERNET
+            data = [bytes(r[3]) for r in reader
+                    if isinstance(r[3], memoryview)]
+        assert data == [b'first', b'second']
+
+    def test_truncated_record(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        write_pcap(path, self.RECORDS)
+        with open(path, 'ab') as f:
+            f.write(struct.pack('<IIII', 12, 0, 100, 100) + b'short')
+        assert len(list(pcap_file.iter_pcap(path))) == 2
+
+    @pytest.mark.parametrize('content', [b'', b'\x00' * 24])
+    def test_not_pcap(self, tmp_path, content):
+        path = str(tmp_path / 'f.pcap')
+        with open(path, 'wb') as f:
+            f.write(content)
+        with pytest.raises(ValueError):
+            list(pcap_file.iter_pcap(path))
+
+
+class TestPcapng:
+    @pytest.mark.parametrize('order', ['<', '>'])
+    def test_enhanced_packets(self, tmp_path, order):
+        path = str(tmp_path / 'f.pcapng')
+        with open(path, 'wb') as f:
+            f.write(pcapng_section(order, [None, 9], [
+                (0, 1500000, b'usec', 4),
+                (1, 1500000000, b'nsec!', 70),
+            ]))
+        assert list(pcap_file.iter_pcap(path)) == [
+            (1500000000, 4, 4, b'usec'),
+            (1500000000, 5, 70, b'nsec!'),
+        ]
+
+    def test_binary_resolution(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        with open(path, 'wb') as f:
+            # 2^-10 s units
+            f.write(pcapng_section('<', [0x80 | 10], [(0, 3 * 1024, b'x', 1)]))
+        assert [r[0] for r in pcap_file.iter_pcap(path)] == [3000000000]
+
+    def test_sections(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        with open(path, 'wb') as f:
+            f.write(pcapng_section('<', [None], [(0, 1, b'a', 1)]))
+            f.write(pcapng_section('>', [None], [(0, 2, b'b', 1)]))
+        assert [(r[0], bytes(r[3])) for r in pcap_file.iter_pcap(path)] == [
+            (1000, b'a'), (2000, b'b')]
+
+    def test_truncated_block(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        data = pcapng_section('<', [None], [(0, 1, b'a', 1), (0, 2, b'b', 1)])
+        with open(path, 'wb') as f:
+            f.write(data[:-4])
+        assert len(list(pcap_file.iter_pcap(path))) == 1
+
+
+class TestPcapWriter:
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        with pcap_file.PcapWriter(path, nanoseconds=True) as writer:
+            writer.write(b'frame', 1500000000123, 60)
+            writer.write(memoryview(b'view'), 1500000001000)
+        assert list(pcap_file.iter_pcap(path)) == [
+            (1500000000123, 5, 60, b'frame'),
+            (1500000001000, 4, 4, b'view'),
+        ]
+
+    def test_microseconds(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        with pcap_file.PcapWriter(path) as writer:
+            writer.write(b'frame', 1500000000123)
+        assert [r[0] for r in pcap_file.iter_pcap(path)] == [1500000000000]
+
+    def test_default_timestamp(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        before = time.time()
+        with pcap_file.PcapWriter(path) as writer:
+            writer.write(b'frame')
+        ts_ns = next(pcap_file.iter_pcap(path))[0]
+        assert before - 1 < ts_ns / 1e9 < time.time() + 1
+
+    def test_snaplen(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        with pcap_file.PcapWriter(path, snaplen=4) as writer:
+            writer.write(b'truncated', 1000)
+        assert list(pcap_file.iter_pcap(path)) == [(1000, 4, 9, b'trun')]
+
+    def test_buffering(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        writer = pcap_file.PcapWriter(path, buffer_size=100,
+                                      flush_interval=3600)
+        try:
+            header_only = os.path.getsize(path)
+            writer.write(b'x' * 10, 1)
+            writer.tick()
+            assert os.path.getsize(path) == header_only
+            writer.write(b'x' * 100, 1)
+            assert os.path.getsize(path) == header_only + 2 * 16 + 110
+        finally:
+            writer.close()
+
+    def test_flush_interval(self, tmp_path):
+        path = str(tmp_path / 'f.pcap')
+        writer = pcap_file.PcapWriter(path, flush_interval=0)
+        try:
+            writer.write(b'frame', 1)
+            writer.tick()
+            assert len(list(pcap_file.iter_pcap(path))) == 1
+        finally:
+            writer.close()
+
+
+def pcapng_blocks(path):
+    """ Returns the (type, body) of the blocks of a little-endian pcapng
+    file
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    off = 0
+    while off < len(data):
+        btype, blen = struct.unpack_from('<II', data, off)
+        blocks.append((btype, data[off + 8:off + blen - 4]))
+        off += blen
+    return blocks
+
+
+class TestPcapngWriter:
+    def test_interfaces(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        lo = socket.if_nametoindex('lo')
+        with pcap_file.PcapWriter(path, pcapng=True) as writer:
+            writer.write(b'frame', 1500000000123, 60, lo)
+            writer.write(b'other', 1500000000456)
+            writer.write(b'again', 1500000000789, None, lo)
+        with pcap_file.PcapReader(path) as reader:
+            assert reader.pcapng
+            records = [(ts_ns, caplen, wirelen, bytes(data), itf.if_id,
+                        itf.name)
+                       for ts_ns, caplen, wirelen, data, itf
+                       in reader.records(True)]
+        assert records == [
+            (1500000000123, 5, 60, b'frame', 0, 'lo'),
+            (1500000000456, 5, 5, b'other', 1, None),
+            (1500000000789, 5, 5, b'again', 0, 'lo'),
+        ]
+
+    def test_foreign_interfaces(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        with pcap_file.PcapWriter(path, pcapng=True) as writer:
+            writer.write(b'a', 1000, None, -1, 'remote0')
+            writer.write(b'b', 1000, None, -2)
+            writer.write(b'c', 1000, None, -1, 'remote0')
+        with pcap_file.PcapReader(path) as reader:
+            interfaces = [(rec[4].if_id, rec[4].name)
+                          for rec in reader.records(True)]
+        assert interfaces == [(0, 'remote0'), (1, None), (0, 'remote0')]
+
+    def test_statistics(self, tmp_path):
+        path = str(tmp_path / 'f.pcapng')
+        with pcap_file.PcapWriter(path, pcapng=True) as writer:
+            writer.write(b'a', 1000, None, 1)
+            writer.write(b'b', 2000, None, 1)
+            writer.set_stats(1, 10, 3)
+        blocks = pcapng_blocks(path)
+        assert [b[0] for b in blocks] == [
+            pcap_file.PCAPNG_SHB, pcap_file.PCAPNG_IDB, pcap_file.PCAPNG_EPB,
+            pcap_file.PCAPNG_EPB, pcap_file.PCAPNG_ISB,
+        ]
+        body = blocks[-1][1]
+        assert struct.unpack_from('<I', body)[0] == 0
+        options = {}
+        off = 12
+        while True:
+            code, length = struct.unpack_from('<HH', body, off)
+            if code == pcap_file.PCAPNG_OPT_ENDOFOPT:
+                break
+            options[code] = body[off + 4:off + 4 + length]
+            off += 4 + length + (-length % 4)
+        assert options == {
+            pcap_file.PCAPNG_OPT_ISB_STARTTIME: struct.pack('<II', 0, 1000),
+            pcap_file.PCAPNG_OPT_ISB_ENDTIME: struct.pack('<II', 0, 2000),
+            pcap_file.PCAPNG_OPT_ISB_IFRECV: struct.pack('<Q', 10),
+            pcap_file.PCAPNG_OPT_ISB_IFDROP: struct.pack('<Q', 3),
+            pcap_file.PCAPNG_OPT_ISB_USRDELIV: struct.pack('<Q', 2),
+        }
+
+
+class TestRotatingPcapWriter:
+    def read_all(self, paths):
+        return [bytes(r[3]) for p in paths for r in pcap_file.iter_pcap(p)]
+
+    def test_max_packets(self, tmp_path):
+        template = str(tmp_path / 'cap.pcap')
+        writer = pcap_file.RotatingPcapWriter(template, max_packets=2)
+        frames = [b'frame%d' % i for i in range(5)]
+        for frame in frames:
+            writer.write(frame, 1000)
+        writer.close()
+        assert writer.files == [str(tmp_path / 'cap-{}.pcap'.format(i))
+                                for i in (1, 2, 3)]
+        assert self.read_all(writer.files) == frames
+
+    def test_max_bytes(self, tmp_path):
+        template = str(tmp_path / 'cap-{index}.pcap')
+        # header and two 16 + 84-byte records
+        writer = pcap_file.RotatingPcapWriter(template, max_bytes=224)
+        for _ in range(5):
+            writer.write(b'x' * 84, 1000)
+        writer.close()
+        assert [os.path.getsize(p) for p in writer.files] == [224, 224, 124]
+
+    def test_max_seconds(self, tmp_path):
+        template = str(tmp_path / 'cap-{index}.pcap')
+        writer = pcap_file.RotatingPcapWriter(template, max_seconds=0.05)
+        writer.write(b'first', 1000)
+        time.sleep(0.1)
+        writer.tick()
+        writer.write(b'second', 1000)
+        writer.close()
+        assert len(writer.files) == 2
+        assert self.read_all(writer.files) == [b'first', b'second']
+
+    @pytest.mark.parametrize('compress', sorted(pcap_file.COMPRESSORS))
+    def test_compress(self, tmp_path, compress):
+        template = str(tmp_path / 'cap.pcap')
+        writer = pcap_file.RotatingPcapWriter(template, max_packets=1,
+                                              compress=compress)
+        writer.write(b'a', 1000)
+        writer.write(b'b', 1000)
+        writer.close()
+        open_func, suffix = pcap_file.COMPRESSORS[compress]
+        assert len(writer.files) == 2
+        data = []
+        for path in writer.files:
+            assert path.endswith(suffix)
+            assert not os.path.exists(path[:-len(suffix)])
+            with open_func(path, 'rb') as f:
+                data.append(f.read()[-1:])
+        assert data == [b'a', b'b']
+
+    def test_no_rotation(self, tmp_path):
+        path = str(tmp_path / 'cap.pcap')
+        with pcap_file.RotatingPcapWriter(path) as writer:
+            writer.write(b'frame', 1000)
+        assert writer.files == [path]
+        assert self.read_all([path]) == [b'frame']
+
+    def test_pcapng(self, tmp_path):
+        template = str(tmp_path / 'cap.pcapng')
+        writer = pcap_file.RotatingPcapWriter(template, max_packets=1,
+                                              pcapng=True)
+        writer.write(b'a', 1000, None, 1)
+        writer.write(b'b', 1000, None, 2)
+        writer.write(b'c', 1000, None, 1)
+        writer.close()
+        assert len(writer.files) == 3
+        assert self.read_all(writer.files) == [b'a', b'b', b'c']
+        # interfaces seen in previous files are described again, with the
+        # same identifier
+        ids = []
+        for path in writer.files:
+            with pcap_file.PcapReader(path) as reader:
+                ids += [rec[4].if_id for rec in reader.records(True)]
+            assert pcapng_blocks(path)[-1][0] == pcap_file.PCAPNG_ISB
+        assert ids == [0, 1, 0]
+
+    def test_literal_path(self, tmp_path):
+        path = str(tmp_path / 'cap-{x}-%d.pcap')
+        with pcap_file.RotatingPcapWriter(path) as writer:
+            writer.write(b'frame', 1000)
+        assert writer.files == [path]
+        assert self.read_all([path]) == [b'frame']
+
+    def test_full_queue(self, tmp_path):
+        template = str(tmp_path / 'cap.pcap')
+        writer = pcap_file.RotatingPcapWriter(template, max_packets=1,
+                                              queue_size=1, buffer_size=1)
+        # the writer thread is deemed late: no buffer fits in the queue,
+        # but new files are still started without waiting
+        writer._slots.acquire()
+        try:
+            for _ in range(3):
+                writer.write(b'frame', 1000)
+        finally:
+            writer._slots.release()
+            writer.close()
+        assert writer.dropped == 3
+        assert len(writer.files) == 3
+        assert self.read_all(writer.files) == []
+
+    def test_pcapng_full_queue(self, tmp_path):
+        path = str(tmp_path / 'cap.pcapng')
+        lo = socket.if_nametoindex('lo')
+        writer = pcap_file.RotatingPcapWriter(path, queue_size=1,
+                                              buffer_size=1, pcapng=True)
+        writer._slots.acquire()
+        try:
+            writer.write(b'dropped', 1000, None, lo)
+            writer._slots.release()
+            writer.write(b'kept', 2000, None, lo)
+        finally:
+            writer.close()
+        assert writer.dropped == 1
+        with pcap_file.PcapReader(path) as reader:
+            records = [(bytes(rec[3]), rec[4].name)
+                       for rec in reader.records(True)]
+        # the IDB of the dropped record was still written
+        assert records == [(b'kept', 'lo')]
+        assert pcapng_blocks(path)[-1][0] == pcap_file.PCAPNG_ISB
+
+    def test_unknown_compressor(self, tmp_path):
+        with pytest.raises(ValueError):
+            pcap_file.RotatingPcapWriter(str(tmp_path / 'cap.pcap'),
+                                         compress='zip')
+
+    def test_write_error(self, tmp_path):
+        template = str(tmp_path / 'missing' / 'cap.pcap')
+        writer = pcap_file.RotatingPcapWriter(template, buffer_size=1)
+        try:
+            with pytest.raises(IOError):
+                # the writer thread fails to open the file in the background
+                for _ in range(100):
+                    writer.write(b'frame', 1000)
+                    time.sleep(0.01)
+        finally:
+            writer.close()